@@ -0,0 +1,189 @@
+"""
+执行器开关状态的游程编码时间线
+
+integral_data 每分钟为约 40 个执行器各记录一个 True/False, 回答 "上周 CO2 阀什么时候开过"
+需要扫描全部行。这里把每个执行器压缩成按时间排序、互不重叠的开启区间 [start, end):
+    - 一行的状态持续到下一行的时间; 两行间隔超过 MAX_GAP 视为数据缺失, 状态只持续 SAMPLE_PERIOD
+    - CO2 记录的是阀门开度, 大于 0 即为开启
+    - 新行到达时只编码新行, 与最后一个区间首尾相接时合并
+查询都是在区间数组上二分查找:
+    state_at      某时刻的状态
+    intervals     与时间范围重叠的区间 (裁剪到范围内)
+    on_time       范围内的累计开启时长 (前缀和, 与区间个数无关; cumulative_on_time 可一次计算多个时刻)
+    switch_count  范围内的开启次数
+后台同步线程调用 update 时页面会话可能正在查询: update 在 lock 内进行, 区间数组只整体替换、不原地修改,
+查询在 lock 内取出一个执行器的 (starts, ends, 前缀和), 之后在这份快照上计算, 不会读到只更新了一半的区间。
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data_schema import row_time_column
+
+SAMPLE_PERIOD = pd.Timedelta(minutes=1)
+MAX_GAP = pd.Timedelta(minutes=5)
+
+
+def _ns(value):
+    return pd.Timestamp(value).value
+
+
+def encode(times, states, period=SAMPLE_PERIOD, max_gap=MAX_GAP):
+    """
+    把按时间排序的一列状态编码为开启区间, times 为 int64 纳秒, 返回 (starts, ends)。
+    """
+    times = np.asarray(times, dtype=np.int64)
+    states = np.asarray(states, dtype=bool)
+    if not len(times):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    gap = np.diff(times) > pd.Timedelta(max_gap).value
+    # 每一行状态的结束时间: 下一行的时间, 遇到缺口或最后一行时只持续一个采样周期
+    row_end = np.append(times[1:], times[-1])
+    broken = np.append(gap, True)
+    row_end[broken] = times[broken] + pd.Timedelta(period).value
+    previous_on = np.concatenate([[False], states[:-1] & ~gap])
+    next_on = np.concatenate([states[1:] & ~gap, [False]])
+    starts = times[states & ~previous_on]
+    ends = row_end[states & ~next_on]
+    return starts, ends
+
+
+class ActuatorTimeline:
+    def __init__(self, columns, period=SAMPLE_PERIOD, max_gap=MAX_GAP):
+        self.columns = list(columns)
+        self.period = pd.Timedelta(period)
+        self.max_gap = pd.Timedelta(max_gap)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.starts = {col: np.empty(0, dtype=np.int64) for col in self.columns}
+            self.ends = {col: np.empty(0, dtype=np.int64) for col in self.columns}
+            self._cumulative = {}
+            self.last_time = None   # 已编码的最后一行时间
+            self.last_state = None  # 最后一行各执行器的状态
+
+    @classmethod
+    def from_frame(cls, frame, columns, **kwargs):
+        timeline = cls([col for col in columns if col in frame.columns], **kwargs)
+        timeline.update(frame)
+        return timeline
+
+    def update(self, new_rows):
+        """追加新行; 不晚于已编码最后一行的记录被忽略"""
+        if new_rows is None or new_rows.empty:
+            return
+        with self.lock:
+            self._update(new_rows)
+
+    def _update(self, new_rows):
+        time_column = row_time_column(new_rows)
+        frame = new_rows.sort_values(time_column, kind='stable')
+        times = pd.to_datetime(frame[time_column]).to_numpy(dtype='datetime64[ns]').view(np.int64)
+        keep = times > self.last_time if self.last_time is not None else np.ones(len(times), dtype=bool)
+        if not keep.any():
+            return
+        times = times[keep]
+        previous_time = self.last_time
+        if previous_time is not None:
+            # 带上上一批的最后一行, 这样它的结束时间和与新行的衔接都能正确计算
+            times = np.concatenate([[previous_time], times])
+        last_state = {}
+        for col in self.columns:
+            if col in frame.columns:
+                states = frame[col].to_numpy()[keep].astype(np.float64) > 0
+            else:
+                states = np.zeros(int(keep.sum()), dtype=bool)
+            if previous_time is not None:
+                states = np.concatenate([[self.last_state[col]], states])
+            starts, ends = encode(times, states, self.period, self.max_gap)
+            old_ends = self.ends[col]
+            if previous_time is not None and len(self.starts[col]) and len(starts) and starts[0] == previous_time:
+                # 上一批最后一行是开启状态: 同一个开启区间, 延长原来的最后一个区间 (不修改查询可能正在用的旧数组)
+                old_ends = np.append(old_ends[:-1], ends[0])
+                starts, ends = starts[1:], ends[1:]
+            self.starts[col] = np.concatenate([self.starts[col], starts])
+            self.ends[col] = np.concatenate([old_ends, ends])
+            last_state[col] = bool(states[-1])
+        self.last_time = int(times[-1])
+        self.last_state = last_state
+        self._cumulative = {}
+
+    def snapshot(self, column):
+        """一个执行器的 (starts, ends, 累计开启时长前缀和), 三者来自同一次更新"""
+        with self.lock:
+            starts, ends = self.starts[column], self.ends[column]
+            if column not in self._cumulative:
+                self._cumulative[column] = np.concatenate([[0], np.cumsum(ends - starts)])
+            return starts, ends, self._cumulative[column]
+
+    @staticmethod
+    def _overlap(starts, ends, start, end):
+        """与 [start, end) 重叠的区间的下标范围"""
+        first = int(np.searchsorted(ends, start, side='right'))
+        last = int(np.searchsorted(starts, end, side='left'))
+        return first, max(first, last)
+
+    def state_at(self, column, when):
+        when = _ns(when)
+        starts, ends, _ = self.snapshot(column)
+        i = int(np.searchsorted(starts, when, side='right')) - 1
+        return i >= 0 and ends[i] > when
+
+    def states_at(self, when):
+        return pd.Series({col: self.state_at(col, when) for col in self.columns})
+
+    def intervals(self, column, start, end):
+        """与 [start, end) 重叠的开启区间, 裁剪到范围内"""
+        start, end = _ns(start), _ns(end)
+        starts, ends, _ = self.snapshot(column)
+        first, last = self._overlap(starts, ends, start, end)
+        starts = np.maximum(starts[first:last], start)
+        ends = np.minimum(ends[first:last], end)
+        return pd.DataFrame({'start': pd.to_datetime(starts), 'end': pd.to_datetime(ends)})
+
+    def cumulative_on_time(self, column, times):
+        """每个时刻之前的累计开启时长 (纳秒), times 可以是数组, 向量化计算"""
+        times = np.asarray(pd.to_datetime(times).to_numpy(dtype='datetime64[ns]').view(np.int64))
+        starts, ends, cumulative = self.snapshot(column)
+        i = np.searchsorted(starts, times, side='right')
+        total = cumulative[i]
+        # 包含该时刻的区间只计到该时刻为止
+        inside = i > 0
+        overshoot = np.zeros(len(times), dtype=np.int64)
+        overshoot[inside] = np.maximum(ends[i[inside] - 1] - times[inside], 0)
+        return total - overshoot
+
+    def on_time(self, column, start, end):
+        """[start, end) 内的累计开启时长"""
+        before = self.cumulative_on_time(column, [pd.Timestamp(start), pd.Timestamp(end)])
+        return pd.Timedelta(int(before[1] - before[0]))
+
+    def switch_count(self, column, start, end):
+        """[start, end) 内由关到开的次数"""
+        starts, _, _ = self.snapshot(column)
+        return int(np.searchsorted(starts, _ns(end), side='left') - np.searchsorted(starts, _ns(start), side='left'))
+
+    def summary(self, start, end, columns=None):
+        """每个执行器在范围内的开启时长 (小时)、占空比和开启次数"""
+        columns = self.columns if columns is None else columns
+        span = (pd.Timestamp(end) - pd.Timestamp(start)) / pd.Timedelta(hours=1)
+        hours = [self.on_time(col, start, end) / pd.Timedelta(hours=1) for col in columns]
+        return pd.DataFrame({
+            'on_hours': hours,
+            'duty_cycle': [h / span if span > 0 else np.nan for h in hours],
+            'switches': [self.switch_count(col, start, end) for col in columns],
+        }, index=columns)
+
+    def gantt(self, start, end, columns=None):
+        """甘特图用的长表: 每个开启区间一行 (Task / Start / Finish)"""
+        columns = self.columns if columns is None else columns
+        frames = []
+        for col in columns:
+            intervals = self.intervals(col, start, end)
+            frames.append(pd.DataFrame({'Task': col, 'Start': intervals['start'], 'Finish': intervals['end']}))
+        if not frames:
+            return pd.DataFrame(columns=['Task', 'Start', 'Finish'])
+        return pd.concat(frames, ignore_index=True)
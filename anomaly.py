@@ -0,0 +1,330 @@
+"""
+传感器读数的流式异常检测
+
+原来只有即时反馈面板里写死的 pH 5-7 警告。这里为每个传感器列保存少量滚动状态,
+每来一行只做一次与传感器个数成正比的 numpy 运算:
+    EWMA 均值/方差   |x - 均值| / 标准差 超过 EWMA_Z 记为 'ewma'
+    稳健中位数/MAD    偏离中位数超过 MAD_Z 个 MAD (换算为标准差) 记为 'mad'
+    变化率            相邻两次有效读数每分钟的变化超过 RATE_LIMITS 记为 'rate'
+空值和 -1 无效值不更新状态也不打分; 每列前 WARMUP 个有效值只用于建立状态。
+离群值截断到未截断 EWMA 均值上下 CLIP_Z 个标准差后再更新打分用的 EWMA, 避免一个尖峰把均值和方差拉偏
+(截断范围来自另一组不截断的 EWMA, 所以整段历史可以向量化计算)。
+中位数/MAD 按有效读数的个数刷新: 前 MAD_WINDOW 个读数每个都用之前的全部读数计算,
+之后每 MAD_STRIDE 个读数用之前 MAD_WINDOW 个读数计算一次, 中间沿用上一次的结果。
+同一传感器连续超限只在开始超限的那一行记一次事件。
+
+逐行和整段回放是同一套定义的两种实现, 得到相同的事件 (tests/test_anomaly.py 检查):
+    update   后台同步送入新行, 逐行调用 step; 每列保存最近 MAD_WINDOW 个有效读数用于刷新中位数/MAD。
+             只处理比已处理的最新读数更晚的行, 重复送入或迟到的行直接跳过
+    replay   第一次启动或 CSV 被重写时对整段历史按列向量化计算 (pandas ewm 与 step 的递推公式相同,
+             中位数/MAD 在刷新点上一次算出), 结束时的状态供之后的 update 继续使用
+             (logs/integral_data.csv 的 8029 行: update 约 2 秒, replay 约 0.2 秒)
+状态随事件表一起保存, 重启时直接读取。
+标记出的事件保存在 events 表中 (time / column / kind / value / score), 只保留最近 MAX_EVENTS 条。
+"""
+import json
+import posixpath
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data_schema import SENTINEL, row_time_column
+
+EWMA_ALPHA = 0.05
+EWMA_Z = 4.0
+MAD_Z = 5.0
+CLIP_Z = 3.0
+WARMUP = 30
+# 计算中位数/MAD 的窗口和刷新间隔 (有效读数个数)
+MAD_WINDOW = 240
+MAD_STRIDE = 40
+# 超过这个间隔的两次读数不检查变化率
+MAX_RATE_GAP_MINUTES = 10
+MAX_EVENTS = 10000
+ANOMALY_DIR = "_anomalies"
+
+# 每分钟允许的最大变化
+RATE_LIMITS = {
+    'Temperature': 2.0, 'Humidity': 10.0, 'CO2PPM': 300.0, 'pH': 0.5, 'WTEMP': 2.0, 'EC': 0.5, 'Wlevel': 50.0,
+}
+# 传感器的分辨率, 作为标准差和 MAD 的下限, 读数长时间不变时不会因为最小的跳动报警
+MIN_SCALE = {
+    'CO2PPM': 5.0, 'CO2PPM1': 5.0, 'CO2PPM2': 5.0, 'CO2PPM3': 5.0, 'CO2PPM4': 5.0,
+    'pH': 0.05, 'EC': 0.05, 'Wlevel': 1.0,
+}
+DEFAULT_MIN_SCALE = 0.1
+KINDS = ['ewma', 'mad', 'rate']
+EVENT_COLUMNS = ['time', 'column', 'kind', 'value', 'score']
+STATE_FIELDS = ('count', 'raw_mean', 'raw_var', 'mean', 'var', 'median', 'mad', 'window',
+                'last_value', 'last_time', 'active')
+
+
+def _empty_events():
+    return pd.DataFrame({'time': pd.Series(dtype='datetime64[ns]'), 'column': pd.Series(dtype=object),
+                         'kind': pd.Series(dtype=object), 'value': pd.Series(dtype=np.float64),
+                         'score': pd.Series(dtype=np.float64)})
+
+
+def _refresh_due(count, window=MAD_WINDOW, stride=MAD_STRIDE):
+    """已有 count 个有效读数时, 下一个读数之前是否重新计算中位数/MAD"""
+    return (count >= 1) & ((count <= window) | ((count - window) % stride == 0))
+
+
+def _window_median(x, window=MAD_WINDOW, stride=MAD_STRIDE):
+    """
+    replay 用: 每个读数打分时的中位数和 MAD (定义见模块说明)。
+    第一个读数之前没有数据, 中位数取它自己、MAD 为 0 (还在 WARMUP 内, 不打分)。
+    """
+    n = len(x)
+    median = np.empty(n)
+    mad = np.empty(n)
+    median[0], mad[0] = x[0], 0.0
+    head = min(n, window + 1)
+    if head > 1:
+        # 第 j 个读数 (1 <= j <= window) 用之前全部 j 个读数, 下三角之外填 NaN
+        prefix = np.where(np.tri(head - 1, dtype=bool), x[:head - 1][None, :], np.nan)
+        median[1:head] = np.nanmedian(prefix, axis=1)
+        mad[1:head] = np.nanmedian(np.abs(prefix - median[1:head, None]), axis=1)
+    if n > window + 1:
+        # 第 k 个窗口是 x[k*stride : k*stride+window], 用于之后的 stride 个读数
+        windows = np.lib.stride_tricks.sliding_window_view(x[:-1], window)[::stride]
+        window_median = np.median(windows, axis=1)
+        window_mad = np.median(np.abs(windows - window_median[:, None]), axis=1)
+        median[window + 1:] = np.repeat(window_median, stride)[1:n - window]
+        mad[window + 1:] = np.repeat(window_mad, stride)[1:n - window]
+    return median, mad
+
+
+def _ewm_step(mean, var, x, valid, alpha):
+    """EWMA 均值/方差的一步递推 (与 pandas ewm(adjust=False) 的 mean / var(bias=True) 相同)"""
+    delta = x - mean
+    mean = np.where(valid, mean + alpha * delta, mean)
+    var = np.where(valid, (1 - alpha) * (var + alpha * delta * delta), var)
+    return mean, var
+
+
+class AnomalyDetector:
+    def __init__(self, columns, alpha=EWMA_ALPHA):
+        self.columns = list(columns)
+        self.alpha = alpha
+        self.rate_limits = np.array([RATE_LIMITS.get(col, np.inf) for col in self.columns])
+        self.min_scale = np.array([MIN_SCALE.get(col, DEFAULT_MIN_SCALE) for col in self.columns])
+        self.reset()
+
+    def reset(self):
+        size = len(self.columns)
+        self.count = np.zeros(size, dtype=np.int64)
+        self.raw_mean = np.zeros(size)   # 不截断的 EWMA, 只用来确定截断范围
+        self.raw_var = np.zeros(size)
+        self.mean = np.zeros(size)
+        self.var = np.zeros(size)
+        self.median = np.zeros(size)
+        self.mad = np.zeros(size)
+        self.window = np.zeros((size, MAD_WINDOW))   # 最近 MAD_WINDOW 个有效读数, 第 count 个写在 count % MAD_WINDOW
+        self.last_value = np.zeros(size)
+        self.last_time = np.full(size, -np.inf)   # 分钟
+        self.active = np.zeros((size, len(KINDS)), dtype=bool)
+        self.events = _empty_events()
+
+    def _refresh(self, valid):
+        for i in np.flatnonzero(valid & _refresh_due(self.count)):
+            recent = self.window[i, :min(self.count[i], MAD_WINDOW)]
+            self.median[i] = np.median(recent)
+            self.mad[i] = np.median(np.abs(recent - self.median[i]))
+
+    def step(self, minute, values):
+        """处理一行: minute 为时间 (分钟), values 为各传感器读数; 返回 [(传感器下标, 类型, 分数), ...]"""
+        valid = (values == values) & (values != SENTINEL)
+        # 无效读数用当前均值代替参与运算, 之后不更新它的状态, 这样运算中不会出现 NaN
+        x = np.where(valid, values, self.mean)
+        self._refresh(valid)
+        ready = valid & (self.count >= WARMUP)
+        std = np.fmax(np.sqrt(self.var), self.min_scale)
+        scale = np.fmax(1.4826 * self.mad, self.min_scale)
+        z_ewma = np.abs(x - self.mean) / std
+        z_mad = np.abs(x - self.median) / scale
+        elapsed = minute - self.last_time
+        rate = np.abs(x - self.last_value) / np.fmax(elapsed, 1.0)
+        masks = (ready & (z_ewma > EWMA_Z),
+                 ready & (z_mad > MAD_Z),
+                 valid & (elapsed <= MAX_RATE_GAP_MINUTES) & (rate > self.rate_limits))
+        flagged = []
+        for k, (mask, score) in enumerate(zip(masks, (z_ewma, z_mad, rate))):
+            # 连续超限只在开始时记一次事件, 无效读数不改变超限状态
+            new = mask & ~self.active[:, k]
+            if new.any():
+                flagged.extend((i, KINDS[k], float(score[i])) for i in np.flatnonzero(new))
+            self.active[valid, k] = mask[valid]
+        if not valid.any():
+            return flagged
+
+        # 更新状态: 打分用的 EWMA 只接收截断到未截断 EWMA 上下 CLIP_Z 个标准差以内的值
+        limit = CLIP_Z * np.fmax(np.sqrt(self.raw_var), self.min_scale)
+        clipped = np.where(ready, np.clip(x, self.raw_mean - limit, self.raw_mean + limit), x)
+        self.raw_mean, self.raw_var = _ewm_step(self.raw_mean, self.raw_var, x, valid, self.alpha)
+        self.mean, self.var = _ewm_step(self.mean, self.var, clipped, valid, self.alpha)
+        first = valid & (self.count == 0)
+        self.raw_mean[first] = self.mean[first] = x[first]
+        self.raw_var[first] = self.var[first] = 0.0
+        self.median[first] = x[first]
+        self.mad[first] = 0.0
+        rows = np.flatnonzero(valid)
+        self.window[rows, self.count[rows] % MAD_WINDOW] = x[rows]
+        self.last_value[valid] = x[valid]
+        self.last_time[valid] = minute
+        self.count += valid
+        return flagged
+
+    def _arrays(self, new_rows):
+        """按时间排序, 返回 (时间, 分钟, 各传感器读数矩阵); 没有可处理的列时返回 None"""
+        if new_rows.empty or not any(col in new_rows.columns for col in self.columns):
+            return None
+        time_column = row_time_column(new_rows)
+        frame = new_rows.sort_values(time_column, kind='stable')
+        times = pd.to_datetime(frame[time_column]).to_numpy(dtype='datetime64[ns]')
+        minutes = times.view(np.int64) / 60e9
+        values = np.full((len(frame), len(self.columns)), np.nan)
+        for i, col in enumerate(self.columns):
+            if col in frame.columns:
+                values[:, i] = frame[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        return times, minutes, values
+
+    def _record(self, records):
+        if not records:
+            return _empty_events()
+        events = pd.DataFrame.from_records(records, columns=EVENT_COLUMNS)
+        combined = events if self.events.empty else pd.concat([self.events, events], ignore_index=True)
+        self.events = combined.tail(MAX_EVENTS).reset_index(drop=True)
+        return events
+
+    def update(self, new_rows):
+        """送入一批新行 (按时间排序后逐行打分), 返回这批行里标记出的事件; 不晚于已处理读数的行跳过"""
+        arrays = self._arrays(new_rows)
+        if arrays is None:
+            return _empty_events()
+        times, minutes, values = arrays
+        newer = minutes > self.last_time.max()
+        times, minutes, values = times[newer], minutes[newer], values[newer]
+
+        records = []
+        for row in range(len(minutes)):
+            for i, kind, score in self.step(minutes[row], values[row]):
+                records.append((times[row], self.columns[i], kind, values[row, i], score))
+        return self._record(records)
+
+    def replay(self, history):
+        """从头对整段历史按列向量化打分, 返回全部事件 (与逐行 update 相同); 结束时的状态供之后的 update 使用"""
+        self.reset()
+        arrays = self._arrays(history)
+        if arrays is None:
+            return _empty_events()
+        times, minutes, values = arrays
+        records = []
+        for i in range(len(self.columns)):
+            column = values[:, i]
+            rows = np.flatnonzero((column == column) & (column != SENTINEL))
+            if not len(rows):
+                continue
+            x = column[rows]
+            t = minutes[rows]
+            floor = self.min_scale[i]
+            ready = np.arange(len(x)) >= WARMUP
+
+            # 每个读数与它到来之前的状态比较: 状态数组向后错一位, 第一个读数之前的状态取它自己
+            raw = pd.Series(x).ewm(alpha=self.alpha, adjust=False)
+            raw_mean = raw.mean().to_numpy()
+            raw_var = raw.var(bias=True).fillna(0.0).to_numpy()
+            limit = CLIP_Z * np.fmax(np.sqrt(np.concatenate([[0.0], raw_var[:-1]])), floor)
+            prev_raw_mean = np.concatenate([[x[0]], raw_mean[:-1]])
+            clipped = np.where(ready, np.clip(x, prev_raw_mean - limit, prev_raw_mean + limit), x)
+            ewm = pd.Series(clipped).ewm(alpha=self.alpha, adjust=False)
+            mean = ewm.mean().to_numpy()
+            var = ewm.var(bias=True).fillna(0.0).to_numpy()
+            prev_mean = np.concatenate([[x[0]], mean[:-1]])
+            prev_var = np.concatenate([[0.0], var[:-1]])
+            median, mad = _window_median(x)
+
+            z_ewma = np.abs(x - prev_mean) / np.fmax(np.sqrt(prev_var), floor)
+            z_mad = np.abs(x - median) / np.fmax(1.4826 * mad, floor)
+            elapsed = np.diff(t, prepend=-np.inf)
+            rate = np.abs(np.diff(x, prepend=x[0])) / np.fmax(elapsed, 1.0)
+            masks = (ready & (z_ewma > EWMA_Z),
+                     ready & (z_mad > MAD_Z),
+                     (elapsed <= MAX_RATE_GAP_MINUTES) & (rate > self.rate_limits[i]))
+            for k, (mask, score) in enumerate(zip(masks, (z_ewma, z_mad, rate))):
+                # 连续超限只在开始时记一次事件
+                for j in np.flatnonzero(mask & ~np.concatenate([[False], mask[:-1]])):
+                    records.append((rows[j], k, i, times[rows[j]], self.columns[i], KINDS[k], x[j], float(score[j])))
+                self.active[i, k] = mask[-1]
+
+            n = len(x)
+            self.count[i] = n
+            self.raw_mean[i], self.raw_var[i] = raw_mean[-1], raw_var[-1]
+            self.mean[i], self.var[i] = mean[-1], var[-1]
+            # 最后一个读数打分时用的中位数/MAD; 下一个读数是刷新点时 step 会用 window 重新计算
+            self.median[i], self.mad[i] = (x[0], 0.0) if n == 1 else (median[-1], mad[-1])
+            recent = np.arange(max(0, n - MAD_WINDOW), n)
+            self.window[i, recent % MAD_WINDOW] = x[recent]
+            self.last_value[i] = x[-1]
+            self.last_time[i] = t[-1]
+        # 与逐行处理的顺序一致: 按行, 同一行内按类型, 再按列
+        records.sort(key=lambda record: record[:3])
+        return self._record([record[3:] for record in records])
+
+    def recent_events(self, since=None, columns=None, kinds=None):
+        events = self.events
+        if since is not None:
+            events = events[events['time'] >= pd.Timestamp(since)]
+        if columns is not None:
+            events = events[events['column'].isin(columns)]
+        if kinds is not None:
+            events = events[events['kind'].isin(kinds)]
+        return events
+
+    def state(self):
+        """各传感器当前的滚动状态, 用于显示"""
+        return pd.DataFrame({
+            'count': self.count, 'ewma_mean': self.mean, 'ewma_std': np.sqrt(self.var),
+            'median': self.median, 'mad': self.mad, 'last_value': self.last_value,
+        }, index=self.columns)
+
+    def save(self, fs, root, tag):
+        """事件表写入 Parquet, 滚动状态和 tag 写在元数据中 (tag 的用法与 RollupEngine 相同)"""
+        state = {name: getattr(self, name).tolist() for name in STATE_FIELDS}
+        state['columns'] = self.columns
+        table = pa.Table.from_pandas(self.events, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                               b'tag': str(tag).encode(),
+                                               b'state': json.dumps(state).encode()})
+        path = posixpath.join(root, ANOMALY_DIR, "events.parquet")
+        fs.makedirs(posixpath.dirname(path), exist_ok=True)
+        with fs.open(path, 'wb') as f:
+            pq.write_table(table, f, compression='zstd')
+
+    def load(self, fs, root, tag):
+        """读取保存的状态和事件, 文件缺失、tag 或列不一致时返回 False, 调用方应重新回放"""
+        path = posixpath.join(root, ANOMALY_DIR, "events.parquet")
+        if not fs.exists(path):
+            return False
+        with fs.open(path, 'rb') as f:
+            table = pq.read_table(f)
+        metadata = table.schema.metadata or {}
+        if metadata.get(b'tag') != str(tag).encode():
+            return False
+        state = json.loads(metadata[b'state'])
+        # 列或状态的组成变了 (旧版本保存的状态) 都重新回放
+        if state.pop('columns') != self.columns or set(state) != set(STATE_FIELDS):
+            return False
+        for name, values in state.items():
+            setattr(self, name, np.array(values, dtype=getattr(self, name).dtype))
+        self.events = table.to_pandas()
+        return True
+
+
+def score_history(frame, columns):
+    """批量模式: 对整段历史向量化回放, 返回全部事件和回放后的检测器 (可继续 update 新行)"""
+    detector = AnomalyDetector(columns)
+    events = detector.replay(frame)
+    return events, detector
@@ -0,0 +1,214 @@
+"""
+传感器流与执行器流的流式 as-of 合并
+
+integral_data 由两路各自带时间戳的记录合并而来:
+    传感器读数  DateTime_x + Temperature / Humidity / ...
+    执行器状态  DateTime_y + Acondition / FreshAir / ...
+原来按分钟键 DateTime 离线合并, 会丢失记录, 而且每次都要整体重做。
+这里对每一条传感器记录, 取容差范围内最近的一条执行器记录 (默认取不晚于它的最后一条),
+输出与 integral_data 相同的列, 其中 DateTime 仍然是 DateTime_x 所在的分钟。
+
+记录到达顺序可以乱: 只有当执行器流的水位线 (见到的最大时间减去允许的迟到时间)
+越过某条传感器记录后才输出它; 迟到的执行器记录会让最近已经输出、可能受影响的行重新输出一次
+(下游按 DateTime_x 去重, 以后输出的为准)。比各自水位线晚超过迟到时间的记录会被丢弃并计数。
+缓冲区只保留迟到窗口内的记录, 内存与历史长度无关
+(第一条传感器记录到达之前, 执行器记录全部保留)。
+
+用法 (分块读取两份原始 CSV, 增量合并后写入分区存储):
+    python asof_join.py sensor.csv actuator.csv ./integral_store
+"""
+import sys
+
+import pandas as pd
+
+SENSOR_TIME = 'DateTime_x'
+ACTUATOR_TIME = 'DateTime_y'
+KEY_COLUMN = 'DateTime'
+
+DEFAULT_TOLERANCE = pd.Timedelta(minutes=2)
+DEFAULT_LATENESS = pd.Timedelta(minutes=5)
+
+
+def asof_merge(sensor, actuator, tolerance=DEFAULT_TOLERANCE, direction='backward'):
+    """一次性合并两段已排序或未排序的记录, 输出 integral_data 格式"""
+    sensor = sensor.sort_values(SENSOR_TIME, kind='stable')
+    actuator = actuator.sort_values(ACTUATOR_TIME, kind='stable')
+    merged = pd.merge_asof(sensor, actuator, left_on=SENSOR_TIME, right_on=ACTUATOR_TIME,
+                           direction=direction, tolerance=tolerance)
+    merged[KEY_COLUMN] = merged[SENSOR_TIME].dt.floor('min')
+    return merged.reset_index(drop=True)
+
+
+class AsOfJoiner:
+    def __init__(self, tolerance=DEFAULT_TOLERANCE, lateness=DEFAULT_LATENESS, direction='backward'):
+        if direction not in ('backward', 'nearest'):
+            raise ValueError(f"不支持的合并方向: {direction}")
+        self.tolerance = pd.Timedelta(tolerance)
+        self.lateness = pd.Timedelta(lateness)
+        self.direction = direction
+        self.pending = None      # 还不能输出的传感器记录
+        self.emitted = None      # 迟到窗口内已经输出的传感器记录, 用于迟到的执行器记录触发重算
+        self.actuator = None     # 迟到窗口内的执行器记录
+        self.watermark = None    # 执行器流的最大时间
+        self.sensor_watermark = None
+        self.stats = {'emitted': 0, 'corrected': 0, 'late_dropped': 0}
+
+    @staticmethod
+    def _append(buffer, frame, column):
+        if buffer is None or buffer.empty:
+            combined = frame
+        else:
+            combined = pd.concat([buffer, frame], ignore_index=True)
+        return combined.sort_values(column, kind='stable').reset_index(drop=True)
+
+    def _ready_before(self):
+        """时间不晚于这个值的传感器记录已经可以确定合并结果"""
+        if self.watermark is None:
+            return None
+        horizon = self.watermark - self.lateness
+        if self.direction == 'nearest':
+            horizon -= self.tolerance
+        return horizon
+
+    def _join(self, sensor):
+        return asof_merge(sensor, self.actuator, self.tolerance, self.direction)
+
+    def _prune(self):
+        if self.watermark is None:
+            return
+        # 之后到达的执行器记录不早于 watermark - lateness, 只有不早于这个时间的已输出行可能需要重算
+        actuator_late = self.watermark - self.lateness
+        if self.emitted is not None:
+            self.emitted = self.emitted[self.emitted[SENSOR_TIME] >= actuator_late - self.tolerance].reset_index(drop=True)
+        if self.sensor_watermark is None:
+            # 还没有见到任何传感器记录, 不知道它们从哪里开始, 执行器记录全部保留
+            return
+        # 仍可能需要合并的最早传感器时间: 等待中的、可能重算的、以及还可能迟到的传感器记录
+        # (传感器水位线减去迟到时间之后的记录随时可能到达, 执行器缓冲区不能裁剪到它们的合并范围之后)
+        candidates = [actuator_late - self.tolerance, self.sensor_watermark - self.lateness]
+        if self.pending is not None and not self.pending.empty:
+            candidates.append(self.pending[SENSOR_TIME].iloc[0])
+        keep_from = min(candidates) - self.tolerance
+        if self.actuator is not None and len(self.actuator) > 1:
+            # backward 合并需要窗口之前的最后一条记录
+            times = self.actuator[ACTUATOR_TIME]
+            first = max(int(times.searchsorted(keep_from, side='left')) - 1, 0)
+            self.actuator = self.actuator.iloc[first:].reset_index(drop=True)
+
+    def _emit_ready(self):
+        horizon = self._ready_before()
+        if horizon is None or self.pending is None or self.pending.empty:
+            return None
+        ready_mask = self.pending[SENSOR_TIME] <= horizon
+        if not ready_mask.any():
+            return None
+        ready = self.pending[ready_mask]
+        self.pending = self.pending[~ready_mask].reset_index(drop=True)
+        self.emitted = self._append(self.emitted, ready, SENSOR_TIME)
+        self.stats['emitted'] += len(ready)
+        return self._join(ready)
+
+    def push_sensor(self, frame):
+        """加入一批传感器记录, 返回现在可以输出的合并行"""
+        if frame.empty:
+            return self._empty()
+        frame = frame.assign(**{SENSOR_TIME: pd.to_datetime(frame[SENSOR_TIME])})
+        if self.sensor_watermark is not None:
+            too_late = frame[SENSOR_TIME] < self.sensor_watermark - self.lateness
+            self.stats['late_dropped'] += int(too_late.sum())
+            frame = frame[~too_late]
+        if frame.empty:
+            return self._empty()
+        latest = frame[SENSOR_TIME].max()
+        if self.sensor_watermark is None or latest > self.sensor_watermark:
+            self.sensor_watermark = latest
+        self.pending = self._append(self.pending, frame, SENSOR_TIME)
+        result = self._emit_ready()
+        self._prune()
+        return result if result is not None else self._empty()
+
+    def push_actuator(self, frame):
+        """加入一批执行器记录, 返回新输出的行以及受迟到记录影响而重新输出的行"""
+        if frame.empty:
+            return self._empty()
+        frame = frame.assign(**{ACTUATOR_TIME: pd.to_datetime(frame[ACTUATOR_TIME])})
+        if self.watermark is not None:
+            too_late = frame[ACTUATOR_TIME] < self.watermark - self.lateness
+            self.stats['late_dropped'] += int(too_late.sum())
+            frame = frame[~too_late]
+        if frame.empty:
+            return self._empty()
+        earliest = frame[ACTUATOR_TIME].min()
+        latest = frame[ACTUATOR_TIME].max()
+        self.actuator = self._append(self.actuator, frame, ACTUATOR_TIME)
+        if self.watermark is None or latest > self.watermark:
+            self.watermark = latest
+
+        outputs = []
+        # 迟到的执行器记录: 已经输出的、可能受影响的行重新合并输出
+        if self.emitted is not None and not self.emitted.empty:
+            affected_from = earliest - self.tolerance if self.direction == 'nearest' else earliest
+            affected = self.emitted[self.emitted[SENSOR_TIME] >= affected_from]
+            if not affected.empty:
+                self.stats['corrected'] += len(affected)
+                outputs.append(self._join(affected))
+        ready = self._emit_ready()
+        if ready is not None:
+            outputs.append(ready)
+        self._prune()
+        if not outputs:
+            return self._empty()
+        return pd.concat(outputs, ignore_index=True).sort_values(SENSOR_TIME, kind='stable').reset_index(drop=True)
+
+    def flush(self):
+        """输入结束: 输出所有还在等待的传感器记录"""
+        if self.pending is None or self.pending.empty:
+            return self._empty()
+        ready = self.pending
+        self.pending = None
+        self.emitted = self._append(self.emitted, ready, SENSOR_TIME)
+        self.stats['emitted'] += len(ready)
+        return self._join(ready)
+
+    def _empty(self):
+        return pd.DataFrame()
+
+
+def join_files(sensor_csv, actuator_csv, store_url, chunksize=10000):
+    """分块读取两份原始记录, 交替送入合并器, 合并结果增量写入分区存储"""
+    from fsspec.core import url_to_fs
+    from sensor_store import append_rows
+
+    fs, root = url_to_fs(store_url)
+    joiner = AsOfJoiner()
+    sensor_chunks = pd.read_csv(sensor_csv, chunksize=chunksize)
+    actuator_chunks = pd.read_csv(actuator_csv, chunksize=chunksize)
+    rows = 0
+    for sensor, actuator in _zip_longest(sensor_chunks, actuator_chunks):
+        for merged in (joiner.push_actuator(actuator), joiner.push_sensor(sensor)):
+            if not merged.empty:
+                append_rows(fs, root, merged)
+                rows += len(merged)
+    merged = joiner.flush()
+    if not merged.empty:
+        append_rows(fs, root, merged)
+        rows += len(merged)
+    return rows, joiner.stats
+
+
+def _zip_longest(left, right):
+    empty = pd.DataFrame()
+    left, right = iter(left), iter(right)
+    while True:
+        a, b = next(left, None), next(right, None)
+        if a is None and b is None:
+            return
+        yield (a if a is not None else empty), (b if b is not None else empty)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print("用法: python asof_join.py <传感器csv> <执行器csv> <存储目录>")
+        sys.exit(1)
+    rows, stats = join_files(*sys.argv[1:])
+    print(f"写入 {rows} 行, 统计: {stats}")
@@ -0,0 +1,144 @@
+"""
+控制指令流量分析
+
+基于 modbus_log 解码后的触发日志 (DateTime, Trigger, slave, function, address, value, coil_on, crc_valid):
+    trigger_summary   每个触发器的次数、每小时频率、触发间隔的分布
+    trigger_rates     每个触发器每小时 (或其他粒度) 的次数
+    bursts            同一从站上间隔不超过 BURST_GAP 的连续指令组成的突发
+    redundant_writes  保持型线圈的多余写入:
+                          repeat          与同一从站上一条指令完全相同 (中间没有其他指令, 状态不可能改变)
+                          coil_unchanged  写入的值与该线圈上一次写入的值相同
+                      日志中的写入都是对触发线圈写 FF00 (按一下, 设备自己复位), 每次写入都是一次新的按下,
+                      "上一次写入的值" 不代表线圈当前的状态; 所以只对调用方列出的保持型线圈 (latching) 标记,
+                      默认没有多余写入, 与 modbus_dispatch.CoilDispatcher 的处理一致
+    join_actuators    按时间与 integral_data 的执行器列合并 (as-of, 取指令之前最近的一条执行器记录)
+全部是 groupby / shift / cumsum 的向量化运算。
+
+用法 (打印每个触发器的统计; --latching 假设日志中的线圈都是保持型, 再统计多余写入):
+    python command_analytics.py logs/mideA.csv [logs/mideB.csv ...] [--latching]
+"""
+import sys
+
+import pandas as pd
+
+BURST_GAP = pd.Timedelta(seconds=10)
+MIN_BURST_SIZE = 3
+COIL_KEY = ['slave', 'address']
+
+
+def _sorted(frames):
+    return frames.sort_values('DateTime', kind='stable').reset_index(drop=True)
+
+
+def inter_arrival(frames, by='Trigger'):
+    """同一触发器 (或其他分组) 相邻两次指令的间隔 (秒), 每组第一条为 NaN"""
+    frames = _sorted(frames)
+    return frames.groupby(by, observed=True)['DateTime'].diff().dt.total_seconds()
+
+
+def trigger_summary(frames):
+    """每个触发器的次数、时间跨度、每小时频率和触发间隔的分位数 (秒)"""
+    frames = _sorted(frames)
+    frames = frames.assign(interval=inter_arrival(frames))
+    grouped = frames.groupby('Trigger', observed=True)
+    summary = grouped.agg(count=('DateTime', 'size'), first=('DateTime', 'min'), last=('DateTime', 'max'),
+                          min_interval=('interval', 'min'))
+    span_hours = (summary['last'] - summary['first']) / pd.Timedelta(hours=1)
+    summary['per_hour'] = summary['count'] / span_hours.where(span_hours > 0)
+    quantiles = grouped['interval'].quantile([0.1, 0.5, 0.9]).unstack()
+    quantiles.columns = ['p10_interval', 'median_interval', 'p90_interval']
+    return summary.join(quantiles).sort_values('count', ascending=False)
+
+
+def trigger_rates(frames, freq='1h'):
+    """每个触发器每个时间桶的次数, 行为时间桶, 列为触发器"""
+    buckets = frames['DateTime'].dt.floor(freq)
+    return frames.groupby([buckets, 'Trigger'], observed=True).size().unstack(fill_value=0)
+
+
+def bursts(frames, gap=BURST_GAP, min_size=MIN_BURST_SIZE, by='slave'):
+    """同一分组 (默认同一从站) 内相邻间隔不超过 gap 的指令连成一个突发, 只返回不少于 min_size 条的突发"""
+    frames = _sorted(frames)
+    delta = frames.groupby(by, observed=True)['DateTime'].diff()
+    burst_id = (delta.isna() | (delta > gap)).cumsum()
+    grouped = frames.groupby([frames[by], burst_id], observed=True)['DateTime']
+    table = grouped.agg(start='min', end='max', size='size').reset_index(level=1, drop=True).reset_index()
+    table = table[table['size'] >= min_size]
+    table['duration'] = table['end'] - table['start']
+    return table.sort_values('start').reset_index(drop=True)
+
+
+def redundant_writes(frames, latching=()):
+    """
+    为 latching 中的保持型线圈 {(从站, 地址), ...} 的每条写线圈指令标记 repeat / coil_unchanged (见模块说明),
+    只考虑 CRC 正确的写线圈帧 (功能码 05); 其他线圈都是触发线圈, 不标记。
+    """
+    frames = _sorted(frames)
+    writes = frames['crc_valid'] & (frames['function'] == 5)
+    keys = pd.MultiIndex.from_arrays([frames['slave'].astype(int), frames['address'].astype(int)])
+    is_latching = keys.isin(list(latching)) if latching else False
+    frame = frames[writes]
+    by_slave = frame.groupby('slave', observed=True)
+    repeat = ((by_slave['address'].shift() == frame['address'])
+              & (by_slave['value'].shift() == frame['value']))
+    previous_value = frame.groupby(COIL_KEY, observed=True)['value'].shift()
+    coil_unchanged = previous_value == frame['value']
+    flags = pd.DataFrame({'repeat': False, 'coil_unchanged': False}, index=frames.index)
+    flags.loc[frame.index, 'repeat'] = repeat.to_numpy()
+    flags.loc[frame.index, 'coil_unchanged'] = coil_unchanged.to_numpy()
+    flags[~(writes & is_latching)] = False
+    return frames.join(flags)
+
+
+def redundancy_report(frames, latching=()):
+    """每个触发器的写入次数, 以及保持型线圈两种多余写入的次数和比例"""
+    flagged = redundant_writes(frames, latching)
+    grouped = flagged.groupby('Trigger', observed=True)
+    report = grouped.agg(count=('DateTime', 'size'), repeat=('repeat', 'sum'),
+                         coil_unchanged=('coil_unchanged', 'sum'))
+    report['repeat_share'] = report['repeat'] / report['count']
+    report['coil_unchanged_share'] = report['coil_unchanged'] / report['count']
+    return report.sort_values('coil_unchanged', ascending=False)
+
+
+def join_actuators(frames, integral, columns, tolerance=pd.Timedelta(minutes=2)):
+    """
+    每条指令附上之前最近一条 integral_data 执行器记录 (按 DateTime_y, 没有时按 DateTime) 的状态,
+    超过 tolerance 没有记录的为空。
+    """
+    time_column = 'DateTime_y' if 'DateTime_y' in integral.columns else 'DateTime'
+    right = integral[[time_column] + [col for col in columns if col in integral.columns]]
+    right = right.rename(columns={time_column: 'actuator_time'})
+    right = right.assign(actuator_time=pd.to_datetime(right['actuator_time']).astype('datetime64[ns]'))
+    right = right.dropna(subset=['actuator_time']).sort_values('actuator_time', kind='stable')
+    left = _sorted(frames)
+    left = left.assign(DateTime=left['DateTime'].astype('datetime64[ns]'))
+    return pd.merge_asof(left, right, left_on='DateTime', right_on='actuator_time',
+                         direction='backward', tolerance=pd.Timedelta(tolerance))
+
+
+if __name__ == "__main__":
+    urls = [arg for arg in sys.argv[1:] if arg != '--latching']
+    assume_latching = len(urls) < len(sys.argv) - 1
+    if not urls:
+        print("用法: python command_analytics.py <日志csv> [<日志csv> ...] [--latching]")
+        sys.exit(1)
+    from fsspec.core import url_to_fs
+    from modbus_log import load_frames, written_coils
+
+    for url in urls:
+        fs, path = url_to_fs(url)
+        frames = load_frames(fs, path)
+        latching = written_coils(frames) if assume_latching else ()
+        print(f"== {url}: {len(frames)} 条指令")
+        with pd.option_context('display.width', 200, 'display.max_columns', None):
+            print(trigger_summary(frames))
+            if latching:
+                report = redundancy_report(frames, latching)
+                print(report)
+        print(f"突发 (间隔 <= {BURST_GAP.seconds} 秒, 至少 {MIN_BURST_SIZE} 条): {len(bursts(frames))} 个")
+        if latching:
+            print(f"假设 {len(latching)} 个线圈都是保持型时的多余写入: 与上一条相同 {int(report['repeat'].sum())} 条, "
+                  f"线圈值未变 {int(report['coil_unchanged'].sum())} 条 / 共 {len(frames)} 条")
+        else:
+            print("日志中的线圈都是触发线圈, 每次写入都是一次按下, 没有多余写入 (--latching 按保持型线圈统计)")
@@ -9,6 +9,11 @@ import boto3
 import matplotlib.pyplot as plt 
 import cv2
 
+import pandas as pd
+
+from data_quality import QUALITY_DAYS, quality_report, report_text
+from data_schema import row_time_column
+
 #st.set_page_config(page_title='室墨司源', layout='wide')
 
 # AWS and S3 configuration
@@ -118,9 +123,25 @@ def ai_assistants(df):
 
 
 
-def data_analysis(agent_data_analyst):
+def data_quality_answer(df, report=None):
+    """数据完整性直接计算得到, 不再交给大模型; 没有传入 report 时只检查 df 的最近七天"""
+    question = "**最近七天数据是否完整? (时间缺口、缺失值、-1无效值、读数冻结)**"
+    st.write(question)
+    message = st.chat_message(name="ai", avatar=':material/cruelty_free:')
+    if report is None:
+        times = pd.to_datetime(df[row_time_column(df)], errors='coerce')
+        start = times.max().normalize() - pd.Timedelta(days=QUALITY_DAYS - 1)
+        report = quality_report(df[times >= start])
+    answer = report_text(report)
+    message.write(answer)
+    problems = report['columns']
+    problems = problems[problems['valid_ratio'] < 1]
+    if not problems.empty:
+        message.dataframe(problems)
+    return question + "\n" + answer + "\n\n"
+
+def data_analysis(agent_data_analyst, df, quality=None):
     questions = [
-        "**最近七天除了unnamed开头的列，还有没有否缺失数据，缺失情况如何?**",
         "**最近七天，室内温度和湿度稳定性如何？**",
         "**最近七天，CO2浓度变化规律如何**",
         "**最近七天，pH变化规律如何**",
@@ -129,6 +150,11 @@ def data_analysis(agent_data_analyst):
     
     avatar = ':material/cruelty_free:'
     combined_info = ""
+
+    try:
+        combined_info += data_quality_answer(df, quality)
+    except Exception as e:
+        st.warning(f"检查数据完整性时发生错误: {str(e)}")
     
     for question in questions:
         try:
@@ -185,7 +211,7 @@ def data_analysis(agent_data_analyst):
     
     return combined_info, summary
 
-def ai_assistants(df):
+def ai_assistants(df, quality=None):
     try:
         agent_data_analyst = create_pandas_dataframe_agent(
             langchain_llm,#moonshot_llm,
@@ -194,7 +220,7 @@ def ai_assistants(df):
             allow_dangerous_code=True
         )
         
-        data_analysis(agent_data_analyst)
+        data_analysis(agent_data_analyst, df, quality)
         
         prompt = st.chat_input('请输入你感兴趣的问题')
         with st.expander('补充提问回答'):
@@ -0,0 +1,180 @@
+"""
+数据完整性报告
+
+原来 "最近七天有没有缺失数据" 交给大模型和 pandas agent 去回答, 既慢又不确定。
+这里用几次向量化计算直接得到结构化的结果:
+    时间缺口    相邻两条记录的间隔超过 GAP_THRESHOLD, 估计缺失的行数
+    缺失值      每列的空值数 (不含占位字符串)
+    占位字符串  原始 CSV 中数值列里不能转为数字的文本, 如 pH 列的 "pH"
+                (分区存储中已经转为空值, 按入库时记下的 PLACEHOLDER_COLUMN 掩码统计)
+    -1 无效值   传感器的无效读数
+    冻结传感器  连续 FROZEN_ROWS 行以上读数完全相同
+报告是普通的 dict / DataFrame, 数据查看器和 AI 问答都可以直接使用。
+"""
+import numpy as np
+import pandas as pd
+
+from data_schema import (PLACEHOLDER_COLUMN, ROW_KEY, SENSOR_COLUMNS, SENTINEL, TIME_COLUMN,
+                         row_time_column)
+
+SAMPLE_PERIOD = pd.Timedelta(minutes=1)
+GAP_THRESHOLD = pd.Timedelta(minutes=2)
+FROZEN_ROWS = 60
+# AI 问答中 "最近七天" 的数据完整性检查范围 (按日期计, 含最新一天)
+QUALITY_DAYS = 7
+
+
+def _as_datetime(times):
+    times = pd.Series(times)
+    if pd.api.types.is_datetime64_any_dtype(times):
+        return times
+    return pd.to_datetime(times, format='ISO8601', errors='coerce')
+
+
+def timestamp_gaps(times, threshold=GAP_THRESHOLD, period=SAMPLE_PERIOD):
+    """相邻记录间隔超过 threshold 的缺口: 缺口前后的时间、时长和估计缺失的行数"""
+    times = _as_datetime(times).dropna().sort_values().reset_index(drop=True)
+    delta = times.diff()
+    gap = delta > threshold
+    gaps = pd.DataFrame({
+        'start': times.shift(1)[gap],
+        'end': times[gap],
+        'duration': delta[gap],
+    }).reset_index(drop=True)
+    gaps['missing_rows'] = (gaps['duration'] / period).round().astype(int) - 1
+    return gaps
+
+
+def _is_text(series):
+    return not (pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series)
+                or pd.api.types.is_datetime64_any_dtype(series))
+
+
+def _numeric(series):
+    if not _is_text(series):
+        return series
+    return pd.to_numeric(series.replace({'True': 1, 'False': 0}), errors='coerce')
+
+
+def placeholder_counts(frame, columns):
+    """
+    每列占位字符串的个数。有 PLACEHOLDER_COLUMN 掩码 (分区存储) 时按掩码统计,
+    否则统计原始文本列中不能转为数字的非空值 (已经是数值类型的列为 0)。
+    """
+    counts = {}
+    if PLACEHOLDER_COLUMN in frame.columns:
+        mask = frame[PLACEHOLDER_COLUMN].fillna(0).to_numpy(dtype=np.uint32)
+        for col in columns:
+            if col in SENSOR_COLUMNS:
+                bit = np.uint32(1) << np.uint32(SENSOR_COLUMNS.index(col))
+                counts[col] = int(np.count_nonzero(mask & bit))
+            else:
+                counts[col] = 0
+        return pd.Series(counts, dtype=np.int64)
+    for col in columns:
+        series = frame[col]
+        counts[col] = int((series.notna() & _numeric(series).isna()).sum()) if _is_text(series) else 0
+    return pd.Series(counts, dtype=np.int64)
+
+
+def frozen_runs(values, min_rows=FROZEN_ROWS):
+    """
+    一列中连续相同读数不少于 min_rows 行的片段, 返回片段在列中的 (起始位置, 长度) 两个数组。
+    空值和 -1 打断片段。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values) & (values != SENTINEL)
+    same = valid[1:] & valid[:-1] & (values[1:] == values[:-1])
+    # 每个 "与上一行相同" 的游程对应一个冻结片段, 片段长度为游程长度 + 1
+    edges = np.diff(np.concatenate([[0], same.astype(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1)
+    lengths = np.flatnonzero(edges == -1) - starts + 1
+    keep = lengths >= min_rows
+    return starts[keep], lengths[keep]
+
+
+def quality_report(frame, columns=None, min_frozen_rows=FROZEN_ROWS, gap_threshold=GAP_THRESHOLD):
+    """
+    返回 dict:
+        rows / start / end   记录数和时间范围
+        gaps                 时间缺口表 (timestamp_gaps)
+        columns              每列一行: missing / placeholders / sentinels / frozen_runs /
+                             longest_frozen_rows / frozen_rows / valid_ratio
+        frozen               冻结片段明细: column / start / end / rows / value
+    """
+    if ROW_KEY not in frame.columns and TIME_COLUMN not in frame.columns:
+        # 以时间为索引的数据 (with_time_index)
+        frame = frame.reset_index()
+    time_column = row_time_column(frame)
+    if columns is None:
+        columns = [col for col in frame.columns
+                   if not col.startswith('Unnamed')
+                   and col not in (ROW_KEY, TIME_COLUMN, 'DateTime_y', PLACEHOLDER_COLUMN)]
+    columns = [col for col in columns if col in frame.columns]
+    frame = frame.sort_values(time_column, kind='stable').reset_index(drop=True)
+    times = _as_datetime(frame[time_column])
+
+    placeholders = placeholder_counts(frame, columns)
+    numeric = frame[columns].apply(_numeric)
+    missing = numeric.isna().sum() - placeholders
+    sensors = [col for col in columns if col in SENSOR_COLUMNS]
+    sentinels = (numeric[sensors] == SENTINEL).sum()
+
+    frozen_details = []
+    frozen_summary = {}
+    for col in sensors:
+        starts, lengths = frozen_runs(numeric[col].to_numpy(dtype=np.float64, na_value=np.nan), min_frozen_rows)
+        frozen_summary[col] = (len(starts), int(lengths.max()) if len(lengths) else 0, int(lengths.sum()))
+        if len(starts):
+            frozen_details.append(pd.DataFrame({
+                'column': col,
+                'start': times.to_numpy()[starts],
+                'end': times.to_numpy()[starts + lengths - 1],
+                'rows': lengths,
+                'value': numeric[col].to_numpy()[starts],
+            }))
+    frozen_summary = pd.DataFrame(frozen_summary, index=['frozen_runs', 'longest_frozen_rows', 'frozen_rows']).T
+
+    table = pd.DataFrame({
+        'missing': missing,
+        'placeholders': placeholders,
+        'sentinels': sentinels,
+    }).reindex(columns)
+    table = table.join(frozen_summary).fillna(0).astype(np.int64)
+    rows = len(frame)
+    invalid = table['missing'] + table['placeholders'] + table['sentinels'] + table['frozen_rows']
+    table['valid_ratio'] = 1 - invalid / rows if rows else np.nan
+
+    return {
+        'rows': rows,
+        'start': times.min() if rows else None,
+        'end': times.max() if rows else None,
+        'gaps': timestamp_gaps(times, gap_threshold),
+        'columns': table,
+        'frozen': (pd.concat(frozen_details, ignore_index=True) if frozen_details
+                   else pd.DataFrame(columns=['column', 'start', 'end', 'rows', 'value'])),
+    }
+
+
+def report_text(report, max_items=5):
+    """简短的中文文字结论, 用于 AI 问答的总结报告"""
+    if not report['rows']:
+        return "所选时间范围内没有数据。"
+    lines = [f"共 {report['rows']} 条记录, {report['start']:%Y-%m-%d %H:%M} 至 {report['end']:%Y-%m-%d %H:%M}。"]
+    gaps = report['gaps']
+    if gaps.empty:
+        lines.append("没有时间缺口。")
+    else:
+        longest = gaps.loc[gaps['duration'].idxmax()]
+        lines.append(f"{len(gaps)} 处时间缺口, 估计缺失 {gaps['missing_rows'].sum()} 行, "
+                     f"最长一处 {longest['duration'].round('min')} (从 {longest['start']:%m-%d %H:%M} 开始)。")
+    table = report['columns']
+    for label, column in [('缺失值', 'missing'), ('占位字符串', 'placeholders'), ('-1 无效值', 'sentinels')]:
+        worst = table[column][table[column] > 0].sort_values(ascending=False).head(max_items)
+        if not worst.empty:
+            lines.append(f"{label}: " + ", ".join(f"{col} {count} 行" for col, count in worst.items()) + "。")
+    frozen = table['longest_frozen_rows'][table['longest_frozen_rows'] > 0].sort_values(ascending=False).head(max_items)
+    if not frozen.empty:
+        lines.append("读数长时间不变 (可能冻结): "
+                     + ", ".join(f"{col} 最长 {rows} 行" for col, rows in frozen.items()) + "。")
+    return "\n".join(lines)
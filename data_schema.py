@@ -0,0 +1,153 @@
+"""
+integral_data 各列的紧凑类型定义
+
+原始日志里数值列混有占位字符串 (pH/WTEMP/EC 列的内容就是 "pH"/"WTEMP"/"EC"),
+执行器列是文本 True/False, 时间列是字符串, pandas 推断出来的都是 object 类型, 内存占用很大。
+这里按列名给出固定的紧凑类型:
+    传感器  -> float32, 占位字符串变为 NaN
+    执行器  -> bool (数值型的状态 0.0/20/30 等按非零即开处理, 缺失视为关闭)
+    CO2     -> uint8, 保留阀门开度 (%)
+    时间列  -> datetime64
+占位字符串转为 NaN 之后就无法和真正的缺失区分, 所以入库时先用 placeholder_mask
+把每行哪些传感器列是占位字符串记成一个位掩码 (PLACEHOLDER_COLUMN) 一起保存。
+
+用法 (打印每列节省的内存):
+    python data_schema.py logs/integral_data.csv
+"""
+import sys
+
+import numpy as np
+import pandas as pd
+
+TIME_COLUMN = "DateTime"
+TIME_COLUMNS = ['DateTime_x', 'DateTime_y', 'DateTime']
+# 每条传感器记录的时间戳唯一, 用作行的去重键
+ROW_KEY = 'DateTime_x'
+# 传感器上报的无效读数
+SENTINEL = -1
+
+# 传感器数值列 (包括只在部分单元出现的列)
+SENSOR_COLUMNS = [
+    'Temperature', 'Humidity', 'CO2PPM', 'CO2M', 'pH', 'WTEMP', 'EC', 'Wlevel',
+    'Temperature1', 'Humidity1', 'Temperature2', 'Humidity2', 'Temperature3', 'Humidity3',
+    'CO2PPM1', 'CO2PPM2', 'CO2PPM3', 'CO2PPM4', 'CO2M4',
+    'TempA', 'TempB', 'TempC', 'HumiA', 'HumiB', 'HumiC', 'CO2PPMA', 'CO2PPMB', 'CO2PPMC',
+]
+
+# 每行的占位字符串位掩码: 第 i 位对应 SENSOR_COLUMNS[i]
+PLACEHOLDER_COLUMN = '_placeholders'
+
+# 执行器开关列
+ACTUATOR_COLUMNS = [
+    'Acondition', 'FreshAir', 'Mtank', 'WaterCooler', 'TubeFan', 'UV', 'Humidifier', 'O3',
+    'HallLight', 'CO2', 'Nutrition', 'Acid', 'CirclePump', 'SeedPump', 'SeedSpray',
+    'SeedA', 'SeedA.1', 'SeedB', 'SeedC',
+    'AA', 'AB', 'AC', 'BA', 'BB', 'BC', 'CA', 'CB', 'CC', 'DA', 'DB', 'DC',
+    'Motor1L', 'Motor1R', 'Motor2R', 'Motor2L', 'Motor3R', 'Motor3L', 'Motor4L', 'Motor4R',
+    'EqipRoomFan', 'StandBy',
+]
+
+# 记录开度而不只是开关的执行器
+LEVEL_COLUMNS = {'CO2': np.uint8}
+
+COLUMN_DTYPES = {}
+COLUMN_DTYPES.update({col: 'datetime64[ns]' for col in TIME_COLUMNS})
+COLUMN_DTYPES.update({col: np.float32 for col in SENSOR_COLUMNS})
+COLUMN_DTYPES.update({col: np.bool_ for col in ACTUATOR_COLUMNS})
+COLUMN_DTYPES.update(LEVEL_COLUMNS)
+COLUMN_DTYPES[PLACEHOLDER_COLUMN] = np.uint32
+
+
+def row_time_column(frame):
+    """行的时间列: 有 ROW_KEY 时用它 (每条传感器记录唯一), 否则用 DateTime"""
+    return ROW_KEY if ROW_KEY in frame.columns else TIME_COLUMN
+
+
+def _to_number(series):
+    if pd.api.types.is_bool_dtype(series):
+        return series.astype(np.float32)
+    if pd.api.types.is_numeric_dtype(series):
+        return series
+    values = series.replace({'True': 1, 'False': 0, True: 1, False: 0})
+    return pd.to_numeric(values, errors='coerce')
+
+
+def placeholder_mask(df):
+    """每行一个 uint32: 传感器列中不能转为数字的非空文本 (如 "pH") 所在的位为 1"""
+    mask = np.zeros(len(df), dtype=np.uint32)
+    for bit, column in enumerate(SENSOR_COLUMNS):
+        if column not in df.columns or pd.api.types.is_numeric_dtype(df[column]):
+            continue
+        series = df[column]
+        placeholder = (series.notna() & _to_number(series).isna()).to_numpy()
+        mask |= placeholder.astype(np.uint32) << np.uint32(bit)
+    return pd.Series(mask, index=df.index, name=PLACEHOLDER_COLUMN)
+
+
+def coerce_column(series, dtype):
+    if dtype == 'datetime64[ns]':
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return series
+        return pd.to_datetime(series, format='ISO8601', errors='coerce')
+    values = _to_number(series)
+    if dtype == np.bool_:
+        return values.fillna(0).astype(bool)
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        info = np.iinfo(dtype)
+        return values.fillna(0).clip(info.min, info.max).astype(dtype)
+    return values.astype(dtype)
+
+
+def apply_schema(df):
+    """
+    按 COLUMN_DTYPES 把每一列转换为紧凑类型, 未登记的列按内容推断:
+    能转为数值的转 float32, 其余保持原样。
+    """
+    typed = {}
+    for column in df.columns:
+        dtype = COLUMN_DTYPES.get(column)
+        if dtype is not None:
+            typed[column] = coerce_column(df[column], dtype)
+            continue
+        values = _to_number(df[column])
+        if values.notna().sum() == df[column].notna().sum():
+            typed[column] = values.astype(np.float32)
+        else:
+            typed[column] = df[column]
+    return pd.DataFrame(typed, index=df.index)
+
+
+def memory_report(before, after):
+    """逐列对比转换前后的内存占用 (字节)"""
+    before_bytes = before.memory_usage(deep=True, index=False)
+    after_bytes = after.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({
+        'dtype_before': before.dtypes.astype(str),
+        'dtype_after': after.dtypes.astype(str),
+        'bytes_before': before_bytes,
+        'bytes_after': after_bytes,
+    })
+    report['bytes_saved'] = report['bytes_before'] - report['bytes_after']
+    return report.sort_values('bytes_saved', ascending=False)
+
+
+def load_typed(source, report=False, **read_csv_kwargs):
+    """读取 CSV 并转换为紧凑类型, report=True 时同时返回逐列内存报告"""
+    raw = pd.read_csv(source, **read_csv_kwargs)
+    typed = apply_schema(raw)
+    if report:
+        return typed, memory_report(raw, typed)
+    return typed
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("用法: python data_schema.py <csv路径>")
+        sys.exit(1)
+    typed, report = load_typed(sys.argv[1], report=True)
+    with pd.option_context('display.max_rows', None):
+        print(report)
+    total_before = report['bytes_before'].sum()
+    total_after = report['bytes_after'].sum()
+    print(f"合计: {total_before / 1e6:.2f} MB -> {total_after / 1e6:.2f} MB "
+          f"(节省 {1 - total_after / total_before:.0%})")
@@ -0,0 +1,77 @@
+"""
+图表曲线的服务端降采样
+
+一个月的分钟数据乘以七个温度传感器就是几十万个点, 全部发给浏览器会让 Plotly 卡住。
+这里把每条曲线的点数限制在屏幕分辨率附近:
+    lttb    Largest-Triangle-Three-Buckets, 保留曲线的视觉形状
+    minmax  每个桶保留最小值和最大值, 保证峰值不会被丢掉
+两个函数都返回要保留的点的下标, 调用方用下标同时取 x 和 y。
+"""
+import numpy as np
+
+# 每条曲线最多的点数, 约为宽屏图表的像素宽度
+SCREEN_POINTS = 2000
+# 点数超过这个值时改用 WebGL (Scattergl) 绘制
+WEBGL_THRESHOLD = 1000
+
+METHODS = {}
+
+
+def _as_float(x):
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+    return x.astype(np.float64)
+
+
+def lttb(x, y, n_out):
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = _as_float(x)
+    y = np.asarray(y, dtype=np.float64)
+
+    # 首尾两点固定保留, 中间的点分成 n_out - 2 个桶
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # 以上一个选中点和下一个桶的平均点为底, 选出三角形面积最大的点
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a])
+                      - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+def minmax(x, y, n_out):
+    n = len(y)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+    y = np.asarray(y, dtype=np.float64)
+    buckets = n_out // 2
+    bucket_id = (np.arange(n) * buckets) // n
+    # 按 (桶, 值) 排序后, 每个桶的第一个是最小值, 最后一个是最大值
+    order = np.lexsort((y, bucket_id))
+    sorted_bucket = bucket_id[order]
+    first = np.flatnonzero(np.r_[True, sorted_bucket[1:] != sorted_bucket[:-1]])
+    last = np.r_[first[1:] - 1, n - 1]
+    return np.unique(np.concatenate([order[first], order[last]]))
+
+
+METHODS['LTTB'] = lttb
+METHODS['最大最小值'] = minmax
+
+
+def downsample(x, y, n_out=SCREEN_POINTS, method='LTTB'):
+    """返回降采样后要保留的点的下标 (升序), 点数不超过 n_out 时保留全部"""
+    return METHODS[method](x, y, n_out)
@@ -0,0 +1,79 @@
+"""
+执行器占空比与能耗统计
+
+由执行器开关区间 (actuator_timeline) 和每台设备的额定功率计算每小时/每天/每周的
+占空比和用电量 (kWh):
+    每个时间桶的开启时长 = 桶结束时刻的累计开启时长 - 桶开始时刻的累计开启时长
+累计开启时长在区间数组上二分查找得到, 所有桶边界一次向量化计算,
+一年的分钟数据也只是几千个区间; 开关区间由后台同步增量维护, 这里不需要再扫描原始行。
+
+额定功率 (kW) 是按铭牌估计的默认值, 可以在 settings.json 的 rated_power_kw 中覆盖;
+功率为 0 或没有登记的设备 (阀门、电磁阀等) 不计入能耗。
+"""
+import numpy as np
+import pandas as pd
+
+# 默认额定功率 (kW)
+DEFAULT_RATED_POWER_KW = {
+    'Acondition': 3.5, 'FreshAir': 0.25, 'Mtank': 0.37, 'WaterCooler': 1.5, 'TubeFan': 0.1,
+    'UV': 0.04, 'Humidifier': 0.3, 'O3': 0.05, 'HallLight': 0.1,
+    'Nutrition': 0.02, 'Acid': 0.02, 'CirclePump': 0.37, 'SeedPump': 0.1, 'SeedSpray': 0.05,
+    'EqipRoomFan': 0.1,
+    # LED 灯排 A-D, 每排 A-C 三段
+    'AA': 0.2, 'AB': 0.2, 'AC': 0.2, 'BA': 0.2, 'BB': 0.2, 'BC': 0.2,
+    'CA': 0.2, 'CB': 0.2, 'CC': 0.2, 'DA': 0.2, 'DB': 0.2, 'DC': 0.2,
+    'Motor1L': 0.09, 'Motor1R': 0.09, 'Motor2R': 0.09, 'Motor2L': 0.09,
+    'Motor3R': 0.09, 'Motor3L': 0.09, 'Motor4L': 0.09, 'Motor4R': 0.09,
+}
+
+# 界面上的统计周期 -> pandas Period 频率 (周从周一开始)
+PERIODS = {'每小时': 'h', '每天': 'D', '每周': 'W'}
+
+
+def rated_power_table(overrides=None):
+    """默认额定功率加上配置中的覆盖值, 只保留功率大于 0 的设备"""
+    ratings = dict(DEFAULT_RATED_POWER_KW)
+    if overrides:
+        ratings.update({device: float(kw) for device, kw in overrides.items()})
+    table = pd.Series(ratings, dtype=np.float64, name='rated_kw')
+    return table[table > 0]
+
+
+def bucket_edges(start, end, freq):
+    """[start, end) 按日历周期切分的桶边界, 首尾两个桶裁剪到范围内"""
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    periods = pd.period_range(start, end - pd.Timedelta(1), freq=freq)
+    edges = periods.start_time.append(pd.DatetimeIndex([(periods[-1] + 1).start_time]))
+    edges = pd.DatetimeIndex(np.clip(edges.to_numpy(), start.to_datetime64(), end.to_datetime64()))
+    return periods.start_time, edges
+
+
+def duty_and_energy(timeline, start, end, freq='h', ratings=None):
+    """
+    返回 (duty, energy) 两张表: 行是时间桶起点, 列是设备;
+    duty 为开启时间占桶长度的比例, energy 为用电量 (kWh)。
+    """
+    ratings = rated_power_table() if ratings is None else ratings
+    devices = [device for device in ratings.index if device in timeline.columns]
+    index, edges = bucket_edges(start, end, freq)
+    lengths = np.diff(edges.to_numpy(dtype='datetime64[ns]').view(np.int64)).astype(np.float64)
+    on_hours = {}
+    for device in devices:
+        cumulative = timeline.cumulative_on_time(device, edges)
+        on_hours[device] = np.diff(cumulative) / pd.Timedelta(hours=1).value
+    on_hours = pd.DataFrame(on_hours, index=index, columns=devices)
+    hours = lengths / pd.Timedelta(hours=1).value
+    with np.errstate(invalid='ignore', divide='ignore'):
+        duty = on_hours.div(hours, axis=0)
+    energy = on_hours.mul(ratings[devices], axis=1)
+    return duty, energy
+
+
+def energy_summary(timeline, start, end, ratings=None):
+    """整个范围内每台设备的开启时长、占空比和用电量, 按用电量从高到低排序"""
+    ratings = rated_power_table() if ratings is None else ratings
+    devices = [device for device in ratings.index if device in timeline.columns]
+    summary = timeline.summary(start, end, devices)
+    summary['rated_kw'] = ratings[devices]
+    summary['kwh'] = summary['on_hours'] * summary['rated_kw']
+    return summary.sort_values('kwh', ascending=False)
@@ -0,0 +1,105 @@
+"""
+执行器开关事件与传感器响应的关联分析
+
+例如 CO2 阀打开后 CO2PPM 多久开始上升、升高多少, 空调切换后温度怎样变化。
+    1. 传感器数据对齐到每分钟一格的规则网格 (同一分钟多行取平均, 缺失为 NaN, -1 视为缺失)
+    2. 开关事件直接取自执行器时间线 (actuator_timeline) 的区间起点 (开启) 或终点 (关闭)
+    3. 用 sliding_window_view 得到网格上所有长度为 pre + post + 1 的窗口 (不复制数据),
+       按事件所在位置一次取出 (事件数, 传感器数, 窗口长度) 的数组
+    4. 每个窗口减去事件前 pre 分钟的均值作为基线, 对所有事件取平均得到平均响应曲线
+每对 (执行器, 传感器) 的统计量:
+    gain          事件后平均响应偏离基线最大的值 (带符号)
+    peak_minutes  达到 gain 的时间
+    lag_minutes   平均响应第一次达到 gain 的 63% 的时间 (一阶系统的时间常数)
+    settled       窗口最后 PLATEAU_MINUTES 分钟的平均响应
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from data_schema import SENTINEL
+
+PRE_MINUTES = 10
+POST_MINUTES = 60
+PLATEAU_MINUTES = 10
+LAG_FRACTION = 0.63
+MINUTE = pd.Timedelta(minutes=1)
+
+
+def minute_grid(frame, columns):
+    """
+    把以时间为索引的数据对齐到每分钟一格,
+    返回 (第一格的时间, 形状为 (分钟数, 列数) 的 float32 数组, 实际存在的列)。
+    """
+    columns = [col for col in columns if col in frame.columns]
+    values = frame[columns].astype(np.float32)
+    values = values.where(values != SENTINEL)
+    minutes = values.groupby(pd.DatetimeIndex(frame.index).floor('min')).mean()
+    if minutes.empty:
+        return None, np.empty((0, len(columns)), dtype=np.float32), columns
+    full = pd.date_range(minutes.index[0], minutes.index[-1], freq='min')
+    return full[0], minutes.reindex(full).to_numpy(dtype=np.float32), columns
+
+
+def switch_events(timeline, actuator, direction='on'):
+    """执行器由关到开 (direction='on') 或由开到关 ('off') 的时刻, int64 纳秒"""
+    starts, ends, _ = timeline.snapshot(actuator)
+    return starts if direction == 'on' else ends
+
+
+def event_windows(grid, grid_start, events, pre=PRE_MINUTES, post=POST_MINUTES):
+    """
+    每个事件前 pre 分钟到后 post 分钟的传感器窗口, 形状 (事件数, 传感器数, pre + post + 1);
+    窗口超出网格范围的事件被丢弃。
+    """
+    width = pre + post + 1
+    if len(grid) < width or not len(events):
+        return np.empty((0, grid.shape[1], width), dtype=grid.dtype)
+    positions = (np.asarray(events, dtype=np.int64) - pd.Timestamp(grid_start).value) // MINUTE.value
+    first = positions - pre
+    first = first[(first >= 0) & (first + width <= len(grid))]
+    windows = sliding_window_view(grid, width, axis=0)   # (len(grid) - width + 1, 传感器数, width)
+    return windows[first]
+
+
+def response_curves(windows, columns, pre=PRE_MINUTES):
+    """平均响应曲线 (以事件时刻为 0 分钟) 和每个传感器的统计量"""
+    offsets = np.arange(windows.shape[2]) - pre
+    with warnings.catch_warnings():
+        # 全是 NaN 的切片取平均时 numpy 会警告, 结果为 NaN 即可
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        baseline = np.nanmean(windows[:, :, :pre], axis=2, keepdims=True)
+        curve = np.nanmean(windows - baseline, axis=0)   # (传感器数, 窗口长度)
+    curve_frame = pd.DataFrame(curve.T, index=pd.Index(offsets, name='minutes'), columns=columns)
+    events = (~np.isnan(windows[:, :, pre])).sum(axis=0)
+    after = curve[:, pre:]
+    stats = []
+    for i, column in enumerate(columns):
+        response = after[i]
+        if np.isnan(response).all():
+            stats.append((int(events[i]), np.nan, np.nan, np.nan, np.nan))
+            continue
+        peak = int(np.nanargmax(np.abs(response)))
+        gain = float(response[peak])
+        reached = np.flatnonzero(response * np.sign(gain) >= LAG_FRACTION * abs(gain))
+        lag = int(reached[0]) if len(reached) else np.nan
+        settled = float(np.nanmean(response[-PLATEAU_MINUTES:]))
+        stats.append((int(events[i]), gain, peak, lag, settled))
+    stats = pd.DataFrame(stats, index=columns, columns=['events', 'gain', 'peak_minutes', 'lag_minutes', 'settled'])
+    return curve_frame, stats
+
+
+def response_matrix(timeline, grid, grid_start, actuators, columns, direction='on',
+                    pre=PRE_MINUTES, post=POST_MINUTES):
+    """所有 (执行器, 传感器) 组合的统计量, 行为 MultiIndex (actuator, sensor)"""
+    tables = {}
+    for actuator in actuators:
+        windows = event_windows(grid, grid_start, switch_events(timeline, actuator, direction), pre, post)
+        if len(windows):
+            tables[actuator] = response_curves(windows, columns, pre)[1]
+    if not tables:
+        return pd.DataFrame(columns=['events', 'gain', 'peak_minutes', 'lag_minutes', 'settled'])
+    return pd.concat(tables, names=['actuator', 'sensor'])
+
@@ -0,0 +1,116 @@
+"""
+图片下载层: 连接池复用、每个对象只下载一次、后台预取
+
+原来图片查看器里同一张原始图片下载两次: st.image(预签名 URL) 由浏览器下载一次,
+process_image 又用不复用连接的 requests.get 下载一次。这里统一通过一个 S3 客户端
+(boto3 客户端线程安全, 内部的 urllib3 连接池在所有线程之间共享) 读取对象字节:
+    - 最近用过的图片字节保存在内存 LRU 中 (按总字节数限制), 显示和分析共用同一份
+    - 同一个对象正在下载时, 其他请求等待同一个 Future, 不会重复下载
+    - prefetch 把相邻时间的图片交给线程池并发下载, 可以附带一个回调 (例如预先计算分析结果)
+每次下载的耗时和字节数记录在最近 LATENCY_WINDOW 次的窗口中, latency_stats 给出分位数。
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+FETCH_WORKERS = 4
+MAX_BYTES = 256 * 1024 * 1024
+LATENCY_WINDOW = 200
+
+
+class ImageFetcher:
+    def __init__(self, client, bucket, workers=FETCH_WORKERS, max_bytes=MAX_BYTES):
+        self.client = client
+        self.bucket = bucket
+        self.max_bytes = max_bytes
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='image-fetch')
+        self.lock = threading.Lock()
+        self.items = OrderedDict()   # key -> bytes, 最近使用的在末尾
+        self.size = 0
+        self.inflight = {}           # key -> Future
+        self.latencies = deque(maxlen=LATENCY_WINDOW)   # (秒, 字节数)
+        self.hits = 0
+        self.misses = 0
+
+    def _download(self, key):
+        start = time.perf_counter()
+        data = self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        with self.lock:
+            self.latencies.append((time.perf_counter() - start, len(data)))
+        return data
+
+    def _store(self, key, data):
+        with self.lock:
+            self.inflight.pop(key, None)
+            if key not in self.items:
+                self.items[key] = data
+                self.size += len(data)
+            while self.size > self.max_bytes and len(self.items) > 1:
+                self.size -= len(self.items.popitem(last=False)[1])
+
+    def _lookup(self, key):
+        """
+        返回 (字节, Future, 是否由本次调用负责下载):
+        已缓存时只有字节; 否则是正在进行 (或刚登记) 的下载的 Future。
+        """
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key], None, False
+            if key in self.inflight:
+                self.hits += 1
+                return None, self.inflight[key], False
+            self.misses += 1
+            future = self.inflight[key] = Future()
+            return None, future, True
+
+    def _run(self, key, future):
+        try:
+            data = self._download(key)
+        except Exception as e:
+            with self.lock:
+                self.inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        self._store(key, data)
+        future.set_result(data)
+        return data
+
+    def fetch(self, key):
+        """对象的字节, 已缓存时直接返回, 正在下载时等待同一次下载"""
+        data, future, owner = self._lookup(key)
+        if future is None:
+            return data
+        if owner:
+            return self._run(key, future)
+        return future.result()
+
+    def prefetch(self, keys, then=None):
+        """在线程池中下载 keys 中还没有缓存的对象; then(key, data) 在下载完成后于同一线程中调用"""
+        def task(key):
+            data = self.fetch(key)
+            if then is not None:
+                then(key, data)
+
+        for key in keys:
+            with self.lock:
+                cached = key in self.items or key in self.inflight
+            if not cached or then is not None:
+                self.pool.submit(task, key)
+
+    def latency_stats(self):
+        with self.lock:
+            samples = list(self.latencies)
+            hits, misses, items, size = self.hits, self.misses, len(self.items), self.size
+        stats = {'fetches': len(samples), 'hits': hits, 'misses': misses, 'cached': items, 'cached_bytes': size}
+        if samples:
+            seconds = np.array([sample[0] for sample in samples])
+            stats.update(p50_ms=float(np.percentile(seconds, 50) * 1000),
+                         p95_ms=float(np.percentile(seconds, 95) * 1000),
+                         mean_ms=float(seconds.mean() * 1000),
+                         mb_per_s=float(sum(sample[1] for sample in samples) / seconds.sum() / 1e6))
+        return stats
@@ -0,0 +1,160 @@
+"""
+每个单元的图片清单索引
+
+原来每次页面重新运行都要分页列出 images/{unit}/ 下的全部对象, 再逐个用正则解析文件名。
+这里为每个单元保存一份按拍摄时间排序的清单 (timestamp datetime64 数组 + key / type / etag),
+以 Parquet 保存在本地目录, 刷新时只列出上次之后新增的对象:
+    S3 按 key 的字典序列出, 文件名中的时间格式 (YYYY-MM-DD_HH-MM-SS) 按字典序就是时间顺序,
+    但 img_... 和 img_dst_... 两类文件交错排列 ('img_2' < 'img_d'), 所以按时间之前的前缀加上年份的
+    前两位 (family, 例如 images/3/img_20 和 images/3/img_dst_20) 分别记录最后一个 key,
+    每个 family 用 Prefix + StartAfter 只列出更新的对象, 前缀不会再包含其他 family 的文件。
+新的 family 或补传的旧图片只有整体重新列出时才能发现, 每隔 FULL_RESCAN_SECONDS 做一次。
+日期和时间的选择都在排序后的 timestamp 数组上二分查找 (searchsorted)。
+"""
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from leaf_area import IMAGE_DATE, parse_image_key
+
+MANIFEST_DIR = os.path.join(tempfile.gettempdir(), "ifoag1_manifests")
+FULL_RESCAN_SECONDS = 24 * 3600
+
+
+def unit_prefix(unit):
+    return f"images/{unit}/"
+
+
+class UnitManifest:
+    def __init__(self, unit, directory=MANIFEST_DIR):
+        self.unit = unit
+        self.path = os.path.join(directory, f"{unit}.parquet")
+        self.timestamps = np.empty(0, dtype='datetime64[ns]')
+        self.keys = np.empty(0, dtype=object)
+        self.types = np.empty(0, dtype=object)
+        self.etags = np.empty(0, dtype=object)
+        self.families = {}   # 时间之前的 key 前缀 -> 已列出的最后一个 key
+        self.full_scan = 0.0
+        self.listed = 0      # 最近一次刷新列出的对象数
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _set(self, frame):
+        frame = frame.sort_values(['timestamp', 'key'], kind='stable')
+        self.timestamps = frame['timestamp'].to_numpy(dtype='datetime64[ns]')
+        self.keys = frame['key'].to_numpy(dtype=object)
+        self.types = frame['type'].to_numpy(dtype=object)
+        self.etags = frame['etag'].to_numpy(dtype=object)
+
+    def _frame(self):
+        return pd.DataFrame({'timestamp': self.timestamps, 'key': self.keys, 'type': self.types, 'etag': self.etags})
+
+    def _list(self, client, bucket, prefix, start_after=None):
+        params = {'Bucket': bucket, 'Prefix': prefix}
+        if start_after:
+            params['StartAfter'] = start_after
+        rows = []
+        for page in client.get_paginator('list_objects_v2').paginate(**params):
+            for item in page.get('Contents', []):
+                key = item['Key']
+                parsed = parse_image_key(key)
+                self.listed += 1
+                if parsed:
+                    rows.append((parsed[0], key, parsed[1], item.get('ETag', '')))
+                # 不是图片的对象也要推进 family 的位置
+                match = IMAGE_DATE.search(key)
+                if match:
+                    family = key[:match.start() + 2]
+                    self.families[family] = max(self.families.get(family, ''), key)
+        return rows
+
+    def refresh(self, client, bucket, full=False):
+        """列出新增的对象并合并进清单, 返回新增的图片数"""
+        self.listed = 0
+        if full or not self.families or time.time() - self.full_scan > FULL_RESCAN_SECONDS:
+            self.families = {}
+            rows = self._list(client, bucket, unit_prefix(self.unit))
+            before = set()
+            self.full_scan = time.time()
+        else:
+            rows = []
+            for family, last in list(self.families.items()):
+                rows += self._list(client, bucket, family, last)
+            before = set(self.keys)
+        added = [row for row in rows if row[1] not in before]
+        if rows or not before:
+            new = pd.DataFrame.from_records(rows, columns=['timestamp', 'key', 'type', 'etag'])
+            new['timestamp'] = new['timestamp'].astype('datetime64[ns]')
+            frame = new if not before else pd.concat([self._frame(), new], ignore_index=True)
+            self._set(frame.drop_duplicates('key', keep='last'))
+        return len(added)
+
+    def save(self):
+        table = pa.Table.from_pandas(self._frame(), preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                               b'families': json.dumps(self.families).encode(),
+                                               b'full_scan': str(self.full_scan).encode()})
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        pq.write_table(table, tmp)
+        os.replace(tmp, self.path)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        table = pq.read_table(self.path)
+        metadata = table.schema.metadata or {}
+        self._set(table.to_pandas())
+        self.families = json.loads(metadata.get(b'families', b'{}'))
+        self.full_scan = float(metadata.get(b'full_scan', b'0'))
+        return True
+
+    def _rows(self, selection):
+        return [(key, pd.Timestamp(ts).to_pydatetime(), image_type, etag) for ts, key, image_type, etag
+                in zip(self.timestamps[selection], self.keys[selection], self.types[selection], self.etags[selection])]
+
+    def images(self):
+        """全部图片, [(key, 拍摄时间, type, etag), ...], 最新的在前 (与原来 get_image_list 的顺序一致)"""
+        return self._rows(slice(None, None, -1))
+
+    def count(self, image_type=None):
+        return len(self.types) if image_type is None else int((self.types == image_type).sum())
+
+    def dates(self):
+        """有图片的日期, 最新的在前"""
+        days = np.unique(self.timestamps.astype('datetime64[D]'))[::-1]
+        return [day.item() for day in days]
+
+    def _range(self, start, end):
+        start, end = np.datetime64(start, 'ns'), np.datetime64(end, 'ns')
+        return slice(np.searchsorted(self.timestamps, start, 'left'), np.searchsorted(self.timestamps, end, 'left'))
+
+    def on_date(self, date):
+        """某一天的图片, 最新的在前"""
+        day = datetime.combine(date, datetime.min.time())
+        return self._rows(self._range(day, day + timedelta(days=1)))[::-1]
+
+    def at(self, timestamp):
+        """拍摄时间正好是 timestamp 的图片 (原始图片和处理后图片)"""
+        return self._rows(self._range(timestamp, timestamp + timedelta(microseconds=1)))
+
+
+def load_manifest(client, bucket, unit, directory=MANIFEST_DIR):
+    """读取本地保存的清单并增量刷新"""
+    manifest = UnitManifest(unit, directory)
+    manifest.load()
+    return refresh_manifest(manifest, client, bucket)
+
+
+def refresh_manifest(manifest, client, bucket):
+    if manifest.refresh(client, bucket) or manifest.listed or not os.path.exists(manifest.path):
+        manifest.save()
+    return manifest
@@ -0,0 +1,384 @@
+"""
+叶面积的批量计算
+
+绿色区域的分割算法 (improve_green_detection / calculate_green_area_and_contour) 放在这里,
+不依赖 streamlit, 进程池的子进程只导入这个模块。
+run_batch 把一个或多个单元的全部原始图片分给进程池, 每个子进程自己从 fsspec 文件系统 (S3 上为 s3fs)
+读取图片、解码、分割, 只把 (green_area, coverage) 返回主进程。
+结果表 (unit, timestamp, key, green_area, coverage, algorithm) 保存为 Parquet, algorithm 列记录每一行的
+algorithm_tag (算法版本和分析分辨率), 每完成 CHECKPOINT_EVERY 张图片写一次;
+中断后再次运行时跳过表中已有的图片, 从停下的地方继续。
+读取失败的图片不写入结果表, run_batch 把它们的路径单独返回, 下次运行时重试。
+修改分割算法时增大 ALGORITHM_VERSION, 旧版本的行自动作废; 只改变分析分辨率时已有的行继续使用,
+只有新图片按新的分辨率计算 (没有 algorithm 列的旧表按元数据中的标识补上)。
+图片查看器用 analyze_bytes 得到单张图片的统计量和轮廓叠加图, 结果由 result_cache 缓存在本地磁盘。
+
+分析分辨率 (scale = 1/2/4/8): 大于 1 时用 IMREAD_REDUCED_COLOR_* 在 JPEG 解码阶段直接缩小,
+颜色转换、Otsu 和形态学都在小图上进行, 最小轮廓面积和形态学次数随之缩小, 面积按全分辨率与小图的像素数之比
+换算回全分辨率像素。refine=True 时再解码一次全分辨率图片, 只在掩码边缘附近 scale 个像素宽的带内
+逐像素重新判断颜色, 得到全分辨率的边缘。JPEG 只能整张解码, 第二次解码的耗时与全分辨率分析相当,
+refine 的速度基本等于全分辨率, 只在需要全分辨率边缘 (例如显示) 时使用, 批量计算默认不细化。
+不同分辨率的结果用 algorithm_tag 区分, 结果缓存不会混用。
+精度与速度的对比用 segmentation_benchmark.py 在实际图片上测量。
+
+用法:
+    python leaf_area.py s3://ifoag1/images 结果.parquet 单元 [单元 ...]
+"""
+import os
+import posixpath
+import re
+import io
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import cv2
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from PIL import Image
+
+ALGORITHM_VERSION = 1
+CHECKPOINT_EVERY = 200
+MIN_CONTOUR_AREA = 500
+THUMBNAIL_SIZE = 1024
+THUMBNAIL_QUALITY = 85
+# 叶面积趋势 (批量计算) 使用的分析分辨率, 图片查看器仍按全分辨率显示和计算;
+# 修改前先用 segmentation_benchmark.py 在实际图片上确认速度和面积误差
+TREND_SCALE = 2
+REDUCED_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+LOWER_GREEN = np.array([35, 30, 30])  # 避免太暗或饱和度太低的像素
+UPPER_GREEN = np.array([85, 255, 255])
+IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg')
+IMAGE_DATE = re.compile(r"(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})")
+TABLE_COLUMNS = ['unit', 'timestamp', 'key', 'green_area', 'coverage', 'algorithm']
+
+
+def improve_green_detection(image, iterations=2):
+    """
+    改进的绿色植物检测算法，增加了多重检查以避免错误识别黑色区域
+    """
+    # 转换到HSV色彩空间，更容易分离颜色
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+
+    # 计算图像的平均亮度
+    brightness = np.mean(hsv[:,:,2])
+
+    # 如果图像太暗（可能是全黑图像），直接返回空掩码
+    if brightness < 30:  # 可以根据需要调整这个阈值
+        return np.zeros(image.shape[:2], dtype=np.uint8)
+
+    # 创建绿色掩码
+    green_mask = cv2.inRange(hsv, LOWER_GREEN, UPPER_GREEN)
+
+    # 计算LAB色彩空间中的绿色分量
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+    l, a, b = cv2.split(lab)
+
+    # 在A通道中绿色为负值，创建另一个掩码
+    _, a_mask = cv2.threshold(a, 127, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+    # 组合HSV和LAB的掩码
+    combined_mask = cv2.bitwise_and(green_mask, a_mask)
+
+    # 使用形态学操作清理噪声
+    kernel = np.ones((3,3), np.uint8)
+    cleaned_mask = cv2.morphologyEx(combined_mask, cv2.MORPH_OPEN, kernel, iterations=iterations)
+    cleaned_mask = cv2.morphologyEx(cleaned_mask, cv2.MORPH_CLOSE, kernel, iterations=iterations)
+
+    return cleaned_mask
+
+def calculate_green_area_and_contour(image, scale=1):
+    """
+    计算绿色区域面积并绘制轮廓，增加了额外的验证
+    image 是按 scale 缩小后的图片时, 面积阈值和形态学次数按比例缩小, 返回的面积仍是小图的像素数
+    """
+    # 获取改进的绿色检测掩码
+    mask = improve_green_detection(image, iterations=max(1, 2 // scale))
+
+    # 检查掩码中非零像素的比例
+    mask_coverage = np.count_nonzero(mask) / mask.size
+
+    # 如果掩码覆盖率不合理（过高或过低），可能是错误检测
+    if mask_coverage > 0.9 or mask_coverage < 0.01:
+        return 0, image.copy(), np.zeros_like(mask)
+
+    # 寻找轮廓
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    # 过滤小的轮廓并验证形状特征
+    filtered_contours = []
+    min_contour_area = MIN_CONTOUR_AREA / (scale * scale)
+
+    for cnt in contours:
+        area = cv2.contourArea(cnt)
+        if area > min_contour_area:
+            # 计算轮廓的形状特征
+            perimeter = cv2.arcLength(cnt, True)
+            circularity = 4 * np.pi * area / (perimeter * perimeter) if perimeter > 0 else 0
+
+            # 通常植物叶片的轮廓不会太圆，也不会太不规则
+            if 0.1 < circularity < 0.9:
+                filtered_contours.append(cnt)
+
+    # 创建结果掩码和轮廓图像
+    filtered_mask = np.zeros(mask.shape, dtype=np.uint8)
+    cv2.drawContours(filtered_mask, filtered_contours, -1, 255, -1)
+
+    contour_image = image.copy()
+    cv2.drawContours(contour_image, filtered_contours, -1, (0, 255, 0), 2)
+
+    # 计算最终的绿色区域面积
+    green_area = np.sum(filtered_mask > 0)
+
+    return green_area, contour_image, filtered_mask
+
+
+def _tag_version(tag):
+    return tag.split('-', 1)[0]
+
+
+def algorithm_tag(scale=1, refine=False):
+    """结果表和结果缓存使用的算法标识, 全分辨率时就是 ALGORITHM_VERSION"""
+    if scale == 1:
+        return str(ALGORITHM_VERSION)
+    return f"{ALGORITHM_VERSION}-x{scale}{'r' if refine else ''}"
+
+
+def decode_image(data, scale=1):
+    """图片文件的字节 -> BGR 数组 (scale > 1 时在解码阶段缩小), 无法解码时返回 None"""
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), REDUCED_FLAGS[scale])
+    if image is None or image.size == 0:
+        return None
+    return image
+
+
+def image_size(data):
+    """只解析文件头得到全分辨率的 (宽, 高)"""
+    with Image.open(io.BytesIO(data)) as image:
+        return image.size
+
+
+def refine_edges(full_image, small_image, small_mask, scale):
+    """
+    把小图上的掩码放大到全分辨率, 只在边缘附近的带内按与 improve_green_detection 相同的颜色条件
+    (HSV 范围 + LAB 的 a 通道 Otsu 阈值, 阈值取自小图) 逐像素重新判断。
+    full_image 需要整张解码, 加上小图的分析, 总耗时与全分辨率分析相当。
+    """
+    height, width = full_image.shape[:2]
+    mask = cv2.resize(small_mask, (width, height), interpolation=cv2.INTER_NEAREST)
+    kernel = np.ones((2 * scale + 1, 2 * scale + 1), np.uint8)
+    band = cv2.dilate(mask, kernel) != cv2.erode(mask, kernel)
+    if not band.any():
+        return mask
+    a_small = cv2.cvtColor(small_image, cv2.COLOR_BGR2LAB)[:, :, 1]
+    a_threshold, _ = cv2.threshold(a_small, 127, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    pixels = full_image[band][:, None, :]   # (带内像素数, 1, 3), 只转换这些像素的颜色空间
+    hsv = cv2.cvtColor(pixels, cv2.COLOR_BGR2HSV)
+    a = cv2.cvtColor(pixels, cv2.COLOR_BGR2LAB)[:, 0, 1]
+    green = (cv2.inRange(hsv, LOWER_GREEN, UPPER_GREEN)[:, 0] > 0) & (a <= a_threshold)
+    mask[band] = np.where(green, 255, 0).astype(np.uint8)
+    return mask
+
+
+def render_overlay(image, filtered_mask):
+    """只保留主要绿色区域并画出轮廓 (与原来 process_image 的显示一致)"""
+    result_image = cv2.bitwise_and(image, image, mask=filtered_mask)
+    contours = cv2.findContours(filtered_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
+    cv2.drawContours(result_image, contours, -1, (0, 255, 0), 2)
+    return result_image, len(contours)
+
+
+def encode_thumbnail(image, max_side=THUMBNAIL_SIZE):
+    """缩小到最长边不超过 max_side 并编码为 JPEG 字节"""
+    scale = max_side / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])[1].tobytes()
+
+
+def analyze_image(image):
+    """
+    一张全分辨率图片的统计量 (green_area / coverage / contours / width / height) 和轮廓叠加图 (BGR);
+    无效图片的叠加图为 None, 全黑图片直接返回原图。
+    """
+    return analyze_bytes(None, image=image)
+
+
+def analyze_bytes(data, scale=1, refine=False, image=None):
+    """
+    按分析分辨率 scale 解码并分析图片文件的字节 (已经解码的全分辨率图片可以用 image 直接传入),
+    统计量都换算为全分辨率像素; 叠加图是分析所用分辨率的图片 (refine 时为全分辨率)。
+    """
+    if image is None:
+        image = decode_image(data, scale) if data is not None else None
+    else:
+        scale = 1
+    if image is None:
+        return {'green_area': 0, 'coverage': None, 'contours': 0, 'width': 0, 'height': 0}, None
+    width, height = image_size(data) if scale > 1 else image.shape[1::-1]
+    stats = {'green_area': 0, 'coverage': 0.0, 'contours': 0, 'width': width, 'height': height}
+    # 全黑或接近全黑的图片不做分割
+    if np.mean(image) < 5:
+        return stats, image
+    green_area, _, filtered_mask = calculate_green_area_and_contour(image, scale)
+    if scale > 1 and refine and green_area:
+        full_image = decode_image(data)
+        filtered_mask = refine_edges(full_image, image, filtered_mask, scale)
+        image, green_area = full_image, np.count_nonzero(filtered_mask)
+    else:
+        green_area = green_area * (width * height) / (image.shape[0] * image.shape[1])
+    overlay, contours = render_overlay(image, filtered_mask)
+    green_area = int(round(green_area))
+    stats.update(green_area=green_area, coverage=green_area / (width * height), contours=contours)
+    return stats, overlay
+
+
+def parse_image_key(key):
+    """图片路径 -> (拍摄时间, 'original' 或 'processed'), 不是单元图片时返回 None"""
+    filename = key.split('/')[-1]
+    if not key.lower().endswith(IMAGE_SUFFIXES) or not filename.startswith('img'):
+        return None
+    match = IMAGE_DATE.search(key)
+    if not match:
+        return None
+    image_type = 'processed' if filename.startswith('img_dst') else 'original'
+    return datetime.strptime(match.group(1), "%Y-%m-%d_%H-%M-%S"), image_type
+
+
+def list_originals(fs, root, unit):
+    """单元目录下所有原始图片, [(unit, 路径, 拍摄时间), ...]"""
+    images = []
+    for path in fs.find(posixpath.join(root, str(unit))):
+        parsed = parse_image_key(path)
+        if parsed and parsed[1] == 'original':
+            images.append((unit, path, parsed[0]))
+    return images
+
+
+def _empty_table():
+    return pd.DataFrame({'unit': pd.Series(dtype=object), 'timestamp': pd.Series(dtype='datetime64[ns]'),
+                         'key': pd.Series(dtype=object), 'green_area': pd.Series(dtype=np.int64),
+                         'coverage': pd.Series(dtype=np.float64), 'algorithm': pd.Series(dtype=object)})
+
+
+def load_table(fs, path):
+    """读取结果表中当前算法版本的行 (任意分析分辨率), 文件缺失时返回空表"""
+    if not fs.exists(path):
+        return _empty_table()
+    with fs.open(path, 'rb') as f:
+        table = pq.read_table(f)
+    frame = table.to_pandas()
+    if 'algorithm' not in frame.columns:
+        # 每行记录标识之前的表, 整张表用同一个标识
+        frame['algorithm'] = (table.schema.metadata or {}).get(b'algorithm', b'').decode()
+    frame = frame[frame['algorithm'].map(_tag_version) == str(ALGORITHM_VERSION)]
+    return frame.reset_index(drop=True) if len(frame) else _empty_table()
+
+
+def save_table(fs, path, frame):
+    table = pa.Table.from_pandas(frame[TABLE_COLUMNS], preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           b'algorithm': str(ALGORITHM_VERSION).encode()})
+    parent = posixpath.dirname(path)
+    if parent:
+        fs.makedirs(parent, exist_ok=True)
+    with fs.open(path, 'wb') as f:
+        pq.write_table(table, f, compression='zstd')
+
+
+# 子进程中的文件系统和分析分辨率, 由 _init_worker 设置
+_worker_fs = None
+_worker_options = {}
+
+
+def _init_worker(fs, scale, refine):
+    global _worker_fs, _worker_options
+    _worker_fs = fs
+    _worker_options = {'scale': scale, 'refine': refine}
+
+
+def _analyze(key):
+    """返回 (绿叶面积, 覆盖率); 图片读取失败时返回 None, 这张图片不写入结果表, 下次运行时重试"""
+    try:
+        with _worker_fs.open(key, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    stats, _ = analyze_bytes(data, **_worker_options)
+    return stats['green_area'], np.nan if stats['coverage'] is None else stats['coverage']
+
+
+def run_batch(image_fs, images, table_fs, table_path, workers=None, checkpoint=CHECKPOINT_EVERY, progress=None,
+              scale=TREND_SCALE, refine=False):
+    """
+    计算 images ([(unit, 路径, 拍摄时间), ...]) 中还没有结果的图片, 合并进结果表, 返回 (整张表, 读取失败的路径列表)。
+    读取失败的图片不写入结果表, 下次运行时会重新计算。
+    progress(完成数, 总数) 在每张图片完成后调用; 新计算的行按 scale / refine 对应的分析分辨率得到,
+    表中已有的行 (任意分辨率) 不重新计算。
+    """
+    tag = algorithm_tag(scale, refine)
+    table = load_table(table_fs, table_path)
+    done = set(table['key'])
+    todo = [image for image in images if image[1] not in done]
+    failed = []
+    if not todo:
+        return table, failed
+    workers = workers or os.cpu_count() or 1
+    rows = []
+
+    def flush():
+        nonlocal table, rows
+        if rows:
+            new = pd.DataFrame.from_records(rows, columns=TABLE_COLUMNS)
+            table = new if table.empty else pd.concat([table, new], ignore_index=True)
+            table = table.sort_values(['unit', 'timestamp'], kind='stable').reset_index(drop=True)
+            save_table(table_fs, table_path, table)
+            rows = []
+
+    # 调用方 (Streamlit) 是多线程进程, fork 可能把其他线程持有的锁复制进子进程, 所以用 spawn 启动
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(image_fs, scale, refine)) as pool:
+        # 结果按提交顺序返回, chunksize 减少进程间通信的次数
+        results = pool.map(_analyze, [key for _, key, _ in todo], chunksize=max(1, min(16, len(todo) // (4 * workers))))
+        for i, ((unit, key, timestamp), result) in enumerate(zip(todo, results), 1):
+            if result is None:
+                failed.append(key)
+            else:
+                rows.append((unit, pd.Timestamp(timestamp), key, *result, tag))
+            if len(rows) >= checkpoint:
+                flush()
+            if progress is not None:
+                progress(i, len(todo))
+    flush()
+    return table, failed
+
+
+def unit_history(table, unit):
+    """一个单元的叶面积时间序列, 以拍摄时间为索引"""
+    history = table[table['unit'] == unit]
+    return history.set_index('timestamp')[['green_area', 'coverage']].sort_index()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("用法: python leaf_area.py <图片根目录> <结果parquet> <单元> [<单元> ...]")
+        sys.exit(1)
+    from fsspec.core import url_to_fs
+
+    image_fs, root = url_to_fs(sys.argv[1])
+    table_fs, table_path = url_to_fs(sys.argv[2])
+    images = [image for unit in sys.argv[3:] for image in list_originals(image_fs, root, unit)]
+    print(f"共 {len(images)} 张原始图片")
+    table, failed = run_batch(image_fs, images, table_fs, table_path,
+                              progress=lambda done, total: print(f"\r{done}/{total}", end='', flush=True))
+    print()
+    if failed:
+        print(f"{len(failed)} 张图片读取失败, 下次运行时重试:")
+        for key in failed:
+            print(f"  {key}")
+    print(table.groupby('unit').agg(images=('key', 'size'), first=('timestamp', 'min'), last=('timestamp', 'max'),
+                                    max_area=('green_area', 'max')))
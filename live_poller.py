@@ -0,0 +1,58 @@
+"""
+后台轮询新数据
+
+原来 main() 最后 time.sleep(300) 再 st.rerun(): 每个会话占住一个线程 5 分钟,
+然后把所有标签页 (包括图片处理和大模型调用) 整体重算一遍, 即使没有新数据。
+现在每个进程只有一个后台线程定期调用同步函数, 把新数据增量写入共享的
+环形缓冲区和检测状态; 页面上只有实时指标区域按定时器重新运行, 直接读取这些状态。
+"""
+import threading
+import time
+
+POLL_SECONDS = 60
+
+
+class StorePoller:
+    def __init__(self, sync, interval=POLL_SECONDS):
+        """sync() 执行一次同步, 返回是否有新数据"""
+        self.sync = sync
+        self.interval = interval
+        self.last_poll = None
+        self.last_update = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def poll_once(self):
+        """同步一次, 返回是否有新数据; 出错时记录在 last_error 中"""
+        with self._lock:
+            try:
+                changed = self.sync()
+            except Exception as e:
+                self.last_error = e
+                return False
+            self.last_error = None
+            self.last_poll = time.time()
+            if changed:
+                self.last_update = self.last_poll
+            return changed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll_once()
+
+    def start(self):
+        """先在调用线程里同步一次, 保证页面第一次打开就有数据, 之后转入后台线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self.poll_once()
+        self._thread = threading.Thread(target=self._run, name='store-poller', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
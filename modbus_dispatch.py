@@ -0,0 +1,338 @@
+"""
+合并写入的 Modbus 线圈指令下发层
+
+控制逻辑的触发器不直接写总线, 而是先交给 CoilDispatcher。
+线圈默认按触发线圈 (写 FF00 按一下, 设备自己复位) 处理: 每次写入都下发, 同一次 flush 中按了两次就发两次。
+只有调用方在 latching 中列出的保持型线圈才做以下处理:
+    - 记录每个 (从站, 线圈) 最后一次被确认 (从站应答正确) 的状态, 要写的值与之相同时直接丢弃;
+      确认超过 refresh_after 秒后仍然照常下发一次, 防止设备状态被本地改动后一直不同步
+    - flush 之前对同一线圈的多次写入只保留最后一次
+两种线圈都会把同一从站地址相邻的线圈合并成一条功能码 15 (写多个线圈) 的帧, 单个线圈仍用功能码 05;
+同一个触发线圈的第 2、3 ... 次按下分别放在之后的帧中。
+总线占用按 RTU 帧计算: 每字节 11 位 (起始位 + 8 数据位 + 校验位 + 停止位), 帧间隔 3.5 个字符,
+请求和应答都计入。
+
+传输层只需要一个 request(frame) -> response 方法:
+    SimulatedBus   进程内的从站模拟器, 维护每个从站的线圈表, 支持功能码 01/05/15
+    TcpTransport   RTU over TCP (RS-485 转以太网网关的常见模式), 可以连接 serve_simulator 启动的本地模拟器
+
+用法 (用解码后的触发日志回放, 比较合并前后的总线占用):
+    python modbus_dispatch.py logs/mideA.csv [波特率] [--latching]
+日志中的写线圈全部是对触发线圈写 FF00, 回放按默认的触发线圈处理, 只统计帧合并带来的节省;
+--latching 把日志里出现的线圈都当作保持型线圈, 相同状态的重复写入会被丢弃,
+这只适用于确实是保持型的线圈, 否则节省会被高估。
+"""
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from modbus_log import crc16
+
+DEFAULT_BAUD = 9600
+BITS_PER_CHAR = 11
+REFRESH_AFTER = 600
+COIL_ON = 0xFF00
+
+
+def with_crc(body):
+    crc = int(crc16(np.frombuffer(bytes(body), dtype=np.uint8)[None, :])[0])
+    return bytes(body) + struct.pack('<H', crc)
+
+
+def check_crc(frame):
+    return len(frame) >= 4 and with_crc(frame[:-2]) == bytes(frame)
+
+
+def write_coil_frame(slave, address, on):
+    """功能码 05: 写单个线圈"""
+    return with_crc(struct.pack('>BBHH', slave, 5, address, COIL_ON if on else 0))
+
+
+def write_coils_frame(slave, start, states):
+    """功能码 15: 从 start 开始写连续多个线圈, 状态按位打包, 低位对应低地址"""
+    packed = np.packbits(np.asarray(states, dtype=np.uint8), bitorder='little').tobytes()
+    return with_crc(struct.pack('>BBHHB', slave, 15, start, len(states), len(packed)) + packed)
+
+
+def read_coils_frame(slave, start, count):
+    """功能码 01: 读线圈"""
+    return with_crc(struct.pack('>BBHH', slave, 1, start, count))
+
+
+def expected_response_length(request):
+    function = request[1]
+    if function in (5, 6, 15, 16):
+        return 8
+    if function in (1, 2):
+        count = struct.unpack('>H', request[4:6])[0]
+        return 5 + (count + 7) // 8
+    if function in (3, 4):
+        count = struct.unpack('>H', request[4:6])[0]
+        return 5 + 2 * count
+    raise ValueError(f"不支持的功能码: {function}")
+
+
+def frame_seconds(n_bytes, baud=DEFAULT_BAUD):
+    """一帧在总线上占用的时间: 字节数加 3.5 个字符的帧间隔"""
+    return (n_bytes + 3.5) * BITS_PER_CHAR / baud
+
+
+class SimulatedBus:
+    """进程内的 Modbus RTU 从站模拟器, 同时统计经过的流量"""
+
+    def __init__(self, slaves=None, coils=256, baud=DEFAULT_BAUD):
+        self.baud = baud
+        self.coils = {slave: np.zeros(coils, dtype=bool) for slave in (slaves or [])}
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.bytes = 0
+        self.busy_seconds = 0.0
+
+    def _table(self, slave):
+        if slave not in self.coils:
+            self.coils[slave] = np.zeros(256, dtype=bool)
+        return self.coils[slave]
+
+    def request(self, frame):
+        frame = bytes(frame)
+        with self.lock:
+            response = self._handle(frame)
+            self.frames += 1
+            self.bytes += len(frame) + len(response)
+            self.busy_seconds += frame_seconds(len(frame), self.baud) + frame_seconds(len(response), self.baud)
+        return response
+
+    def _handle(self, frame):
+        if not check_crc(frame):
+            # 真实从站对 CRC 错误的帧不应答
+            return b''
+        slave, function = frame[0], frame[1]
+        table = self._table(slave)
+        if function == 5:
+            address, value = struct.unpack('>HH', frame[2:6])
+            table[address] = value == COIL_ON
+            return frame
+        if function == 15:
+            start, count, _ = struct.unpack('>HHB', frame[2:7])
+            bits = np.unpackbits(np.frombuffer(frame[7:-2], dtype=np.uint8), bitorder='little')[:count]
+            table[start:start + count] = bits.astype(bool)
+            return with_crc(frame[:6])
+        if function == 1:
+            start, count = struct.unpack('>HH', frame[2:6])
+            packed = np.packbits(table[start:start + count].astype(np.uint8), bitorder='little').tobytes()
+            return with_crc(bytes([slave, 1, len(packed)]) + packed)
+        # 非法功能码异常应答
+        return with_crc(bytes([slave, function | 0x80, 1]))
+
+
+class TcpTransport:
+    """RTU over TCP: 原样发送 RTU 帧, 按功能码确定应答长度"""
+
+    def __init__(self, host, port, timeout=1.0):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+
+    def request(self, frame):
+        self.sock.sendall(frame)
+        expected = expected_response_length(frame)
+        response = b''
+        while len(response) < expected:
+            chunk = self.sock.recv(expected - len(response))
+            if not chunk:
+                break
+            response += chunk
+            # 异常应答只有 5 个字节
+            if len(response) >= 2 and response[1] & 0x80:
+                expected = 5
+        return response
+
+    def close(self):
+        self.sock.close()
+
+
+def serve_simulator(bus, host='127.0.0.1', port=0):
+    """在后台线程启动 RTU over TCP 模拟器, 返回 (server, 实际端口); 用完调用 server.shutdown()"""
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            buffer = b''
+            while True:
+                chunk = self.request.recv(256)
+                if not chunk:
+                    return
+                buffer += chunk
+                while len(buffer) >= 8:
+                    length = len(buffer)
+                    if buffer[1] == 15:
+                        length = 9 + buffer[6]
+                    elif buffer[1] in (1, 2, 3, 4, 5, 6):
+                        length = 8
+                    if len(buffer) < length:
+                        break
+                    frame, buffer = buffer[:length], buffer[length:]
+                    response = bus.request(frame)
+                    if response:
+                        self.request.sendall(response)
+
+    server = socketserver.ThreadingTCPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='modbus-simulator', daemon=True).start()
+    return server, server.server_address[1]
+
+
+class CoilDispatcher:
+    def __init__(self, transport, refresh_after=REFRESH_AFTER, latching=(), baud=DEFAULT_BAUD,
+                 clock=time.monotonic):
+        self.transport = transport
+        self.refresh_after = refresh_after
+        self.latching = set(latching)   # 保持型线圈 {(slave, address), ...}, 其余都是触发线圈
+        self.baud = baud
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.acked = {}      # (slave, address) -> (状态, 确认时间)
+        self.pending = {}    # 保持型线圈: (slave, address) -> 状态
+        self.presses = []    # 触发线圈: [((slave, address), 状态), ...], 按提交顺序, 不合并
+        self.stats = {'submitted': 0, 'dropped': 0, 'coalesced': 0, 'frames': 0, 'bytes': 0,
+                      'bus_seconds': 0.0, 'failed': 0}
+
+    def submit(self, slave, address, on):
+        """提交一次写线圈请求, 返回是否需要下发 (False 表示保持型线圈与已确认的状态相同, 被丢弃)"""
+        key = (slave, address)
+        on = bool(on)
+        with self.lock:
+            self.stats['submitted'] += 1
+            if key not in self.latching:
+                self.presses.append((key, on))
+                return True
+            acked = self.acked.get(key)
+            if (key not in self.pending and acked is not None
+                    and acked[0] == on and self.clock() - acked[1] < self.refresh_after):
+                self.stats['dropped'] += 1
+                return False
+            if key in self.pending:
+                self.stats['coalesced'] += 1
+            self.pending[key] = on
+            return True
+
+    def invalidate(self, slave=None):
+        """忘记已确认的状态 (例如从站重启或通信超时之后), 之后的写入都会下发"""
+        with self.lock:
+            if slave is None:
+                self.acked.clear()
+            else:
+                self.acked = {key: value for key, value in self.acked.items() if key[0] != slave}
+
+    @staticmethod
+    def plan(pending):
+        """把待写入的线圈按从站和相邻地址分组, 返回 [(从站, 起始地址, [状态, ...]), ...]"""
+        batches = []
+        for slave, address in sorted(pending):
+            state = pending[(slave, address)]
+            if batches and batches[-1][0] == slave and batches[-1][1] + len(batches[-1][2]) == address:
+                batches[-1][2].append(state)
+            else:
+                batches.append((slave, address, [state]))
+        return batches
+
+    def flush(self):
+        """下发所有待写入的线圈, 返回发送的帧数"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            presses, self.presses = self.presses, []
+        # 第 k 轮包含每个触发线圈的第 k 次按下, 第一轮还包含保持型线圈, 每轮内再按相邻地址合并
+        rounds = [pending]
+        counts = {}
+        for key, on in presses:
+            k = counts.get(key, 0)
+            counts[key] = k + 1
+            if k == len(rounds):
+                rounds.append({})
+            rounds[k][key] = on
+        sent = 0
+        for slave, start, states in (batch for pending in rounds for batch in self.plan(pending)):
+            if len(states) == 1:
+                frame = write_coil_frame(slave, start, states[0])
+                ok = lambda response, frame=frame: response == frame
+            else:
+                frame = write_coils_frame(slave, start, states)
+                ok = lambda response, frame=frame: response == with_crc(frame[:6])
+            response = self.transport.request(frame)
+            sent += 1
+            with self.lock:
+                self.stats['frames'] += 1
+                self.stats['bytes'] += len(frame) + len(response)
+                self.stats['bus_seconds'] += (frame_seconds(len(frame), self.baud)
+                                              + frame_seconds(len(response), self.baud))
+                if ok(response):
+                    now = self.clock()
+                    for offset, state in enumerate(states):
+                        self.acked[(slave, start + offset)] = (state, now)
+                else:
+                    self.stats['failed'] += 1
+                    for offset in range(len(states)):
+                        self.acked.pop((slave, start + offset), None)
+        return sent
+
+
+def utilization_report(frames, baud=DEFAULT_BAUD, window=pd.Timedelta(seconds=1),
+                       refresh_after=REFRESH_AFTER, latching=()):
+    """
+    用解码后的触发日志 (modbus_log.load_frames) 回放: 原来每条指令单独下发, 现在经过 CoilDispatcher,
+    间隔不超过 window 的指令在同一次 flush 中下发。返回合并前后的帧数、字节数、总线时间和占用率。
+    latching 为按保持型处理的线圈, 默认没有 (日志中的线圈都是触发线圈, 不丢弃重复写入);
+    采用的假设记录在 report.attrs['latching'] 中。
+    """
+    frames = frames[frames['crc_valid'] & (frames['function'] == 5)].sort_values('DateTime', kind='stable')
+    if frames.empty:
+        return pd.DataFrame()
+    span = (frames['DateTime'].iloc[-1] - frames['DateTime'].iloc[0]).total_seconds() or 1.0
+    # 原始流量: 每条写线圈请求 8 字节, 应答回显 8 字节
+    before = {'frames': len(frames), 'bytes': 16 * len(frames),
+              'bus_seconds': 2 * frame_seconds(8, baud) * len(frames)}
+
+    seconds = (frames['DateTime'] - frames['DateTime'].iloc[0]).dt.total_seconds().to_numpy()
+    now = [0.0]
+    dispatcher = CoilDispatcher(SimulatedBus(baud=baud), refresh_after=refresh_after, latching=latching,
+                                baud=baud, clock=lambda: now[0])
+    batch = (np.diff(seconds, prepend=-np.inf) > window.total_seconds()).cumsum()
+    slaves, addresses, states = frames['slave'].to_numpy(), frames['address'].to_numpy(), frames['coil_on'].to_numpy()
+    for i in range(len(frames)):
+        if i and batch[i] != batch[i - 1]:
+            dispatcher.flush()
+        now[0] = seconds[i]
+        dispatcher.submit(int(slaves[i]), int(addresses[i]), bool(states[i]))
+    dispatcher.flush()
+    after = {key: dispatcher.stats[key] for key in ('frames', 'bytes', 'bus_seconds')}
+
+    report = pd.DataFrame([before, after], index=['原始', '合并后'])
+    report['utilization'] = report['bus_seconds'] / span
+    report.attrs['stats'] = dict(dispatcher.stats)
+    report.attrs['latching'] = sorted(dispatcher.latching)
+    return report
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != '--latching']
+    latching = len(args) < len(sys.argv) - 1
+    if len(args) not in (1, 2):
+        print("用法: python modbus_dispatch.py <日志csv> [波特率] [--latching]")
+        sys.exit(1)
+    from fsspec.core import url_to_fs
+    from modbus_log import load_frames, written_coils
+
+    fs, path = url_to_fs(args[0])
+    baud = int(args[1]) if len(args) == 2 else DEFAULT_BAUD
+    frames = load_frames(fs, path)
+    coils = written_coils(frames) if latching else ()
+    report = utilization_report(frames, baud, latching=coils)
+    if latching:
+        print(f"假设: 日志中的 {len(coils)} 个线圈都是保持型, 与已确认状态相同的写入被丢弃")
+    else:
+        print("假设: 日志中的线圈都是触发线圈, 每次写入都下发")
+    print(report)
+    print(report.attrs['stats'])
@@ -1,8 +1,9 @@
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
+import plotly.express as px
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 import boto3
 from botocore.exceptions import ClientError
 import re
@@ -17,6 +18,24 @@ import time
 import matplotlib.pyplot as plt 
 import cv2
 from data_analyst import ai_assistants
+from data_schema import SENSOR_COLUMNS, ACTUATOR_COLUMNS, ROW_KEY, TIME_COLUMN, PLACEHOLDER_COLUMN
+from sensor_store import (STORE_ROOT, list_partitions, read_range, read_latest,
+                          store_columns, write_partitions, append_rows, read_summaries)
+from stream_stats import describe_summaries
+from tail_ingest import TailIngestor
+from live_poller import StorePoller
+from ring_buffer import RingBuffer
+from shared_cache import get_cache, cache_stats, enable_copy_on_write
+from time_index import with_time_index, slice_time
+from actuator_timeline import ActuatorTimeline
+from anomaly import AnomalyDetector
+from event_response import (PRE_MINUTES, POST_MINUTES, minute_grid, switch_events, event_windows,
+                            response_curves, response_matrix)
+from energy import PERIODS as ENERGY_PERIODS, rated_power_table, duty_and_energy, energy_summary
+from data_quality import QUALITY_DAYS, quality_report
+from cleaning import clean_frame, iqr_bounds, summarize
+from rollups import RollupEngine, RAW_RESOLUTION
+from downsample import downsample, METHODS as DOWNSAMPLE_METHODS, SCREEN_POINTS, WEBGL_THRESHOLD
 st.set_page_config(page_title='室墨司源', layout='wide')
 
 # AWS and S3 configuration
@@ -24,6 +43,19 @@ AWS_ACCESS_KEY_ID = st.secrets["AWS_ACCESS_KEY_ID"]
 AWS_SECRET_ACCESS_KEY = st.secrets["AWS_SECRET_ACCESS_KEY"]
 AWS_DEFAULT_REGION = st.secrets["AWS_DEFAULT_REGION"]
 S3_BUCKET_NAME = "ifoag1"
+DATA_PATH = "ifoag1/integral_data2.csv"
+CHECKPOINT_PATH = "ifoag1/integral_store/_checkpoint.json"
+SETTINGS_PATH = "ifoag1/settings.json"
+LIVE_REFRESH_SECONDS = 30
+RING_CAPACITY = 1440
+ANOMALY_KINDS = {'ewma': '偏离滑动均值', 'mad': '偏离中位数', 'rate': '变化过快'}
+
+HISTORY_CACHE_BYTES = 1024 * 1024 * 1024
+
+# 进程内所有会话共享的缓存, 同一份数据只加载一次、只保存一份
+enable_copy_on_write()
+history_cache = get_cache('history', ttl=600, max_bytes=HISTORY_CACHE_BYTES)
+settings_cache = get_cache('settings', ttl=600)
 
 s3_client = boto3.client('s3', 
                          aws_access_key_id=AWS_ACCESS_KEY_ID,
@@ -40,16 +72,191 @@ moonshot_llm = Moonshot(model="moonshot-v1-128k",
 
 # Data loading functions
 
-def load_data(conn):
+@st.cache_resource
+def get_ingestor(_conn):
+    return TailIngestor(_conn.fs, DATA_PATH, checkpoint_path=CHECKPOINT_PATH)
+
+@st.cache_resource
+def get_rollups(_conn):
+    """加载与检查点一致的聚合结果, 不一致时从分区存储重新构建一次"""
+    engine = RollupEngine([col for columns in column_groups.values() for col in columns])
+    if not engine.load(_conn.fs, STORE_ROOT, get_ingestor(_conn).offset):
+        days = list_partitions(_conn.fs, STORE_ROOT)
+        if days:
+            engine.update(read_range(_conn.fs, STORE_ROOT, days[0], days[-1], engine.columns))
+    return engine
+
+@st.cache_resource
+def get_latest_buffer(_conn):
+    """最近 RING_CAPACITY 行读数, 启动时从分区存储读取一次, 之后由后台同步追加"""
+    ring = RingBuffer(SENSOR_COLUMNS, RING_CAPACITY)
+    ring.append(read_latest(_conn.fs, STORE_ROOT, RING_CAPACITY, SENSOR_COLUMNS))
+    return ring
+
+@st.cache_resource
+def get_timeline(_conn):
+    """所有执行器的开关区间, 启动时从分区存储编码一次, 之后由后台同步追加"""
+    timeline = ActuatorTimeline(ACTUATOR_COLUMNS)
+    days = list_partitions(_conn.fs, STORE_ROOT)
+    if days:
+        timeline.update(read_range(_conn.fs, STORE_ROOT, days[0], days[-1], [ROW_KEY] + ACTUATOR_COLUMNS))
+    return timeline
+
+@st.cache_resource
+def get_detector(_conn):
+    """读取与检查点一致的异常检测状态, 不一致时把分区存储中的历史回放一次"""
+    detector = AnomalyDetector([col for columns in column_groups.values() for col in columns])
+    if not detector.load(_conn.fs, STORE_ROOT, get_ingestor(_conn).offset):
+        days = list_partitions(_conn.fs, STORE_ROOT)
+        if days:
+            detector.replay(read_range(_conn.fs, STORE_ROOT, days[0], days[-1], [ROW_KEY] + detector.columns))
+    return detector
+
+def sync_changes(fs, ingestor, rollups, ring, timeline, detector):
+    """
+    增量同步: 只读取 CSV 新追加的尾部并写入当天的分区, 同时更新多分辨率聚合,
+    第一次运行或 CSV 被重写时才完整加载一次。返回是否有新数据。
+    """
+    with ingestor.lock:
+        new_rows, reloaded = ingestor.poll()
+        changed_days = None
+        if reloaded:
+            write_partitions(fs, STORE_ROOT, new_rows)
+            rollups.reset()
+            ring.reset()
+            timeline.reset()
+            # 整个文件重新加载时异常检测用向量化的 replay 从头计算, 与逐行处理的结果相同
+            detector.replay(new_rows)
+        elif not new_rows.empty:
+            changed_days = append_rows(fs, STORE_ROOT, new_rows)
+            detector.update(new_rows)
+        else:
+            return False
+        rollups.update(new_rows)
+        ring.append(new_rows)
+        timeline.update(new_rows)
+        rollups.save(fs, STORE_ROOT, ingestor.offset)
+        detector.save(fs, STORE_ROOT, ingestor.offset)
+        ingestor.save_checkpoint()
+    if changed_days is None:
+        history_cache.invalidate()
+    else:
+        # 只清除日期范围覆盖了新数据所在日期的查询, 其他日期的结果继续使用
+        history_cache.invalidate_where(lambda key: covers_days(key, changed_days))
+    return True
+
+def covers_days(key, days):
+    """history_cache 的 key 是否受这些日期的新数据影响; 不带日期范围的 key (分区列表、列名) 总是受影响"""
+    if not isinstance(key, tuple):
+        return True
+    start_date, end_date = key[1], key[2]
+    return any(start_date <= day <= end_date for day in days)
+
+@st.cache_resource
+def get_poller(_conn):
+    """每个进程一个后台轮询线程, 所有会话共用"""
+    ingestor = get_ingestor(_conn)
+    rollups = get_rollups(_conn)
+    ring = get_latest_buffer(_conn)
+    timeline = get_timeline(_conn)
+    detector = get_detector(_conn)
+    poller = StorePoller(lambda: sync_changes(_conn.fs, ingestor, rollups, ring, timeline, detector))
+    poller.start()
+    return poller
+
+def sync_store(conn):
+    poller = get_poller(conn)
+    if poller.last_error is not None:
+        st.error(f"同步S3数据时出错: {str(poller.last_error)}")
+        return False
+    return True
+
+def load_store_days(conn):
     try:
-        return conn.read("ifoag1/integral_data2.csv", input_format="csv", ttl=600)
+        return history_cache.get('days', lambda: list_partitions(conn.fs, STORE_ROOT))
+    except Exception as e:
+        st.error(f"从S3读取分区列表时出错: {str(e)}")
+        return []
+
+def load_store_columns(conn):
+    try:
+        return history_cache.get('columns', lambda: store_columns(conn.fs, STORE_ROOT))
+    except Exception as e:
+        st.error(f"从S3读取数据列时出错: {str(e)}")
+        return []
+
+def load_store_range(conn, start_date, end_date, columns=None):
+    """返回以 DateTime 为单调递增索引的数据, 之后按时间筛选都用 slice_time"""
+    try:
+        return history_cache.get(('range', start_date, end_date, columns),
+                                 lambda: with_time_index(read_range(conn.fs, STORE_ROOT, start_date, end_date, columns)))
     except Exception as e:
         st.error(f"从S3加载数据时出错: {str(e)}")
         return None
 
+def load_iqr_bounds(conn, start_date, end_date, columns):
+    """每个 (日期范围, 列集合) 只计算一次所有列的 IQR 上下界"""
+    def compute():
+        filtered_df = load_store_range(conn, start_date, end_date, columns)
+        return iqr_bounds(clean_frame(filtered_df, columns))
+    return history_cache.get(('iqr_bounds', start_date, end_date, columns), compute)
+
+def load_clean_range(conn, start_date, end_date, columns, simple_clean=True):
+    """清洗后的数据, 图表和摘要统计共用"""
+    def compute():
+        filtered_df = load_store_range(conn, start_date, end_date, columns)
+        if filtered_df is None or filtered_df.empty:
+            return filtered_df
+        bounds = None if simple_clean else load_iqr_bounds(conn, start_date, end_date, columns)
+        return clean_frame(filtered_df, columns, simple_clean, bounds)
+    return history_cache.get(('clean', start_date, end_date, columns, simple_clean), compute)
+
+def load_quality_report(conn, start_date, end_date):
+    def compute():
+        filtered_df = load_store_range(conn, start_date, end_date)
+        if filtered_df is None:
+            return None
+        return quality_report(filtered_df)
+    return history_cache.get(('quality', start_date, end_date), compute)
+
+def load_response_grid(conn, start_date, end_date, columns):
+    """传感器数据的每分钟网格, 执行器响应分析的所有组合共用"""
+    def compute():
+        filtered_df = load_store_range(conn, start_date, end_date, columns)
+        return minute_grid(filtered_df, columns)
+    return history_cache.get(('response_grid', start_date, end_date, columns), compute)
+
+def load_response(conn, start_date, end_date, columns, actuator, direction):
+    def compute():
+        grid_start, grid, present = load_response_grid(conn, start_date, end_date, columns)
+        events = switch_events(get_timeline(conn), actuator, direction)
+        windows = event_windows(grid, grid_start, events, PRE_MINUTES, POST_MINUTES)
+        if not len(windows):
+            return None, None
+        return response_curves(windows, present, PRE_MINUTES)
+    return history_cache.get(('response', start_date, end_date, columns, actuator, direction), compute)
+
+def load_response_matrix(conn, start_date, end_date, columns, direction):
+    def compute():
+        grid_start, grid, present = load_response_grid(conn, start_date, end_date, columns)
+        timeline = get_timeline(conn)
+        return response_matrix(timeline, grid, grid_start, timeline.columns, present, direction)
+    return history_cache.get(('response_matrix', start_date, end_date, columns, direction), compute)
+
+def load_summary_table(conn, start_date, end_date, columns):
+    try:
+        return history_cache.get(('summary', start_date, end_date, columns),
+                                 lambda: describe_summaries(read_summaries(conn.fs, STORE_ROOT, start_date, end_date), columns))
+    except Exception as e:
+        st.error(f"从S3加载摘要统计时出错: {str(e)}")
+        return None
+
 def load_settings(conn):
+    def read():
+        with conn.fs.open(SETTINGS_PATH, 'r') as f:
+            return json.load(f)
     try:
-        return conn.read("ifoag1/settings.json", input_format="json", ttl=600)
+        return settings_cache.get('settings', read)
     except Exception as e:
         st.error(f"从S3加载设置时出错: {str(e)}")
         return None
@@ -57,6 +264,7 @@ def load_settings(conn):
 def save_settings(conn, settings):
     try:
         conn.write("settings.json", json.dumps(settings, indent=2))
+        settings_cache.invalidate()
         st.success("设置更新成功!")
     except Exception as e:
         st.error(f"更新设置失败: {str(e)}")
@@ -107,53 +315,73 @@ def settings_editor(conn, settings):
 
 
 
-def data_viewer(df):
+column_groups = {
+    '温度': ['Temperature', 'Temperature1', 'Temperature2', 'Temperature3','TempA','TempB','TempC','WTEMP'],
+    '湿度': ['Humidity', 'Humidity1', 'Humidity2', 'Humidity3', 'HumiA','HumiB','HumiC'],
+    'CO2': ['CO2PPM','CO2PPM1','CO2PPM2','CO2PPM3','CO2PPMA','CO2PPMB','CO2PPMC'],
+    'EC': ['EC'],
+    'pH': ['pH'],
+    '水位': ['Wlevel']
+}
+
+def data_viewer(conn):
     st.header("数据查看器")
-    
-    if df is None or df.empty:
+
+    days = load_store_days(conn)
+    if not days:
         st.warning("没有可用的数据进行可视化。")
         return
 
-    df['DateTime'] = pd.to_datetime(df['DateTime_y'])
-    
     date_range = st.date_input(
         "选择日期范围",
-        [df['DateTime'].min().date(), df['DateTime'].max().date()]
+        [days[0], days[-1]]
     )
     start_date, end_date = date_range
-    mask = (df['DateTime'].dt.date >= start_date) & (df['DateTime'].dt.date <= end_date)
-    filtered_df = df.loc[mask]
 
-    def clean_data(series, simple_clean=True):
-      # 移除-1值
-      series = series[series != -1]
-      
-      if simple_clean or len(series) <= 100:
-          # 数据量小于等于1000时，只去除-1值
-          return series
-      else:
-          # 数据量大时，使用完整的异常值清洗
-          Q1 = series.quantile(0.25)
-          Q3 = series.quantile(0.75)
-          IQR = Q3 - Q1
-          lower_bound = Q1 - 1.2 * IQR
-          upper_bound = Q3 + 1.2 * IQR
-          return series[(series >= lower_bound) & (series <= upper_bound)]
-
-    column_groups = {
-        '温度': ['Temperature', 'Temperature1', 'Temperature2', 'Temperature3','TempA','TempB','TempC','WTEMP'],
-        '湿度': ['Humidity', 'Humidity1', 'Humidity2', 'Humidity3', 'HumiA','HumiB','HumiC'],
-        'CO2': ['CO2PPM','CO2PPM1','CO2PPM2','CO2PPM3','CO2PPMA','CO2PPMB','CO2PPMC'],
-        'EC': ['EC'],
-        'pH': ['pH'],
-        '水位': ['Wlevel']
-    }
+    # 只读取所选日期范围内的分区, 以及图表和摘要统计需要的传感器列
+    available_columns = set(load_store_columns(conn))
+    sensor_columns = tuple(col for col in SENSOR_COLUMNS if col in available_columns)
+
+    # 默认只去除-1值; 开启IQR清洗时, 图表和摘要统计共用整个日期范围清洗后的同一份结果
+    simple_clean = not st.checkbox("完整异常值清洗 (IQR)", value=False)
+
+    # 缩放: 在所选日期范围内选一个时间窗口, 窗口内点数不超过屏幕分辨率时按原始分辨率绘制
+    first_time = datetime.combine(start_date, datetime.min.time())
+    last_time = datetime.combine(end_date, datetime.max.time()).replace(second=0, microsecond=0)
+    col1, col2 = st.columns([7, 3])
+    with col1:
+        window_start, window_end = st.slider("缩放时间窗口",
+                                             min_value=first_time,
+                                             max_value=last_time,
+                                             value=(first_time, last_time),
+                                             step=timedelta(minutes=1),
+                                             format="MM-DD HH:mm")
+    with col2:
+        downsample_method = st.radio("降采样方式", list(DOWNSAMPLE_METHODS), horizontal=True)
+
+    # 时间窗口较长时, 曲线直接使用预先聚合好的最粗且点数足够的分辨率
+    rollup_engine = get_rollups(conn)
+    resolution = rollup_engine.choose_resolution(window_start, window_end, SCREEN_POINTS)
+    # 聚合数据只去除了-1值, 开启IQR清洗时使用原始分辨率
+    if resolution != RAW_RESOLUTION and simple_clean:
+        plot_df = rollup_engine.query(window_start, window_end, resolution)['mean']
+        st.caption(f"时间窗口较长, 曲线显示 {resolution} 聚合均值")
+    else:
+        # 只读取时间窗口覆盖的分区; IQR清洗的上下界按整个日期范围计算
+        if simple_clean:
+            filtered_df = load_clean_range(conn, window_start.date(), window_end.date(), sensor_columns)
+        else:
+            filtered_df = load_clean_range(conn, start_date, end_date, sensor_columns, simple_clean)
+        if filtered_df is None or filtered_df.empty:
+            st.warning("没有可用的数据进行可视化。")
+            return
+        plot_df = slice_time(filtered_df, window_start, window_end)
 
     for group, columns in column_groups.items():
         st.subheader(f'{group}数据')
         
         # 找出第一个有效的列
-        valid_columns = [col for col in columns if col in filtered_df.columns]
+        valid_columns = [col for col in columns if col in sensor_columns]
         if not valid_columns:
             st.warning(f"没有找到 {group} 的有效数据。")
             continue
@@ -168,16 +396,24 @@ def data_viewer(df):
         if selected_columns:
             fig = go.Figure()
             for column in selected_columns:
-                # 检查数据量
-                data_series = filtered_df[column]
-                # 仅去除-1值
-                clean_series = clean_data(filtered_df[column]) #data_series[data_series != -1]
+                if column not in plot_df.columns:
+                    continue
+                clean_series = plot_df[column].dropna()
                 
                 if not clean_series.empty:
-                    fig.add_trace(go.Scatter(x=filtered_df.loc[clean_series.index, 'DateTime'], 
-                                            y=clean_series, 
-                                            mode='lines', 
-                                            name=column))
+                    # 每条曲线最多保留约屏幕分辨率的点数, 点数仍然较多时使用WebGL绘制
+                    x = clean_series.index.to_numpy()
+                    y = clean_series.to_numpy()
+                    keep = downsample(x, y, SCREEN_POINTS, downsample_method)
+                    scatter = go.Scattergl if len(keep) > WEBGL_THRESHOLD else go.Scatter
+                    fig.add_trace(scatter(x=x[keep], 
+                                          y=y[keep], 
+                                          mode='lines', 
+                                          name=column))
+
+            if not fig.data:
+                st.warning(f"所选时间范围内没有 {group} 的有效数据。")
+                continue
 
             y_max = max([trace.y.max() for trace in fig.data])
             y_min = min([trace.y.min() for trace in fig.data])
@@ -193,22 +429,30 @@ def data_viewer(df):
         else:
             st.warning(f"请选择至少一个 {group} 数据列进行显示。")
 
-    # 添加摘要统计表
-    st.subheader("摘要统计")
-    numeric_columns = df.select_dtypes(include=[np.number]).columns
-    
-    # 创建一个新的DataFrame来存储清理后的摘要统计
-    summary_df = pd.DataFrame()
-    
-    for column in numeric_columns:
-        clean_series = clean_data(filtered_df[column])
-        if not clean_series.empty:
-            summary_df[column] = clean_series.describe()
-    
-    st.dataframe(summary_df)
+    actuator_timeline_view(conn, window_start, window_end)
+    anomaly_events_view(conn, window_start, window_end)
+    # 响应分析需要读取原始分区, 只在勾选后按缩放窗口覆盖的日期计算
+    if st.checkbox("显示执行器响应分析", value=False):
+        response_view(conn, window_start.date(), window_end.date(), sensor_columns)
+
+    summary_col, energy_col = st.columns([3, 2])
+    with summary_col:
+        # 添加摘要统计表
+        st.subheader("摘要统计")
+        if simple_clean:
+            # 合并各分区预先计算的摘要, 不读取原始行 (分位数为近似值, 误差见 stream_stats)
+            summary_df = load_summary_table(conn, start_date, end_date, sensor_columns)
+        else:
+            summary_df = summarize(filtered_df)
+        st.dataframe(summary_df)
+
+    with energy_col:
+        energy_panel(conn, start_date, end_date)
+
+    if st.checkbox("显示数据质量报告", value=False):
+        quality_panel(load_quality_report(conn, start_date, end_date))
 
     # 添加数据下载按钮
-    csv = filtered_df.to_csv(index=False)
     #st.download_button(
     #    label="下载CSV数据",
     #    data=csv,
@@ -217,6 +461,120 @@ def data_viewer(df):
     #)
 
 
+def quality_panel(report):
+    """时间缺口、缺失值、-1无效值和冻结传感器"""
+    st.subheader("数据质量")
+    if report is None or not report['rows']:
+        st.warning("所选日期范围内没有数据。")
+        return
+    gaps = report['gaps']
+    col1, col2, col3 = st.columns(3)
+    col1.metric("记录数", report['rows'])
+    col2.metric("时间缺口", len(gaps))
+    col3.metric("估计缺失行数", int(gaps['missing_rows'].sum()))
+    st.dataframe(report['columns'].rename(columns={'missing': '缺失值',
+                                                   'placeholders': '占位字符串',
+                                                   'sentinels': '-1无效值',
+                                                   'frozen_runs': '冻结次数',
+                                                   'longest_frozen_rows': '最长冻结行数',
+                                                   'frozen_rows': '冻结行数',
+                                                   'valid_ratio': '有效比例'}))
+    if not gaps.empty:
+        st.write("时间缺口")
+        st.dataframe(gaps.sort_values('duration', ascending=False))
+    if not report['frozen'].empty:
+        st.write("读数冻结片段")
+        st.dataframe(report['frozen'])
+
+def energy_panel(conn, start_date, end_date):
+    """各设备的占空比和用电量, 由执行器开关区间和额定功率计算"""
+    st.subheader("能耗统计")
+    settings = load_settings(conn) or {}
+    ratings = rated_power_table(settings.get('rated_power_kw'))
+    timeline = get_timeline(conn)
+    start = datetime.combine(start_date, datetime.min.time())
+    end = datetime.combine(end_date + timedelta(days=1), datetime.min.time())
+
+    summary = energy_summary(timeline, start, end, ratings)
+    st.metric("总用电量 (kWh)", f"{summary['kwh'].sum():.1f}")
+    st.dataframe(summary[['on_hours', 'duty_cycle', 'kwh']].rename(columns={'on_hours': '开启时长 (小时)',
+                                                                         'duty_cycle': '占空比',
+                                                                         'kwh': '用电量 (kWh)'}))
+
+    period = st.radio("统计周期", list(ENERGY_PERIODS), index=1, horizontal=True)
+    _, energy = duty_and_energy(timeline, start, end, ENERGY_PERIODS[period], ratings)
+    energy = energy.loc[:, energy.sum() > 0]
+    if energy.empty:
+        st.info("所选日期范围内没有设备用电。")
+        return
+    fig = go.Figure([go.Bar(x=energy.index, y=energy[device], name=device) for device in energy.columns])
+    fig.update_layout(barmode='stack', xaxis_title='日期时间', yaxis_title='用电量 (kWh)',
+                      legend_title='设备', height=400)
+    st.plotly_chart(fig, use_container_width=True)
+
+def response_view(conn, start_date, end_date, sensor_columns):
+    """执行器开关后传感器的平均响应曲线、滞后时间和增益"""
+    st.subheader("执行器响应分析")
+    timeline = get_timeline(conn)
+    col1, col2 = st.columns([7, 3])
+    with col1:
+        default = timeline.columns.index('CO2') if 'CO2' in timeline.columns else 0
+        actuator = st.selectbox("执行器", timeline.columns, index=default)
+    with col2:
+        direction = {'开启': 'on', '关闭': 'off'}[st.radio("事件", ['开启', '关闭'], horizontal=True)]
+    curves, stats = load_response(conn, start_date, end_date, sensor_columns, actuator, direction)
+    if curves is None:
+        st.info("所选日期范围内没有该执行器的开关事件。")
+        return
+    default_sensors = [col for col in ['CO2PPM', 'Temperature', 'Humidity'] if col in curves.columns]
+    selected = st.multiselect("选择传感器", options=list(curves.columns), default=default_sensors)
+    if selected:
+        fig = go.Figure([go.Scatter(x=curves.index, y=curves[col], mode='lines', name=col) for col in selected])
+        fig.add_vline(x=0, line_dash='dash')
+        fig.update_layout(xaxis_title='相对事件的时间 (分钟)', yaxis_title='相对事件前的变化',
+                          legend_title='传感器', height=400)
+        st.plotly_chart(fig, use_container_width=True)
+    st.dataframe(stats.rename(columns={'events': '事件数', 'gain': '增益', 'peak_minutes': '峰值时间 (分钟)',
+                                       'lag_minutes': '滞后 (分钟)', 'settled': '稳态变化'}))
+    if st.checkbox("显示所有执行器与传感器的响应", value=False):
+        st.dataframe(load_response_matrix(conn, start_date, end_date, sensor_columns, direction))
+
+def anomaly_events_view(conn, window_start, window_end):
+    st.subheader("异常事件")
+    events = get_detector(conn).recent_events(since=window_start)
+    events = events[events['time'] < pd.Timestamp(window_end) + timedelta(minutes=1)]
+    if events.empty:
+        st.info("所选时间窗口内没有检测到异常。")
+        return
+    counts = events.groupby(['column', 'kind']).size().unstack(fill_value=0).rename(columns=ANOMALY_KINDS)
+    st.dataframe(counts)
+    st.dataframe(events.sort_values('time', ascending=False).assign(kind=events['kind'].map(ANOMALY_KINDS)))
+
+def actuator_timeline_view(conn, window_start, window_end):
+    """执行器开关甘特图, 直接由开关区间绘制, 不读取逐分钟的行"""
+    st.subheader("执行器开关时间线")
+    timeline = get_timeline(conn)
+    window_end = window_end + timedelta(minutes=1)
+    summary = timeline.summary(window_start, window_end)
+    active = summary.index[summary['on_hours'] > 0].tolist()
+    selected = st.multiselect("选择要显示的执行器", options=timeline.columns, default=active)
+    if not selected:
+        st.info("所选时间窗口内没有执行器开启。")
+        return
+    gantt = timeline.gantt(window_start, window_end, selected)
+    if gantt.empty:
+        st.info("所选执行器在时间窗口内没有开启。")
+    else:
+        fig = px.timeline(gantt, x_start='Start', x_end='Finish', y='Task', color='Task')
+        fig.update_yaxes(categoryorder='array', categoryarray=selected[::-1], title='')
+        fig.update_layout(xaxis_title='日期时间', showlegend=False,
+                          height=max(300, 30 * len(selected) + 120),
+                          xaxis=dict(range=[window_start, window_end]))
+        st.plotly_chart(fig, use_container_width=True)
+    st.dataframe(summary.loc[selected].rename(columns={'on_hours': '开启时长 (小时)',
+                                                       'duty_cycle': '占空比',
+                                                       'switches': '开启次数'}))
+
     
 def get_available_units():
     try:
@@ -242,7 +600,10 @@ def extract_date_from_filename(filename):
 
 from visual_data_process import image_viewer
       
-def overview_tab(df):
+# 页面上只有这一块按定时器刷新, 由浏览器端计时, 空闲的会话不占用服务器线程
+fragment = getattr(st, 'fragment', None) or st.experimental_fragment
+
+def overview_tab(conn):
     st.header("综合概览")
 
     col1, col2 = st.columns([7, 3])
@@ -251,52 +612,71 @@ def overview_tab(df):
         image_viewer()
 
     with col2:
-        st.subheader("最新环境数据")
-        
-        if df is not None and not df.empty:
-            latest_data = df.iloc[-1]
-            previous_data = df.iloc[-2] if len(df) > 1 else latest_data
-
-            # 温度
-            temperature_diff = latest_data['Temperature'] - previous_data['Temperature']
-            st.metric(label="温度 (°C)", 
-                      value=f"{latest_data['Temperature']:.1f}",
-                      delta=f"{temperature_diff:.1f}")
-
-            # 湿度
-            humidity_diff = latest_data['Humidity'] - previous_data['Humidity']
-            st.metric(label="湿度 (%)", 
-                      value=f"{latest_data['Humidity']:.1f}",
-                      delta=f"{humidity_diff:.1f}")
-
-            # CO2 (如果有的话)
-            if 'CO2PPM' in df.columns:
-                co2_diff = latest_data['CO2PPM'] - previous_data['CO2PPM']
-                st.metric(label="CO2 (ppm)", 
-                          value=f"{latest_data['CO2PPM']:.0f}",
-                          delta=f"{co2_diff:.0f}")
-
-            # pH值
-            if 'pH' in df.columns:
-                ph_diff = latest_data['pH'] - previous_data['pH']
-                ph_value = latest_data['pH']
-                st.metric(label="pH值", 
-                          value=f"{ph_value:.2f}",
-                          delta=f"{ph_diff:.2f}")
-                
-                # pH警告
-                if ph_value < 5 or ph_value > 7:
-                    st.warning(f"警告：pH值 ({ph_value:.2f}) 超出正常范围 (5-7)!")
-
-            # EC值
-            if 'EC' in df.columns:
-                ec_diff = latest_data['EC'] - previous_data['EC']
-                st.metric(label="EC值 (mS/cm)", 
-                          value=f"{latest_data['EC']:.2f}",
-                          delta=f"{ec_diff:.2f}")
+        live_metrics(conn)
+
+@fragment(run_every=LIVE_REFRESH_SECONDS)
+def live_metrics(conn):
+    st.subheader("最新环境数据")
+    poller = get_poller(conn)
+    latest = get_latest_buffer(conn).tail(2)
+    render_latest_metrics(latest)
+    if not latest.empty:
+        render_anomaly_alerts(get_detector(conn), latest[TIME_COLUMN].iloc[-1])
+    if poller.last_update is not None:
+        st.caption(f"数据更新于 {datetime.fromtimestamp(poller.last_update):%Y-%m-%d %H:%M:%S}")
+
+def render_anomaly_alerts(detector, latest_time, window=timedelta(hours=1), limit=5):
+    """最近一小时内检测到的异常, 来自后台同步增量维护的检测状态"""
+    events = detector.recent_events(since=latest_time - window)
+    for event in events.tail(limit).iloc[::-1].itertuples():
+        st.warning(f"异常: {event.column} 在 {event.time:%H:%M} 读数 {event.value:.2f} "
+                   f"({ANOMALY_KINDS.get(event.kind, event.kind)}, 分数 {event.score:.1f})")
+
+def render_latest_metrics(df):
+    if df is not None and not df.empty:
+        latest_data = df.iloc[-1]
+        previous_data = df.iloc[-2] if len(df) > 1 else latest_data
+
+        # 温度
+        temperature_diff = latest_data['Temperature'] - previous_data['Temperature']
+        st.metric(label="温度 (°C)", 
+                  value=f"{latest_data['Temperature']:.1f}",
+                  delta=f"{temperature_diff:.1f}")
+
+        # 湿度
+        humidity_diff = latest_data['Humidity'] - previous_data['Humidity']
+        st.metric(label="湿度 (%)", 
+                  value=f"{latest_data['Humidity']:.1f}",
+                  delta=f"{humidity_diff:.1f}")
+
+        # CO2 (如果有的话)
+        if 'CO2PPM' in df.columns:
+            co2_diff = latest_data['CO2PPM'] - previous_data['CO2PPM']
+            st.metric(label="CO2 (ppm)", 
+                      value=f"{latest_data['CO2PPM']:.0f}",
+                      delta=f"{co2_diff:.0f}")
+
+        # pH值
+        if 'pH' in df.columns:
+            ph_diff = latest_data['pH'] - previous_data['pH']
+            ph_value = latest_data['pH']
+            st.metric(label="pH值", 
+                      value=f"{ph_value:.2f}",
+                      delta=f"{ph_diff:.2f}")
+            
+            # pH警告
+            if ph_value < 5 or ph_value > 7:
+                st.warning(f"警告：pH值 ({ph_value:.2f}) 超出正常范围 (5-7)!")
+
+        # EC值
+        if 'EC' in df.columns:
+            ec_diff = latest_data['EC'] - previous_data['EC']
+            st.metric(label="EC值 (mS/cm)", 
+                      value=f"{latest_data['EC']:.2f}",
+                      delta=f"{ec_diff:.2f}")
 
-        else:
-            st.warning("无法加载最新的环境数据。")
+    else:
+        st.warning("无法加载最新的环境数据。")
 
 
 #conn = st.connection('s3', type=FilesConnection)
@@ -316,32 +696,39 @@ def main():
     # 创建标签页
     tab0, tab2, tab3 = st.tabs(["即时反馈面板", "历史数据查看", "生生AI问答"])
 
-    # 添加刷新按钮
+    # 添加刷新按钮 (点击本身就会重新运行页面, 这里先立即同步一次)
     if st.button("刷新数据"):
-        st.rerun()
+        get_poller(conn).poll_once()
 
-    # 加载最新数据
-    df = load_data(conn)
+    # 加载最新数据 (按天分区存储, 只读取需要的分区和列)
+    if sync_store(conn) and load_store_days(conn):
+        days = load_store_days(conn)
 
-    if df is not None:
         with tab0:
-            overview_tab(df)
+            overview_tab(conn)
 
         #with tab1:
         #    settings_editor(conn, settings)
 
         with tab2:
-            data_viewer(df)
+            data_viewer(conn)
 
         with tab3:
-            ai_assistants(df)
+            # 与原来一样把全部历史交给AI问答 ("最近七天" 由问题本身限定),
+            # DateTime 恢复为普通列, 代理生成的代码才能按列名使用它
+            history = load_store_range(conn, days[0], days[-1])
+            if history is not None:
+                # 数据完整性只看最近七天, 与数据查看器共用缓存的报告
+                quality = load_quality_report(conn, days[-1] - timedelta(days=QUALITY_DAYS - 1), days[-1])
+                ai_assistants(history.reset_index().drop(columns=PLACEHOLDER_COLUMN, errors='ignore'), quality)
     else:
         st.warning("数据加载失败，请检查网络连接或S3配置。")
 
-    # 添加自动刷新功能
-    st.write("页面将每5分钟自动刷新一次")
-    time.sleep(300)  # 等待5分钟
-    st.rerun()  # 重新运行整个应用
+    with st.expander("缓存状态"):
+        st.dataframe(cache_stats())
+
+    # 实时指标每 LIVE_REFRESH_SECONDS 秒刷新一次, 其他标签页只在操作时重新运行
+    st.write(f"最新环境数据每{LIVE_REFRESH_SECONDS}秒自动刷新一次")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,105 @@
+"""
+图片分析结果的本地磁盘缓存 (按内容寻址)
+
+S3 上的图片写入后不会再变化, 同一张图片的分割结果每次都一样。
+缓存键是 (S3 路径, ETag, 算法标识) 的 SHA-256: 图片被覆盖时 ETag 改变, 修改分割算法或分析分辨率时
+leaf_area.algorithm_tag 改变, 旧结果都不会再被命中。
+每个条目一个文件: 第一行是 JSON 格式的统计量 (green_area / coverage / contours / width / height),
+之后是 JPEG 编码的轮廓叠加缩略图。写入先写临时文件再 os.replace, 多个进程同时使用也不会读到半个文件。
+缓存总大小超过 max_bytes 时按最近访问时间 (命中时更新文件的 mtime) 删除最旧的条目, 降到 max_bytes 的 80%。
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from leaf_area import algorithm_tag
+
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "ifoag1_results")
+MAX_BYTES = 512 * 1024 * 1024
+EVICT_TO = 0.8
+SUFFIX = ".result"
+
+
+def result_key(s3_key, etag, version=None):
+    version = version or algorithm_tag()
+    return hashlib.sha256(f"{s3_key}\0{etag}\0{version}".encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in self._entries())
+
+    def _entries(self):
+        for shard in os.scandir(self.directory):
+            if shard.is_dir():
+                yield from (entry for entry in os.scandir(shard.path) if entry.name.endswith(SUFFIX))
+
+    def _path(self, key):
+        # 按前两位分子目录, 避免单个目录下文件过多
+        return os.path.join(self.directory, key[:2], key + SUFFIX)
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        """返回 (统计量 dict, 缩略图字节), 未命中时返回 None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                header = f.readline()
+                thumbnail = f.read()
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return json.loads(header), thumbnail
+
+    def put(self, key, stats, thumbnail):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(stats).encode() + b"\n" + thumbnail
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self.lock:
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def get_or_compute(self, key, compute):
+        """compute() 返回 (统计量, 缩略图字节), 只在未命中时调用"""
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        stats, thumbnail = compute()
+        self.put(key, stats, thumbnail)
+        return stats, thumbnail
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if size <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                size -= entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                pass
+        self.size = size
+
+    def stats(self):
+        return {'entries': sum(1 for _ in self._entries()), 'bytes': self.size,
+                'hits': self.hits, 'misses': self.misses}
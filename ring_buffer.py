@@ -0,0 +1,68 @@
+"""
+最近 N 行传感器读数的环形缓冲区
+
+即时反馈面板只需要最新两行就能显示温度/湿度/CO2/pH/EC 和 pH 警告,
+不应该等待历史数据加载。后台同步每拿到新行就写入这里, 面板直接读取:
+    - 每列一段固定长度的 float32 数组, 时间戳一段 datetime64 数组, 内存固定
+    - append 按整批向量化写入, 超过容量时覆盖最旧的行
+    - tail(k) 只复制 k 行, 与历史长度无关
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data_schema import TIME_COLUMN
+
+DEFAULT_CAPACITY = 1440
+
+
+class RingBuffer:
+    def __init__(self, columns, capacity=DEFAULT_CAPACITY):
+        self.columns = list(columns)
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.values = np.full((self.capacity, len(self.columns)), np.nan, dtype=np.float32)
+            self.times = np.full(self.capacity, np.datetime64('NaT'), dtype='datetime64[ns]')
+            self.seen = np.zeros(len(self.columns), dtype=bool)  # 出现过的列, 其他列不显示
+            self.head = 0   # 下一行写入的位置
+            self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, frame):
+        """写入一批按时间排序的新行, 只保留其中最后 capacity 行"""
+        if frame is None or frame.empty:
+            return
+        frame = frame.tail(self.capacity)
+        rows = len(frame)
+        present = np.array([col in frame.columns for col in self.columns])
+        block = np.full((rows, len(self.columns)), np.nan, dtype=np.float32)
+        for i, col in enumerate(self.columns):
+            if present[i]:
+                block[:, i] = frame[col].to_numpy(dtype=np.float32, na_value=np.nan)
+        times = pd.to_datetime(frame[TIME_COLUMN]).to_numpy(dtype='datetime64[ns]')
+        with self.lock:
+            positions = (self.head + np.arange(rows)) % self.capacity
+            self.values[positions] = block
+            self.times[positions] = times
+            self.seen |= present
+            self.head = (self.head + rows) % self.capacity
+            self.size = min(self.size + rows, self.capacity)
+
+    def tail(self, k=2):
+        """最近 k 行, 按时间顺序, 列只包含出现过的传感器"""
+        with self.lock:
+            k = min(k, self.size)
+            positions = (self.head - k + np.arange(k)) % self.capacity
+            values = self.values[positions][:, self.seen]
+            times = self.times[positions]
+            columns = [col for col, seen in zip(self.columns, self.seen) if seen]
+        frame = pd.DataFrame(values, columns=columns)
+        frame.insert(0, TIME_COLUMN, times)
+        return frame
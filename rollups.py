@@ -0,0 +1,140 @@
+"""
+传感器历史的多分辨率聚合 (1 分钟原始数据 -> 5 分钟 -> 每小时 -> 每天)
+
+每个分辨率为每一列保存 min/max/sum/count/last 五个可合并的统计量 (mean = sum / count),
+新数据到达时只聚合新行, 再和已有的最后几个桶合并, 不需要重新扫描历史。
+查询时选出能提供足够点数的最粗分辨率, 几个月的曲线只需要几千行。
+-1 是传感器的无效值, 聚合时当作缺失处理 (与 data_viewer 的 clean_data 一致)。
+1 分钟分辨率就是分区存储中的原始数据, 不再单独物化。
+"""
+import posixpath
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data_schema import SENTINEL, TIME_COLUMN
+
+# 从细到粗
+RESOLUTIONS = ['5min', '1h', '1D']
+RAW_RESOLUTION = '1min'
+STATS = ['min', 'max', 'sum', 'count', 'last']
+ROLLUP_DIR = "_rollups"
+
+
+def aggregate(frame, columns, freq):
+    """把原始行聚合为 freq 粒度的桶, 返回以桶起始时间为索引、(统计量, 列) 为列的 DataFrame"""
+    values = frame[columns].astype(np.float32)
+    values = values.where(values != SENTINEL)
+    grouped = values.groupby(frame[TIME_COLUMN].dt.floor(freq).to_numpy())
+    return _finish({
+        'min': grouped.min(),
+        'max': grouped.max(),
+        'sum': grouped.sum(),
+        'count': grouped.count(),
+        'last': grouped.last(),
+    })
+
+
+def _reduce(agg, keys):
+    """合并同一个桶的多条聚合结果 (用于粗化以及与已有桶合并)"""
+    return _finish({
+        'min': agg['min'].groupby(keys).min(),
+        'max': agg['max'].groupby(keys).max(),
+        'sum': agg['sum'].groupby(keys).sum(),
+        'count': agg['count'].groupby(keys).sum(),
+        'last': agg['last'].groupby(keys).last(),
+    })
+
+
+def _finish(parts):
+    parts['count'] = parts['count'].astype(np.int32)
+    for stat in ('min', 'max', 'sum', 'last'):
+        parts[stat] = parts[stat].astype(np.float32)
+    result = pd.concat(parts, axis=1)
+    result.index.name = TIME_COLUMN
+    return result
+
+
+def merge(existing, delta):
+    """把新聚合的桶合并进已有结果, 只有重叠的桶 (通常是最后一个) 需要重新计算"""
+    if existing is None or existing.empty:
+        return delta
+    overlap = existing.index.intersection(delta.index)
+    if len(overlap):
+        combined = pd.concat([existing.loc[overlap], delta])
+        delta = _reduce(combined, combined.index)
+        existing = existing.drop(overlap)
+    return pd.concat([existing, delta]).sort_index()
+
+
+class RollupEngine:
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.reset()
+
+    def reset(self):
+        self.levels = {resolution: None for resolution in RESOLUTIONS}
+
+    def update(self, new_rows):
+        """增量更新: 新行先聚合为最细的桶, 再逐级粗化后与各级已有的桶合并"""
+        columns = [col for col in self.columns if col in new_rows.columns]
+        if new_rows.empty or not columns:
+            return
+        delta = aggregate(new_rows, columns, RESOLUTIONS[0])
+        for resolution in RESOLUTIONS:
+            if resolution != RESOLUTIONS[0]:
+                delta = _reduce(delta, delta.index.floor(resolution))
+            self.levels[resolution] = merge(self.levels[resolution], delta)
+
+    def choose_resolution(self, start, end, min_points):
+        """选择在 [start, end] 内至少有 min_points 个桶的最粗分辨率, 都不满足时返回原始分辨率"""
+        span = pd.Timestamp(end) - pd.Timestamp(start)
+        for resolution in reversed(RESOLUTIONS):
+            if self.levels[resolution] is not None and span / pd.Timedelta(resolution) >= min_points:
+                return resolution
+        return RAW_RESOLUTION
+
+    def query(self, start, end, resolution, columns=None):
+        """返回 [start, end] 内某个分辨率的聚合结果, 附带 mean"""
+        level = self.levels[resolution]
+        if level is None:
+            return None
+        # 包含 start 所在的桶
+        level = level.loc[pd.Timestamp(start).floor(resolution):pd.Timestamp(end)]
+        if columns is not None:
+            level = level.loc[:, pd.IndexSlice[:, [col for col in columns if col in level['sum'].columns]]]
+        mean = level['sum'] / level['count'].replace(0, np.nan)
+        return pd.concat([level, pd.concat({'mean': mean}, axis=1)], axis=1)
+
+    def save(self, fs, root, tag):
+        """保存到存储目录, tag 用来标记这些聚合对应的数据版本 (例如增量读取的字节偏移)"""
+        for resolution, level in self.levels.items():
+            if level is None:
+                continue
+            flat = level.copy()
+            flat.columns = [f"{stat}|{column}" for stat, column in flat.columns]
+            table = pa.Table.from_pandas(flat.reset_index(), preserve_index=False)
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'tag': str(tag).encode()})
+            path = posixpath.join(root, ROLLUP_DIR, f"{resolution}.parquet")
+            fs.makedirs(posixpath.dirname(path), exist_ok=True)
+            with fs.open(path, 'wb') as f:
+                pq.write_table(table, f, compression='zstd')
+
+    def load(self, fs, root, tag):
+        """读取已保存的聚合, 任意一级缺失或 tag 不一致时返回 False, 调用方应重新构建"""
+        levels = {}
+        for resolution in RESOLUTIONS:
+            path = posixpath.join(root, ROLLUP_DIR, f"{resolution}.parquet")
+            if not fs.exists(path):
+                return False
+            with fs.open(path, 'rb') as f:
+                table = pq.read_table(f)
+            if (table.schema.metadata or {}).get(b'tag') != str(tag).encode():
+                return False
+            flat = table.to_pandas().set_index(TIME_COLUMN)
+            flat.columns = pd.MultiIndex.from_tuples([tuple(col.split('|', 1)) for col in flat.columns])
+            levels[resolution] = flat
+        self.levels = levels
+        return True
@@ -0,0 +1,71 @@
+"""
+低分辨率分割的精度与速度对比
+
+对一组图片分别用全分辨率 (现有结果) 和 scale = 2/4/8 (可选边缘细化) 计算绿叶面积,
+报告每种模式每张图片的平均耗时 (解码 + 分割, 取 REPEAT 次中最快的一次)、相对全分辨率的加速比,
+以及面积的相对误差 (只统计全分辨率面积不为 0 的图片) 和是否判为有叶片的一致率。
+
+用法:
+    python segmentation_benchmark.py "s3://ifoag1/images/3/img_2024-*.jpg" [最多图片数]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from leaf_area import analyze_bytes
+
+SCALES = [2, 4, 8]
+REPEAT = 3
+
+
+def _timed(data, scale, refine):
+    best = np.inf
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        stats, _ = analyze_bytes(data, scale, refine)
+        best = min(best, time.perf_counter() - start)
+    return stats['green_area'], best
+
+
+def benchmark(images, scales=SCALES):
+    """images 为图片文件字节的列表, 返回每种模式一行的对比表"""
+    modes = [(1, False)] + [(scale, refine) for scale in scales for refine in (False, True)]
+    areas = np.zeros((len(modes), len(images)))
+    seconds = np.zeros((len(modes), len(images)))
+    for j, data in enumerate(images):
+        for i, (scale, refine) in enumerate(modes):
+            areas[i, j], seconds[i, j] = _timed(data, scale, refine)
+
+    baseline = areas[0]
+    has_leaf = baseline > 0
+    rows = []
+    for i, (scale, refine) in enumerate(modes):
+        error = np.abs(areas[i, has_leaf] - baseline[has_leaf]) / baseline[has_leaf]
+        rows.append({
+            'scale': scale,
+            'refine': refine,
+            'ms': seconds[i].mean() * 1000,
+            'speedup': seconds[0].mean() / seconds[i].mean(),
+            'mean_error': error.mean() if len(error) else np.nan,
+            'max_error': error.max() if len(error) else np.nan,
+            'leaf_agreement': ((areas[i] > 0) == has_leaf).mean(),
+        })
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("用法: python segmentation_benchmark.py <图片路径或通配符> [最多图片数]")
+        sys.exit(1)
+    from fsspec.core import url_to_fs
+
+    fs, pattern = url_to_fs(sys.argv[1])
+    paths = sorted(fs.glob(pattern))
+    if len(sys.argv) == 3:
+        paths = paths[:int(sys.argv[2])]
+    images = [fs.cat_file(path) for path in paths]
+    print(f"{len(images)} 张图片")
+    with pd.option_context('display.width', 200, 'display.float_format', '{:.4f}'.format):
+        print(benchmark(images))
@@ -0,0 +1,208 @@
+"""
+按天分区的传感器/执行器历史存储
+
+integral_data 合并后的历史数据按 DateTime 的日期拆分成 Parquet 文件:
+    {root}/date=YYYY-MM-DD/part.parquet
+读取时只打开覆盖所选日期范围的分区, 并且只读取需要的列,
+这样页面加载耗时只与所选范围有关, 与历史总长度无关。
+
+用法 (把已有的 CSV 一次性转换为分区存储):
+    python sensor_store.py logs/integral_data.csv ./integral_store
+    python sensor_store.py s3://ifoag1/integral_data2.csv s3://ifoag1/integral_store
+"""
+import sys
+import posixpath
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fsspec.core import url_to_fs
+
+from data_schema import (TIME_COLUMN, SENSOR_COLUMNS, PLACEHOLDER_COLUMN, apply_schema,
+                         placeholder_mask, row_time_column)
+import stream_stats
+
+STORE_ROOT = "ifoag1/integral_store"
+PARTITION_PREFIX = "date="
+PARTITION_FILE = "part.parquet"
+# 每个分区旁边保存一份可合并的传感器列摘要 (见 stream_stats)
+SUMMARY_FILE = "summary.json"
+
+
+def normalize_frame(df):
+    """
+    把原始 CSV 读出的数据按 data_schema 统一为紧凑的固定类型,
+    保证每个分区的 Parquet schema 一致, 并按 DateTime 排序。
+    占位字符串在转换前记入 PLACEHOLDER_COLUMN (已经归一化过的数据保留原来的掩码)。
+    """
+    if PLACEHOLDER_COLUMN not in df.columns:
+        df = df.assign(**{PLACEHOLDER_COLUMN: placeholder_mask(df)})
+    df = apply_schema(df)
+    df = df.dropna(subset=[TIME_COLUMN])
+    return df.sort_values(TIME_COLUMN, kind='stable').reset_index(drop=True)
+
+
+def partition_path(root, day):
+    return posixpath.join(root, f"{PARTITION_PREFIX}{day:%Y-%m-%d}", PARTITION_FILE)
+
+
+def summary_path(root, day):
+    return posixpath.join(root, f"{PARTITION_PREFIX}{day:%Y-%m-%d}", SUMMARY_FILE)
+
+
+def list_partitions(fs, root):
+    """返回存储中已有分区的日期列表 (升序)"""
+    if not fs.exists(root):
+        return []
+    # 分区目录会被其他进程追加, 不使用目录缓存
+    fs.invalidate_cache(root)
+    days = []
+    for path in fs.ls(root, detail=False):
+        name = posixpath.basename(path.rstrip('/'))
+        if name.startswith(PARTITION_PREFIX):
+            try:
+                days.append(datetime.strptime(name[len(PARTITION_PREFIX):], "%Y-%m-%d").date())
+            except ValueError:
+                continue
+    return sorted(days)
+
+
+def read_partition(fs, root, day, columns=None):
+    path = partition_path(root, day)
+    if not fs.exists(path):
+        return None
+    with fs.open(path, 'rb') as f:
+        schema_names = pq.read_schema(f).names
+        f.seek(0)
+        if columns is not None:
+            columns = [col for col in columns if col in schema_names]
+        return pq.read_table(f, columns=columns).to_pandas()
+
+
+def write_partition(fs, root, day, frame):
+    path = partition_path(root, day)
+    fs.makedirs(posixpath.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(frame.reset_index(drop=True), preserve_index=False)
+    with fs.open(path, 'wb') as f:
+        pq.write_table(table, f, compression='zstd')
+    write_summary(fs, root, day, frame)
+
+
+def write_summary(fs, root, day, frame):
+    summaries = stream_stats.summarize_frame(frame, SENSOR_COLUMNS)
+    with fs.open(summary_path(root, day), 'w') as f:
+        f.write(stream_stats.dumps(summaries))
+    return summaries
+
+
+def read_summaries(fs, root, start_date, end_date):
+    """
+    读取 [start_date, end_date] 内每个分区的摘要并合并。
+    旧分区没有摘要文件时, 读取一次该分区补写摘要。
+    """
+    partitions = []
+    for day in list_partitions(fs, root):
+        if not start_date <= day <= end_date:
+            continue
+        path = summary_path(root, day)
+        if fs.exists(path):
+            with fs.open(path, 'r') as f:
+                partitions.append(stream_stats.loads(f.read()))
+        else:
+            frame = read_partition(fs, root, day)
+            if frame is not None:
+                partitions.append(write_summary(fs, root, day, frame))
+    return stream_stats.merge_summaries(partitions)
+
+
+def store_columns(fs, root):
+    """读取最新分区的 schema, 返回存储中可用的数据列名 (不含占位字符串掩码)"""
+    days = list_partitions(fs, root)
+    if not days:
+        return []
+    with fs.open(partition_path(root, days[-1]), 'rb') as f:
+        return [name for name in pq.read_schema(f).names if name != PLACEHOLDER_COLUMN]
+
+
+def write_partitions(fs, root, df):
+    """把整段数据按天写入分区, 已存在的分区会被覆盖, 返回写入的日期"""
+    df = normalize_frame(df)
+    written = []
+    for day, frame in df.groupby(df[TIME_COLUMN].dt.date, sort=True):
+        write_partition(fs, root, day, frame)
+        written.append(day)
+    return written
+
+
+def append_rows(fs, root, df):
+    """
+    追加新数据: 只重写新数据所涉及的日期分区 (通常只有当天),
+    同一条传感器记录 (DateTime_x 相同) 的重复行以新数据为准。
+    """
+    df = normalize_frame(df)
+    written = []
+    for day, frame in df.groupby(df[TIME_COLUMN].dt.date, sort=True):
+        existing = read_partition(fs, root, day)
+        if existing is not None and not existing.empty:
+            frame = pd.concat([existing, frame], ignore_index=True)
+            # 旧分区没有掩码列, 这些行按没有占位字符串处理
+            frame[PLACEHOLDER_COLUMN] = frame[PLACEHOLDER_COLUMN].fillna(0).astype(np.uint32)
+            key = row_time_column(frame)
+            frame = frame.drop_duplicates(subset=[key], keep='last')
+            frame = frame.sort_values(TIME_COLUMN, kind='stable')
+        write_partition(fs, root, day, frame)
+        written.append(day)
+    return written
+
+
+def read_range(fs, root, start_date, end_date, columns=None):
+    """只读取 [start_date, end_date] 范围内的分区和指定列"""
+    if columns is not None and TIME_COLUMN not in columns:
+        columns = [TIME_COLUMN] + list(columns)
+    frames = []
+    for day in list_partitions(fs, root):
+        if start_date <= day <= end_date:
+            frame = read_partition(fs, root, day, columns)
+            if frame is not None and not frame.empty:
+                frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_latest(fs, root, n=2, columns=None):
+    """从最新的分区往前读取, 直到凑够最近 n 行"""
+    if columns is not None and TIME_COLUMN not in columns:
+        columns = [TIME_COLUMN] + list(columns)
+    frames = []
+    rows = 0
+    for day in reversed(list_partitions(fs, root)):
+        frame = read_partition(fs, root, day, columns)
+        if frame is None or frame.empty:
+            continue
+        frames.insert(0, frame)
+        rows += len(frame)
+        if rows >= n:
+            break
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True).tail(n).reset_index(drop=True)
+
+
+def convert_csv(csv_url, store_url):
+    """把单个 CSV 文件转换为分区存储"""
+    csv_fs, csv_path = url_to_fs(csv_url)
+    store_fs, store_root = url_to_fs(store_url)
+    with csv_fs.open(csv_path, 'rb') as f:
+        df = pd.read_csv(f)
+    return write_partitions(store_fs, store_root, df)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("用法: python sensor_store.py <csv路径> <存储目录>")
+        sys.exit(1)
+    days = convert_csv(sys.argv[1], sys.argv[2])
+    print(f"已写入 {len(days)} 个分区: {days[0] if days else '-'} ~ {days[-1] if days else '-'}")
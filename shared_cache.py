@@ -0,0 +1,186 @@
+"""
+进程级共享缓存
+
+Streamlit 每个浏览器会话都会各自调用 conn.read(...), st.cache_data 返回的也是每次反序列化的副本,
+中控室加上几部手机同时打开时, 同一份数据会被下载 N 次、在内存里保存 N 份。
+这里的缓存在整个进程内共享:
+    - 同一个 key 同时被多个会话请求时只加载一次 (single-flight), 其他会话等待同一个结果
+    - DataFrame 以浅拷贝交给调用方, 配合 pandas 的 Copy-on-Write, 调用方的修改不会影响共享数据
+    - 统计命中/未命中/等待次数以及常驻内存字节数
+    - 条目数和常驻字节数有上限, 超过时淘汰最久没有使用的条目; 过期条目在读写时清除
+    - invalidate_where 只清除满足条件的 key (例如覆盖了有新数据的日期的查询)
+"""
+import copy
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+MAX_ENTRIES = 256
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def enable_copy_on_write():
+    """pandas 3 起 Copy-on-Write 默认开启, 之前的版本需要手动打开"""
+    if int(pd.__version__.split('.')[0]) < 3:
+        pd.set_option('mode.copy_on_write', True)
+
+
+def _nbytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_nbytes(k) + _nbytes(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+def _share(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=False)
+    if isinstance(value, (dict, list)):
+        return copy.deepcopy(value)
+    return value
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SharedCache:
+    def __init__(self, name, ttl=None, max_entries=MAX_ENTRIES, max_bytes=None):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (value, 过期时间, 字节数), 最近使用的在末尾
+        self._bytes = 0
+        self._inflight = {}      # key -> _Flight
+        self._stale = set()      # 加载期间被 invalidate_where 清除的 key, 结果不写入缓存
+        self._generation = 0
+        self.evictions = 0
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def get(self, key, loader):
+        """返回 key 对应的值, 没有缓存时调用 loader() 加载; 同一时刻同一个 key 只会加载一次"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _share(entry[0])
+            self._purge_expired(now)
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                generation = self._generation
+                self.misses += 1
+            else:
+                self.waits += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return _share(flight.value)
+
+        try:
+            value = loader()
+        except BaseException as e:
+            flight.error = e
+            with self._lock:
+                self._inflight.pop(key, None)
+                self._stale.discard(key)
+            flight.event.set()
+            raise
+
+        with self._lock:
+            # 加载期间被 invalidate 过的结果只返回给本次调用方, 不写入缓存
+            if generation == self._generation and key not in self._stale:
+                expires = now + self.ttl if self.ttl is not None else None
+                self._put(key, (value, expires, _nbytes(value)), time.monotonic())
+            self._stale.discard(key)
+            self._inflight.pop(key, None)
+        flight.value = value
+        flight.event.set()
+        return _share(value)
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key)[2]
+
+    def _purge_expired(self, now):
+        for key in [k for k, (_, expires, _) in self._entries.items() if expires is not None and expires <= now]:
+            self._remove(key)
+
+    def _put(self, key, entry, now):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._bytes += entry[2]
+        self._purge_expired(now)
+        # 只剩刚写入的条目时即使超过字节上限也保留, 否则它会立刻被淘汰
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries
+                                          or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._bytes = 0
+                self._generation += 1
+            elif key in self._entries:
+                self._remove(key)
+
+    def invalidate_where(self, predicate):
+        """清除 predicate(key) 为真的条目, 正在加载的这些 key 的结果也不会写入缓存"""
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self._remove(key)
+            self._stale.update(k for k in self._inflight if predicate(k))
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            self._purge_expired(now)
+            return {
+                'cache': self.name,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+                'evictions': self.evictions,
+                'resident_bytes': self._bytes,
+            }
+
+
+def get_cache(name, ttl=None, max_entries=MAX_ENTRIES, max_bytes=None):
+    """按名字取进程内唯一的缓存实例"""
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = SharedCache(name, ttl, max_entries, max_bytes)
+        return _registry[name]
+
+
+def cache_stats():
+    with _registry_lock:
+        caches = list(_registry.values())
+    return pd.DataFrame([cache.stats() for cache in caches])
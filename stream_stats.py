@@ -0,0 +1,187 @@
+"""
+可合并的分区摘要统计
+
+每个日期分区为每个传感器列保存一份摘要:
+    count / mean / M2   Welford 方法 (批量时用 Chan 的合并公式), 得到均值和样本方差
+    min / max
+    KLL 分位数草图     用于 25% / 50% / 75% 分位数
+任意日期范围的 "摘要统计" 只需要把范围内各分区的摘要合并, 不需要读取原始行。
+
+误差: count/mean/std/min/max 与 describe() 一致 (只有浮点舍入误差);
+分位数来自 KLL 草图, k=200 时排名误差通常在 1% 以内 (最坏约 2%),
+即给出的 "50%" 介于真实的 49% 和 51% 分位数之间。
+-1 是传感器的无效值, 与 clean_data / clean_frame 一样不计入统计。
+"""
+import base64
+import json
+
+import numpy as np
+import pandas as pd
+
+from data_schema import SENTINEL
+
+DEFAULT_K = 200
+DESCRIBE_INDEX = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+
+
+class KLLSketch:
+    """KLL 分位数草图: 第 h 层的每个元素代表 2^h 个原始值, 两个草图可以直接合并"""
+
+    def __init__(self, k=DEFAULT_K, seed=0):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) <= self._capacity(level):
+                level += 1
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(items)
+            # 奇数个时留一个在本层, 其余两两配对, 随机保留奇数位或偶数位升到上一层
+            keep, items = items[:len(items) % 2], items[len(items) % 2:]
+            promoted = items[self._rng.integers(2)::2]
+            self.levels[level] = keep
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            # 层数增加后下层容量变小, 从头重新检查
+            level = 0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self._compress()
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self._compress()
+
+    def quantiles(self, qs):
+        items = np.concatenate(self.levels)
+        if not len(items):
+            return np.full(len(qs), np.nan)
+        weights = np.concatenate([np.full(len(items), 2 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        cumulative = np.cumsum(weights[order])
+        positions = np.searchsorted(cumulative, np.asarray(qs) * cumulative[-1], side='left')
+        return items[order][np.minimum(positions, len(items) - 1)]
+
+    def to_dict(self):
+        # 传感器数据本身是 float32, 按 float32 的原始字节保存, 既紧凑又不损失精度
+        return {'k': self.k, 'levels': [base64.b64encode(items.astype('<f4').tobytes()).decode()
+                                        for items in self.levels]}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['k'])
+        sketch.levels = [np.frombuffer(base64.b64decode(items), dtype='<f4').astype(np.float64)
+                         for items in data['levels']] or [np.empty(0)]
+        return sketch
+
+
+class ColumnSummary:
+    def __init__(self, k=DEFAULT_K):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.sketch = KLLSketch(k)
+
+    def _combine(self, count, mean, m2, low, high):
+        # Chan 等人的并行 Welford 合并公式
+        total = self.count + count
+        if count == 0:
+            return
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values) & (values != SENTINEL)]
+        if not len(values):
+            return
+        mean = values.mean()
+        self._combine(len(values), mean, ((values - mean) ** 2).sum(), values.min(), values.max())
+        self.sketch.update(values)
+
+    def merge(self, other):
+        self._combine(other.count, other.mean, other.m2, other.min, other.max)
+        self.sketch.merge(other.sketch)
+
+    def describe(self):
+        if self.count == 0:
+            return pd.Series(np.nan, index=DESCRIBE_INDEX)
+        std = np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+        q25, q50, q75 = self.sketch.quantiles([0.25, 0.5, 0.75])
+        return pd.Series([self.count, self.mean, std, self.min, q25, q50, q75, self.max], index=DESCRIBE_INDEX)
+
+    def to_dict(self):
+        return {'count': int(self.count), 'mean': float(self.mean), 'm2': float(self.m2),
+                'min': float(self.min), 'max': float(self.max), 'sketch': self.sketch.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        summary = cls(data['sketch']['k'])
+        summary.count = data['count']
+        summary.mean = data['mean']
+        summary.m2 = data['m2']
+        summary.min = data['min']
+        summary.max = data['max']
+        summary.sketch = KLLSketch.from_dict(data['sketch'])
+        return summary
+
+
+def summarize_frame(frame, columns):
+    """为一段数据 (通常是一个日期分区) 的每一列生成摘要"""
+    summaries = {}
+    for column in columns:
+        if column in frame.columns:
+            summary = ColumnSummary()
+            summary.update(frame[column].to_numpy(dtype=np.float64, na_value=np.nan))
+            summaries[column] = summary
+    return summaries
+
+
+def merge_summaries(partitions):
+    """合并多个分区的摘要 (不修改输入)"""
+    merged = {}
+    for summaries in partitions:
+        for column, summary in summaries.items():
+            if column not in merged:
+                merged[column] = ColumnSummary(summary.sketch.k)
+            merged[column].merge(summary)
+    return merged
+
+
+def describe_summaries(summaries, columns=None):
+    """与 describe() 相同格式的摘要统计表, 没有有效值的列不显示"""
+    if columns is None:
+        columns = list(summaries)
+    table = pd.DataFrame({col: summaries[col].describe() for col in columns
+                          if col in summaries and summaries[col].count > 0})
+    return table.reindex(DESCRIBE_INDEX)
+
+
+def dumps(summaries):
+    return json.dumps({column: summary.to_dict() for column, summary in summaries.items()})
+
+
+def loads(text):
+    return {column: ColumnSummary.from_dict(data) for column, data in json.loads(text).items()}
@@ -0,0 +1,120 @@
+"""
+integral_data CSV 的增量尾部读取
+
+CSV 只会在末尾追加新行。这里记录已经消费到的字节偏移和最后一行的时间戳,
+每次轮询只用范围请求 (Range) 读取偏移之后新追加的字节, 只返回解析出的新行;
+内存中不保留已经读过的数据, 历史由调用方写入分区存储。
+如果文件被重写 (变短, 或偏移之前的内容发生变化), 自动退回完整重新加载。
+"""
+import io
+import json
+import threading
+
+import pandas as pd
+
+from data_schema import TIME_COLUMN
+from sensor_store import normalize_frame
+
+# 每次读取尾部时, 额外多读偏移之前的这么多字节, 用来确认文件没有被重写
+OVERLAP_BYTES = 64
+
+
+class TailIngestor:
+    def __init__(self, fs, path, checkpoint_path=None):
+        self.fs = fs
+        self.path = path
+        self.checkpoint_path = checkpoint_path
+        self.lock = threading.Lock()
+        self.header = None
+        self.offset = 0
+        self.last_timestamp = None
+        self.signature = b""
+        self.bytes_read = 0
+        self._load_checkpoint()
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path or not self.fs.exists(self.checkpoint_path):
+            return
+        try:
+            with self.fs.open(self.checkpoint_path, 'r') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return
+        if checkpoint.get('path') != self.path:
+            return
+        self.header = checkpoint['header']
+        self.offset = checkpoint['offset']
+        self.signature = bytes.fromhex(checkpoint['signature'])
+        if checkpoint.get('last_timestamp'):
+            self.last_timestamp = pd.Timestamp(checkpoint['last_timestamp'])
+
+    def save_checkpoint(self):
+        """调用方把新数据落盘之后再保存检查点, 保证检查点不会超前于已保存的数据"""
+        if not self.checkpoint_path:
+            return
+        checkpoint = {
+            'path': self.path,
+            'header': self.header,
+            'offset': self.offset,
+            'signature': self.signature.hex(),
+            'last_timestamp': self.last_timestamp.isoformat() if self.last_timestamp is not None else None,
+        }
+        with self.fs.open(self.checkpoint_path, 'w') as f:
+            json.dump(checkpoint, f)
+
+    def _parse(self, data, names=None):
+        if not data.strip():
+            return pd.DataFrame(columns=names or self.header)
+        if names is None:
+            df = pd.read_csv(io.BytesIO(data), encoding='utf-8-sig')
+        else:
+            df = pd.read_csv(io.BytesIO(data), header=None, names=names)
+        return normalize_frame(df)
+
+    def _consume(self, data, start):
+        """只处理到最后一个完整的换行, 不完整的行留到下一次轮询"""
+        end = data.rfind(b"\n") + 1
+        complete = data[:end]
+        self.offset = start + end
+        self.signature = (self.signature + complete)[-OVERLAP_BYTES:] if start else complete[-OVERLAP_BYTES:]
+        return complete
+
+    def full_reload(self):
+        data = self.fs.cat_file(self.path)
+        self.bytes_read += len(data)
+        self.signature = b""
+        complete = self._consume(data, 0)
+        self.header = complete.split(b"\n", 1)[0].decode('utf-8-sig').strip().split(',')
+        rows = self._parse(complete)
+        self.last_timestamp = rows[TIME_COLUMN].max() if not rows.empty else None
+        return rows
+
+    def poll(self):
+        """
+        读取新追加的行, 返回 (新行, 是否发生了完整重新加载)。
+        完整重新加载时返回的新行就是整个文件。
+        """
+        self.fs.invalidate_cache(self.path)
+        size = self.fs.size(self.path)
+
+        if self.header is None or size < self.offset:
+            return self.full_reload(), True
+        if size == self.offset:
+            return self._parse(b""), False
+
+        overlap = min(len(self.signature), self.offset)
+        data = self.fs.cat_file(self.path, start=self.offset - overlap, end=size)
+        self.bytes_read += len(data)
+        if overlap and data[:overlap] != self.signature[-overlap:]:
+            # 偏移之前的内容变了: 文件被重写
+            return self.full_reload(), True
+
+        complete = self._consume(data[overlap:], self.offset)
+        new_rows = self._parse(complete, names=self.header)
+        if self.last_timestamp is not None:
+            new_rows = new_rows[new_rows[TIME_COLUMN] >= self.last_timestamp]
+        if new_rows.empty:
+            return new_rows, False
+
+        self.last_timestamp = new_rows[TIME_COLUMN].max()
+        return new_rows, False
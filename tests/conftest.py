@@ -0,0 +1,7 @@
+import os
+import sys
+
+# 模块都在仓库根目录, 测试直接按模块名导入
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOGS = os.path.join(ROOT, "logs")
+sys.path.insert(0, ROOT)
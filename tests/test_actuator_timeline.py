@@ -0,0 +1,57 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from actuator_timeline import ActuatorTimeline
+from conftest import LOGS
+from data_schema import ACTUATOR_COLUMNS, ROW_KEY, load_typed
+
+
+@pytest.fixture(scope='module')
+def frame():
+    typed = load_typed(os.path.join(LOGS, "integral_data.csv"))
+    return typed.sort_values(ROW_KEY, kind='stable').reset_index(drop=True)
+
+
+@pytest.fixture(scope='module')
+def columns(frame):
+    return [col for col in ACTUATOR_COLUMNS if col in frame.columns]
+
+
+def _batches(frame, size):
+    return [frame.iloc[start:start + size] for start in range(0, len(frame), size)]
+
+
+def test_batches_match_single_pass(frame, columns):
+    expected = ActuatorTimeline.from_frame(frame, columns)
+    timeline = ActuatorTimeline(columns)
+    for batch in _batches(frame, 97):
+        timeline.update(batch)
+    for col in columns:
+        np.testing.assert_array_equal(timeline.starts[col], expected.starts[col])
+        np.testing.assert_array_equal(timeline.ends[col], expected.ends[col])
+
+
+def test_reads_during_updates_are_consistent(frame, columns):
+    timeline = ActuatorTimeline(columns)
+    done = threading.Event()
+    errors = []
+
+    def read():
+        while not done.is_set():
+            for col in columns:
+                starts, ends, cumulative = timeline.snapshot(col)
+                if len(starts) != len(ends) or len(cumulative) != len(starts) + 1 or (ends < starts).any():
+                    errors.append(col)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    try:
+        for batch in _batches(frame, 5):
+            timeline.update(batch)
+    finally:
+        done.set()
+        reader.join()
+    assert not errors
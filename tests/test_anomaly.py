@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from anomaly import STATE_FIELDS, AnomalyDetector, score_history
+from conftest import LOGS
+from data_schema import ROW_KEY, SENSOR_COLUMNS, load_typed
+
+
+@pytest.fixture(scope='module')
+def frame():
+    typed = load_typed(os.path.join(LOGS, "integral_data.csv"))
+    return typed.sort_values(ROW_KEY, kind='stable').reset_index(drop=True)
+
+
+@pytest.fixture(scope='module')
+def columns(frame):
+    return [col for col in SENSOR_COLUMNS if col in frame.columns]
+
+
+def _spike(size=600, at=400):
+    times = pd.date_range("2024-01-01", periods=size, freq='min')
+    rng = np.random.default_rng(0)
+    values = 22 + 0.2 * rng.standard_normal(size)
+    values[at] = 35
+    return pd.DataFrame({ROW_KEY: times, 'Temperature': values}), times[at]
+
+
+@pytest.mark.parametrize('batch', [100, 1000])
+def test_batches_match_single_pass(frame, columns, batch):
+    expected = AnomalyDetector(columns).update(frame)
+    detector = AnomalyDetector(columns)
+    events = pd.concat([detector.update(frame.iloc[start:start + batch])
+                        for start in range(0, len(frame), batch)], ignore_index=True)
+    # 空批次返回的空表列类型是 object, 只比较内容
+    pd.testing.assert_frame_equal(events, expected, check_dtype=False)
+
+
+def test_rows_already_processed_are_skipped(frame, columns):
+    detector = AnomalyDetector(columns)
+    detector.update(frame)
+    assert detector.update(frame).empty
+    assert detector.update(frame.iloc[-10:]).empty
+
+
+@pytest.mark.parametrize('replay', [False, True])
+def test_spike_is_flagged(replay):
+    history, spike_time = _spike()
+    detector = AnomalyDetector(['Temperature'])
+    events = detector.replay(history) if replay else detector.update(history)
+    at_spike = events[events['time'] == spike_time]
+    assert set(at_spike['kind']) == {'ewma', 'mad', 'rate'}
+
+
+def test_replay_matches_update(frame, columns):
+    expected = AnomalyDetector(columns)
+    expected_events = expected.update(frame)
+    detector = AnomalyDetector(columns)
+    events = detector.replay(frame)
+    pd.testing.assert_frame_equal(events, expected_events, check_dtype=False)
+    for name in STATE_FIELDS:
+        np.testing.assert_allclose(getattr(detector, name), getattr(expected, name), rtol=1e-9)
+
+
+def test_update_continues_after_replay(frame, columns):
+    split = len(frame) // 2
+    events, detector = score_history(frame.iloc[:split], columns)
+    assert (detector.count <= split).all()
+    later = detector.update(frame.iloc[split:])
+    assert (later['time'] > frame[ROW_KEY].iloc[split - 1]).all()
+    assert len(detector.events) == len(events) + len(later)
+    # 前半段已经回放过, 再送入不会产生事件
+    assert detector.update(frame.iloc[:split]).empty
+    pd.testing.assert_frame_equal(detector.events, AnomalyDetector(columns).update(frame), check_dtype=False)
@@ -0,0 +1,42 @@
+import os
+
+import pandas as pd
+import pytest
+
+from asof_join import ACTUATOR_TIME, SENSOR_TIME, AsOfJoiner, asof_merge
+from conftest import LOGS
+
+
+@pytest.fixture(scope='module')
+def streams():
+    """把 integral_data 拆回传感器流和执行器流"""
+    frame = pd.read_csv(os.path.join(LOGS, "integral_data.csv"))
+    split = list(frame.columns).index(ACTUATOR_TIME)
+    sensor = frame.iloc[:, :split].assign(**{SENSOR_TIME: pd.to_datetime(frame[SENSOR_TIME])})
+    actuator = frame.iloc[:, split:].assign(**{ACTUATOR_TIME: pd.to_datetime(frame[ACTUATOR_TIME])})
+    return sensor, actuator.dropna(subset=[ACTUATOR_TIME])
+
+
+def stream_join(sensor, actuator, chunksize, actuator_first):
+    joiner = AsOfJoiner()
+    outputs = []
+    for start in range(0, max(len(sensor), len(actuator)), chunksize):
+        pushes = [(joiner.push_actuator, actuator.iloc[start:start + chunksize]),
+                  (joiner.push_sensor, sensor.iloc[start:start + chunksize])]
+        for push, chunk in (pushes if actuator_first else pushes[::-1]):
+            outputs.append(push(chunk))
+    outputs.append(joiner.flush())
+    merged = pd.concat([out for out in outputs if not out.empty], ignore_index=True)
+    # 重新输出的行以后输出的为准
+    merged = merged.drop_duplicates(SENSOR_TIME, keep='last')
+    return merged.sort_values(SENSOR_TIME, kind='stable').reset_index(drop=True)
+
+
+@pytest.mark.parametrize('chunksize', [37, 250, 10000])
+@pytest.mark.parametrize('actuator_first', [True, False])
+def test_stream_matches_asof_merge(streams, chunksize, actuator_first):
+    sensor, actuator = streams
+    expected = asof_merge(sensor, actuator).drop_duplicates(SENSOR_TIME, keep='last').reset_index(drop=True)
+    result = stream_join(sensor, actuator, chunksize, actuator_first)
+    pd.testing.assert_series_equal(result[SENSOR_TIME], expected[SENSOR_TIME])
+    pd.testing.assert_series_equal(result[ACTUATOR_TIME], expected[ACTUATOR_TIME])
@@ -0,0 +1,29 @@
+import os
+
+import fsspec
+import pytest
+
+from command_analytics import redundancy_report
+from conftest import LOGS
+from modbus_dispatch import utilization_report
+from modbus_log import load_frames, written_coils
+
+
+@pytest.fixture(scope='module')
+def frames(tmp_path_factory):
+    cache = tmp_path_factory.mktemp("frames") / "mideA.frames.parquet"
+    return load_frames(fsspec.filesystem('file'), os.path.join(LOGS, "mideA.csv"), cache_path=str(cache))
+
+
+def test_trigger_coils_have_no_redundant_writes(frames):
+    report = redundancy_report(frames)
+    assert report['repeat'].sum() == report['coil_unchanged'].sum() == 0
+    # 与下发层的默认假设一致: 一条写入都不丢弃
+    assert utilization_report(frames).attrs['stats']['dropped'] == 0
+
+
+def test_latching_assumption_is_explicit(frames):
+    latching = written_coils(frames)
+    report = redundancy_report(frames, latching)
+    assert 0 < report['repeat'].sum() <= report['coil_unchanged'].sum() <= report['count'].sum()
+    assert utilization_report(frames, latching=latching).attrs['stats']['dropped'] > 0
@@ -0,0 +1,37 @@
+import os
+
+import fsspec
+import pandas as pd
+import pytest
+
+from conftest import LOGS
+from data_quality import quality_report
+from data_schema import PLACEHOLDER_COLUMN
+from sensor_store import append_rows, list_partitions, read_range, store_columns, write_partitions
+
+
+@pytest.fixture(scope='module')
+def raw():
+    return pd.read_csv(os.path.join(LOGS, "integral_data.csv"))
+
+
+def _read_all(fs, root):
+    days = list_partitions(fs, root)
+    return read_range(fs, root, days[0], days[-1])
+
+
+def test_placeholders_survive_the_store(raw, tmp_path):
+    fs = fsspec.filesystem('file')
+    root = str(tmp_path)
+    write_partitions(fs, root, raw)
+    expected = quality_report(raw)['columns']['placeholders']
+    assert expected.sum() > 0
+    stored = quality_report(_read_all(fs, root))['columns']
+    pd.testing.assert_series_equal(stored['placeholders'], expected)
+    assert PLACEHOLDER_COLUMN not in stored.index
+    assert PLACEHOLDER_COLUMN not in store_columns(fs, root)
+
+    # 追加时已经归一化过的行保留原来的掩码
+    append_rows(fs, root, raw.tail(50))
+    appended = quality_report(_read_all(fs, root))['columns']
+    pd.testing.assert_series_equal(appended['placeholders'], expected)
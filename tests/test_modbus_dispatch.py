@@ -0,0 +1,74 @@
+import os
+
+import fsspec
+import pytest
+
+from conftest import LOGS
+from modbus_dispatch import (CoilDispatcher, SimulatedBus, TcpTransport, read_coils_frame, serve_simulator,
+                             utilization_report)
+from modbus_log import load_frames
+
+
+@pytest.fixture
+def simulator():
+    bus = SimulatedBus()
+    server, port = serve_simulator(bus)
+    transport = TcpTransport('127.0.0.1', port)
+    yield bus, transport
+    transport.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_dispatcher_over_tcp_simulator(simulator):
+    bus, transport = simulator
+    now = [0.0]
+    latching = [(21, address) for address in (2, 3, 4)] + [(22, 7)]
+    dispatcher = CoilDispatcher(transport, latching=latching, clock=lambda: now[0])
+    for address, on in [(2, True), (3, False), (4, True), (4, False), (9, True)]:
+        dispatcher.submit(21, address, on)
+    dispatcher.submit(22, 7, True)
+    # 21 号从站 2-4 合并为一条功能码 15, 9 号和 22 号从站各一条功能码 05
+    assert dispatcher.flush() == 3
+    assert dispatcher.stats['coalesced'] == 1
+    assert dispatcher.stats['failed'] == 0
+    assert list(bus.coils[21][2:5]) == [True, False, False]
+    assert bus.coils[21][9] and bus.coils[22][7]
+
+    response = transport.request(read_coils_frame(21, 0, 16))
+    assert response[3:5] == bytes([0b00000100, 0b00000010])
+
+    # 保持型线圈与已确认状态相同的写入被丢弃, 触发线圈照常下发, 超过 refresh_after 后再下发一次
+    assert not dispatcher.submit(21, 2, True)
+    assert dispatcher.submit(21, 9, True)
+    assert dispatcher.flush() == 1
+    now[0] = dispatcher.refresh_after
+    assert dispatcher.submit(21, 2, True)
+    assert dispatcher.flush() == 1
+    assert dispatcher.stats['frames'] == bus.frames - 1
+
+
+def test_repeated_presses_are_not_merged(simulator):
+    bus, transport = simulator
+    dispatcher = CoilDispatcher(transport)
+    for _ in range(3):
+        assert dispatcher.submit(21, 8, True)
+    dispatcher.submit(21, 9, True)
+    # 第一次按下 8 和 9 合并为一帧, 之后的两次按下各一帧
+    assert dispatcher.flush() == 3
+    assert bus.frames == 3
+    assert dispatcher.stats['dropped'] == dispatcher.stats['coalesced'] == 0
+    assert dispatcher.submit(21, 8, True)
+    assert dispatcher.flush() == 1
+
+
+def test_report_treats_logged_coils_as_momentary(tmp_path):
+    frames = load_frames(fsspec.filesystem('file'), os.path.join(LOGS, "mideA.csv"),
+                         cache_path=str(tmp_path / "mideA.frames.parquet"))
+    report = utilization_report(frames)
+    assert report.attrs['stats']['dropped'] == 0
+    assert report.attrs['latching'] == []
+    assert report.loc['合并后', 'frames'] <= report.loc['原始', 'frames']
+    coils = set(zip(frames['slave'].astype(int), frames['address'].astype(int)))
+    latching = utilization_report(frames, latching=coils)
+    assert latching.attrs['stats']['dropped'] > 0
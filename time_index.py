@@ -0,0 +1,89 @@
+"""
+按时间范围切片历史数据
+
+读入的历史数据只在加载时设置一次单调递增的 DatetimeIndex,
+之后每次按时间范围筛选都用 searchsorted 做二分查找, 再用 iloc 取连续的一段,
+不再为每一行生成 date 对象和布尔掩码, 也不会复制数据。
+
+用法 (一年合成分钟数据上的微基准):
+    python time_index.py
+"""
+import timeit
+from datetime import date, datetime, time as dtime
+
+import numpy as np
+import pandas as pd
+
+from data_schema import TIME_COLUMN
+
+
+def with_time_index(df, column=TIME_COLUMN):
+    """把时间列设为索引, 只有在不是单调递增时才排序"""
+    if column in df.columns:
+        df = df.set_index(column)
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index(kind='stable')
+    return df
+
+
+def _bound(value, end=False):
+    # 只给出日期时, 结束边界包含当天全天
+    if isinstance(value, date) and not isinstance(value, datetime):
+        value = datetime.combine(value, dtime.max if end else dtime.min)
+    return pd.Timestamp(value)
+
+
+def slice_time(df, start, end):
+    """返回 [start, end] 之间的行 (两端都包含), df 必须已经经过 with_time_index"""
+    index = df.index
+    i = index.searchsorted(_bound(start), side='left')
+    j = index.searchsorted(_bound(end, end=True), side='right')
+    return df.iloc[i:j]
+
+
+def _synthetic_year():
+    times = pd.date_range('2024-01-01', periods=365 * 24 * 60, freq='1min')
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'DateTime_y': times.strftime('%Y-%m-%d %H:%M:%S.%f'),
+        'Temperature': rng.normal(22, 2, len(times)).astype(np.float32),
+        'Humidity': rng.normal(75, 5, len(times)).astype(np.float32),
+    })
+
+
+def benchmark(repeat=5):
+    raw = _synthetic_year()
+    start_date, end_date = date(2024, 6, 1), date(2024, 6, 7)
+
+    def before():
+        # 原 data_viewer 的做法: 每次重新解析时间字符串, 再用 .dt.date 生成布尔掩码
+        df = raw.copy()
+        df['DateTime'] = pd.to_datetime(df['DateTime_y'])
+        mask = (df['DateTime'].dt.date >= start_date) & (df['DateTime'].dt.date <= end_date)
+        return df.loc[mask]
+
+    indexed = with_time_index(raw.assign(DateTime=pd.to_datetime(raw['DateTime_y'])))
+
+    def mask_only():
+        # 时间已经解析好, 但仍然用 .dt.date 掩码
+        mask = (indexed.index.date >= start_date) & (indexed.index.date <= end_date)
+        return indexed.loc[mask]
+
+    def after():
+        return slice_time(indexed, start_date, end_date)
+
+    assert len(before()) == len(mask_only()) == len(after())
+    results = {}
+    for name, func in [('重新解析 + 掩码', before), ('.dt.date 掩码', mask_only), ('searchsorted 切片', after)]:
+        number = 1 if func is not after else 1000
+        seconds = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+        results[name] = seconds
+    return len(raw), results
+
+
+if __name__ == "__main__":
+    rows, results = benchmark()
+    print(f"{rows} 行合成分钟数据, 查询 7 天范围:")
+    baseline = next(iter(results.values()))
+    for name, seconds in results.items():
+        print(f"  {name:<20} {seconds * 1e3:10.3f} ms/次  ({baseline / seconds:,.0f}x)")
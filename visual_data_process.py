@@ -4,6 +4,7 @@ import plotly.graph_objects as go
 import json
 from datetime import datetime
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import re
 
@@ -14,6 +15,13 @@ import time
 import matplotlib.pyplot as plt 
 import cv2
 from PIL import Image
+import io
+import s3fs
+from shared_cache import get_cache
+from leaf_area import TREND_SCALE, algorithm_tag, analyze_bytes, encode_thumbnail, load_table, run_batch, unit_history
+from result_cache import ResultCache, result_key
+from image_fetch import FETCH_WORKERS, ImageFetcher
+from image_manifest import UnitManifest, load_manifest
 #st.set_page_config(page_title='室墨司源', layout='wide')
 
 # AWS and S3 configuration
@@ -25,8 +33,24 @@ S3_BUCKET_NAME = "ifoag1"
 s3_client = boto3.client('s3', 
                          aws_access_key_id=AWS_ACCESS_KEY_ID,
                          aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-                         region_name=AWS_DEFAULT_REGION)
-
+                         region_name=AWS_DEFAULT_REGION,
+                         config=Config(max_pool_connections=2 * FETCH_WORKERS))
+# 图片字节在所有会话之间共享, 每张图片只下载一次, 显示和分析共用
+image_fetcher = ImageFetcher(s3_client, S3_BUCKET_NAME)
+# 选中时间前后各预取这么多张原始图片
+PREFETCH_NEIGHBORS = 3
+# 批量计算叶面积时进程池的子进程通过 s3fs 读取图片
+image_fs = s3fs.S3FileSystem(key=AWS_ACCESS_KEY_ID, secret=AWS_SECRET_ACCESS_KEY,
+                             client_kwargs={'region_name': AWS_DEFAULT_REGION})
+LEAF_AREA_PATH = f"{S3_BUCKET_NAME}/_leaf_area/leaf_area.parquet"
+# 单张图片的分析结果 (绿叶面积和轮廓缩略图) 按 S3 路径 + ETag + 算法版本缓存在本地磁盘
+result_cache = ResultCache()
+# 图片查看器的分析分辨率 (1 为全分辨率, 2/4/8 为解码时缩小, 见 segmentation_benchmark.py)
+VIEW_SCALE = 1
+VIEW_REFINE = False
+
+# 图片列表在所有会话之间共享, 每 5 分钟最多列举一次 S3
+image_cache = get_cache('images', ttl=300)
 
 
 def load_data(conn):
@@ -52,16 +76,19 @@ def save_settings(conn, settings):
 
 
 
+def _list_units():
+    response = s3_client.list_objects_v2(Bucket=S3_BUCKET_NAME, Prefix="images/", Delimiter='/')
+    units = []
+    for prefix in response.get('CommonPrefixes', []):
+        prefix_name = prefix.get('Prefix', '')
+        unit = prefix_name.strip('/').split('/')[-1]
+        if unit:
+            units.append(unit)
+    return sorted(units)
+
 def get_available_units():
     try:
-        response = s3_client.list_objects_v2(Bucket=S3_BUCKET_NAME, Prefix="images/", Delimiter='/')
-        units = []
-        for prefix in response.get('CommonPrefixes', []):
-            prefix_name = prefix.get('Prefix', '')
-            unit = prefix_name.strip('/').split('/')[-1]
-            if unit:
-                units.append(unit)
-        return sorted(units)
+        return image_cache.get('units', _list_units)
     except ClientError as e:
         st.error(f"获取可用单元列表时出错: {str(e)}")
         return []
@@ -135,159 +162,65 @@ def process_image(image_url):
 """
 
 
-def improve_green_detection(image):
+def process_image(image_key, etag):
     """
-    改进的绿色植物检测算法，增加了多重检查以避免错误识别黑色区域
+    处理图像并返回 (绿叶面积, 轮廓缩略图), 同一张图片 (ETag 不变) 只下载和分割一次
     """
-    # 转换到HSV色彩空间，更容易分离颜色
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    
-    # 计算图像的平均亮度
-    brightness = np.mean(hsv[:,:,2])
-    
-    # 如果图像太暗（可能是全黑图像），直接返回空掩码
-    if brightness < 30:  # 可以根据需要调整这个阈值
-        return np.zeros(image.shape[:2], dtype=np.uint8)
-    
-    # 定义绿色的HSV范围
-    lower_green = np.array([35, 30, 30])  # 避免太暗或饱和度太低的像素
-    upper_green = np.array([85, 255, 255])
-    
-    # 创建绿色掩码
-    green_mask = cv2.inRange(hsv, lower_green, upper_green)
-    
-    # 计算LAB色彩空间中的绿色分量
-    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab)
-    
-    # 在A通道中绿色为负值，创建另一个掩码
-    _, a_mask = cv2.threshold(a, 127, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-    
-    # 组合HSV和LAB的掩码
-    combined_mask = cv2.bitwise_and(green_mask, a_mask)
-    
-    # 使用形态学操作清理噪声
-    kernel = np.ones((3,3), np.uint8)
-    cleaned_mask = cv2.morphologyEx(combined_mask, cv2.MORPH_OPEN, kernel, iterations=2)
-    cleaned_mask = cv2.morphologyEx(cleaned_mask, cv2.MORPH_CLOSE, kernel, iterations=2)
-    
-    return cleaned_mask
+    def compute():
+        stats, overlay = analyze_bytes(image_fetcher.fetch(image_key), VIEW_SCALE, VIEW_REFINE)
+        thumbnail = encode_thumbnail(overlay) if overlay is not None else b''
+        return stats, thumbnail
 
-def calculate_green_area_and_contour(image):
-    """
-    计算绿色区域面积并绘制轮廓，增加了额外的验证
-    """
-    # 获取改进的绿色检测掩码
-    mask = improve_green_detection(image)
-    
-    # 检查掩码中非零像素的比例
-    mask_coverage = np.count_nonzero(mask) / mask.size
-    
-    # 如果掩码覆盖率不合理（过高或过低），可能是错误检测
-    if mask_coverage > 0.9 or mask_coverage < 0.01:
-        return 0, image.copy(), np.zeros_like(mask)
-    
-    # 寻找轮廓
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    # 过滤小的轮廓并验证形状特征
-    filtered_contours = []
-    min_contour_area = 500
-    
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        if area > min_contour_area:
-            # 计算轮廓的形状特征
-            perimeter = cv2.arcLength(cnt, True)
-            circularity = 4 * np.pi * area / (perimeter * perimeter) if perimeter > 0 else 0
-            
-            # 通常植物叶片的轮廓不会太圆，也不会太不规则
-            if 0.1 < circularity < 0.9:
-                filtered_contours.append(cnt)
-    
-    # 创建结果掩码和轮廓图像
-    filtered_mask = np.zeros(mask.shape, dtype=np.uint8)
-    cv2.drawContours(filtered_mask, filtered_contours, -1, 255, -1)
-    
-    contour_image = image.copy()
-    cv2.drawContours(contour_image, filtered_contours, -1, (0, 255, 0), 2)
-    
-    # 计算最终的绿色区域面积
-    green_area = np.sum(filtered_mask > 0)
-    
-    return green_area, contour_image, filtered_mask
-
-def process_image(image_url):
-    """
-    处理图像并返回结果，包含验证步骤
-    """
-    # 读取图像
-    response = requests.get(image_url)
-    image = cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_COLOR)
-    
-    # 检查图像是否有效
-    if image is None or image.size == 0:
+    stats, thumbnail = result_cache.get_or_compute(result_key(image_key, etag, algorithm_tag(VIEW_SCALE, VIEW_REFINE)), compute)
+    if not thumbnail:
         return 0, None
-    
-    # 检查图像是否全黑或接近全黑
-    if np.mean(image) < 5:  # 可以调整这个阈值
-        return 0, Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-    
-    # 计算绿色区域和轮廓
-    green_area, contour_image, filtered_mask = calculate_green_area_and_contour(image)
-    
-    # 使用过滤后的掩码来显示主要的绿色区域
-    result_image = cv2.bitwise_and(image, image, mask=filtered_mask)
-    
-    # 在结果图像上绘制轮廓
-    cv2.drawContours(result_image, cv2.findContours(filtered_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0], -1, (0, 255, 0), 2)
-    
-    # 转换为PIL Image
-    result_image_rgb = cv2.cvtColor(result_image, cv2.COLOR_BGR2RGB)
-    pil_image = Image.fromarray(result_image_rgb)
-    
-    return green_area, pil_image
+    # 缩略图是 BGR 编码的 JPEG, PIL 解码后直接是 RGB
+    return stats['green_area'], Image.open(io.BytesIO(thumbnail))
+
+def prefetch_neighbors(filtered_images, available_times, selected_time):
+    """后台下载并分析选中时间前后的原始图片, 切换到相邻时间时不用再等待"""
+    position = available_times.index(selected_time)
+    nearby = set(available_times[max(0, position - PREFETCH_NEIGHBORS):position + PREFETCH_NEIGHBORS + 1])
+    etags = {image[0]: image[3] for image in filtered_images
+             if image[2] == 'original' and image[1].time() in nearby and image[1].time() != selected_time}
+    keys = [key for key, etag in etags.items() if result_key(key, etag, algorithm_tag(VIEW_SCALE, VIEW_REFINE)) not in result_cache]
+    image_fetcher.prefetch(keys, then=lambda key, data: process_image(key, etags[key]))
 
 
 def get_image_list(unit_number):
+    """单元的图片清单 (image_manifest.UnitManifest), 每 5 分钟最多增量刷新一次"""
     try:
-        prefix = f"images/{unit_number}/"
-        paginator = s3_client.get_paginator('list_objects_v2')
-        pages = paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix=prefix)
-        
-        image_list = []
-        for page in pages:
-            for item in page.get('Contents', []):
-                key = item['Key']
-                if key.lower().endswith(('.png', '.jpg', '.jpeg')):
-                    filename = key.split('/')[-1]
-                    if filename.startswith('img') or filename.startswith('img_dst'):
-                        date = extract_date_from_filename(key)
-                        if date:
-                            image_type = 'original' if filename.startswith('img') and not filename.startswith('img_dst') else 'processed'
-                            image_list.append((key, date, image_type))
-        
-        # 根据日期时间排序，最新的在前
-        return sorted(image_list, key=lambda x: x[1], reverse=True)
+        return image_cache.get(('manifest', unit_number),
+                               lambda: load_manifest(s3_client, S3_BUCKET_NAME, unit_number))
     except ClientError as e:
         st.error(f"获取图片列表时出错: {str(e)}")
-        return []
+        return UnitManifest(unit_number)
 
 
 
-def process_images_and_store_data(image_list):
-    data = []
-    for image_key, image_date, image_type in image_list:
-        if image_type == 'original':  # Only process original images
-            image_url = s3_client.generate_presigned_url('get_object',
-                                                         Params={'Bucket': S3_BUCKET_NAME,
-                                                                 'Key': image_key},
-                                                         ExpiresIn=3600)
-            green_area = calculate_green_area(image_url)
-            data.append((image_date, green_area))
-    return data
+def process_images_and_store_data(unit_number, image_list, progress=None):
+    """
+    计算单元所有原始图片的叶面积 (进程池并行, 已有结果的跳过),
+    返回 ([(拍摄时间, 绿叶面积), ...], 读取失败的图片数)
+    """
+    images = [(unit_number, f"{S3_BUCKET_NAME}/{image_key}", image_date)
+              for image_key, image_date, image_type, _ in image_list if image_type == 'original']
+    table, failed = run_batch(image_fs, images, image_fs, LEAF_AREA_PATH, progress=progress, scale=TREND_SCALE)
+    image_cache.invalidate(('leaf_area', unit_number))
+    history = unit_history(table, unit_number)
+    return list(zip(history.index, history['green_area'])), len(failed)
+
+def load_leaf_area_data(unit_number):
+    """已经计算好的叶面积, 不触发新的计算"""
+    def load():
+        history = unit_history(load_table(image_fs, LEAF_AREA_PATH), unit_number)
+        return list(zip(history.index, history['green_area']))
+    try:
+        return image_cache.get(('leaf_area', unit_number), load)
+    except Exception as e:
+        st.error(f"读取叶面积数据时出错: {str(e)}")
+        return []
 
-import io
 def plot_leaf_area_over_time(data):
     dates = [d[0] for d in data]
     areas = [d[1] for d in data]
@@ -327,21 +260,28 @@ def image_viewer():
         st.session_state.pop('selected_date', None)
         st.session_state.pop('selected_time', None)
 
-    image_list = get_image_list(unit_number)
+    manifest = get_image_list(unit_number)
 
-    if not image_list:
+    if not len(manifest):
         st.warning(f"单元 {unit_number} 没有可用的图片。")
         return
 
-    # Process images and get leaf area data
-    #leaf_area_data = process_images_and_store_data(image_list)
-
-    # Plot leaf area over time
-    #plot_image = plot_leaf_area_over_time(leaf_area_data)
-    #st.image(plot_image, caption='Green Leaf Area Over Time')
-  
-    # 获取所有可用的日期
-    available_dates = sorted(set(image[1].date() for image in image_list), reverse=True)
+    # 叶面积随时间的变化 (结果表中没有的图片点击按钮后批量计算)
+    leaf_area_data = load_leaf_area_data(unit_number)
+    pending = manifest.count('original') - len(leaf_area_data)
+    if pending > 0 and st.button(f"计算叶面积 ({pending} 张新图片)"):
+        bar = st.progress(0.0)
+        leaf_area_data, failed = process_images_and_store_data(
+            unit_number, manifest.images(), progress=lambda done, total: bar.progress(done / total))
+        bar.empty()
+        if failed:
+            st.warning(f"{failed} 张图片读取失败, 没有计入叶面积, 再次点击按钮会重试。")
+    if leaf_area_data:
+        plot_image = plot_leaf_area_over_time(leaf_area_data)
+        st.image(plot_image, caption='Green Leaf Area Over Time')
+
+    # 获取所有可用的日期 (清单按时间排序, 日期和时间都用二分查找取出)
+    available_dates = manifest.dates()
 
     # 使用会话状态来记住选择的日期，但确保它仍然有效
     if 'selected_date' not in st.session_state or st.session_state.selected_date not in available_dates:
@@ -356,14 +296,14 @@ def image_viewer():
         st.session_state.pop('selected_time', None)
 
     # 筛选选定日期的图片
-    filtered_images = [img for img in image_list if img[1].date() == selected_date]
+    filtered_images = manifest.on_date(selected_date)
 
     if not filtered_images:
         st.warning(f"在 {selected_date} 没有可用的图片。")
         return
 
     # 获取选定日期的所有可用时间
-    available_times = sorted(set(image[1].time() for image in filtered_images), reverse=True)
+    available_times = list(dict.fromkeys(image[1].time() for image in filtered_images))
 
     # 使用会话状态来记住选择的时间，但确保它仍然有效
     if 'selected_time' not in st.session_state or st.session_state.selected_time not in available_times:
@@ -378,28 +318,31 @@ def image_viewer():
     st.session_state.selected_time = selected_time
 
     # 找到匹配的图片
-    matching_images = [img for img in filtered_images if img[1].time() == selected_time]
+    matching_images = manifest.at(datetime.combine(selected_date, selected_time))
 
     if matching_images:
         col1, col2 = st.columns(2)
         for img in matching_images:
-            image_key, image_date, image_type = img
-            image_url = s3_client.generate_presigned_url('get_object',
-                                                         Params={'Bucket': S3_BUCKET_NAME,
-                                                                 'Key': image_key},
-                                                         ExpiresIn=3600)
+            image_key, image_date, image_type, etag = img
             if image_type == 'original':
                 with col1:
-                    st.image(image_url)
+                    st.image(image_fetcher.fetch(image_key))
                     st.write(f"原始图片: {image_date}")
                 
-                green_area, processed_image = process_image(image_url)
+                green_area, processed_image = process_image(image_key, etag)
                 
                 with col2:
                     st.image(processed_image)
                     st.write(f"处理后图片 (绿色轮廓): {image_date}")
                 
                 st.write(f"绿叶面积: {green_area} 像素")
+        prefetch_neighbors(filtered_images, available_times, selected_time)
     else:
         st.warning("未找到匹配的图片。")
 
+    fetch_stats = image_fetcher.latency_stats()
+    if fetch_stats['fetches']:
+        st.caption(f"图片下载: 最近 {fetch_stats['fetches']} 次中位数 {fetch_stats['p50_ms']:.0f} ms, "
+                   f"P95 {fetch_stats['p95_ms']:.0f} ms; 内存命中 {fetch_stats['hits']} 次, "
+                   f"已缓存 {fetch_stats['cached']} 张")
+